@@ -0,0 +1,282 @@
+"""
+Benchmarks of the `RailFlow.generate` hot path against the fake engine (no network).
+
+Every config of `config/` with rails is loaded and run through `RailFlow.generate_rails` over
+synthetic corpora, for every combination of image size and corpus size. The cost of each
+stage is measured per call:
+
+    yaml_load      RailFlowConfig.from_yaml
+    compile        compile_flows / _compile_rails (plan compilation and param overlay)
+    preprocess     per-task image preprocessing (resize/re-encode, cached on disk)
+    render         Jinja rendering of the prompts
+    encode_image   image reading and base64 encoding
+    serialize      JSON serialization of the request, as done by the HTTP client
+    engine         the engine call (fake latency, response building and wrapper)
+    function       function tasks
+
+Results are written as JSON so runs of two commits can be diffed, e.g.
+
+    python benchmarks/bench_generate.py --image-sizes 512 2048 --corpus-sizes 10 100
+    python benchmarks/bench_generate.py --output benchmarks/results/baseline.json
+
+Run from the repository root; `src` is added to the import path.
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+from collections import defaultdict
+from contextlib import contextmanager
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / 'src'))
+
+from PIL import Image
+
+import railflow.base.flow as flow_module
+from railflow import RailFlow, RailFlowConfig, TaskType
+from railflow.base.template import render_template
+from inference_engine.fake import FakeEngine, constant_latency, lognormal_latency
+from utils.image_process import encoded_image_cache
+
+
+# Satisfies the output parsers of the sample configs (e.g. `match_and_parse_plain_text`)
+DEFAULT_RESPONSE = 'Here is the result:\n```json\n{"messages": [{"role": "user", "content": "Q"}, {"role": "assistant", "content": "A"}]}\n```\n'
+
+
+class StageTimer:
+    """Collects the durations of every stage, in seconds."""
+
+    def __init__(self):
+        self.durations = defaultdict(list)
+
+    @contextmanager
+    def measure(self, stage:str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.durations[stage].append(time.perf_counter() - start)
+
+    def wrap(self, stage:str, function):
+        def timed(*args, **kwargs):
+            with self.measure(stage):
+                return function(*args, **kwargs)
+        return timed
+
+    def total(self, stage:str) -> float:
+        return sum(self.durations.get(stage, ()))
+
+    def summary(self) -> dict:
+        return {stage: summarize(durations) for stage, durations in sorted(self.durations.items())}
+
+
+def summarize(durations:list) -> dict:
+    """Count, total and percentiles of `durations`, in microseconds."""
+    ordered = sorted(durations)
+    percentile = lambda q: ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1e6
+    return {
+        'count': len(ordered),
+        'total_us': sum(ordered) * 1e6,
+        'mean_us': statistics.fmean(ordered) * 1e6,
+        'p50_us': percentile(0.50),
+        'p95_us': percentile(0.95),
+        'p99_us': percentile(0.99),
+        'max_us': ordered[-1] * 1e6,
+    }
+
+
+@contextmanager
+def instrumented(timer:StageTimer):
+    """Times the stages of `railflow.base.flow` in place, restoring them afterwards."""
+    patched = {
+        'compile_flows': 'compile',
+        '_compile_rails': 'compile',
+        'render_template': 'render',
+        'encode_image': 'encode_image',
+        'preprocess_image': 'preprocess',
+    }
+    originals = {name: getattr(flow_module, name) for name in patched}
+    execute_function_task = RailFlow.execute_function_task
+    try:
+        for name, stage in patched.items():
+            setattr(flow_module, name, timer.wrap(stage, originals[name]))
+        RailFlow.execute_function_task = timer.wrap('function', execute_function_task)
+        yield
+    finally:
+        for name, original in originals.items():
+            setattr(flow_module, name, original)
+        RailFlow.execute_function_task = execute_function_task
+
+
+def make_engine(config:RailFlowConfig, timer:StageTimer, latency) -> FakeEngine:
+    """A fake engine answering every condition with the first label of its flow."""
+    responses = {}
+    plan = config.rails.compile()
+    for rail in (plan.input, plan.output):
+        for flow in rail or ():
+            condition = flow.condition
+            if condition is not None and condition.type == TaskType.prompt:
+                prompt = render_template(condition.task, dict(condition.params))
+                responses.setdefault(prompt, next(iter(flow.actions.keys())))
+
+    engine = FakeEngine(responses, default_response=DEFAULT_RESPONSE, latency=latency, model='bench')
+    create = engine.chat.completions.create
+
+    def timed_create(**params):
+        with timer.measure('serialize'):
+            json.dumps(params)
+        with timer.measure('engine'):
+            return create(**params)
+
+    engine.chat.completions.create = timed_create
+    return engine
+
+
+def make_corpus(directory:Path, image_size:int, corpus_size:int, seed:int=0) -> list:
+    """Writes `corpus_size` distinct JPEG images of `image_size` x 3/4 `image_size` pixels."""
+    rng = random.Random(seed)
+    width, height = image_size, image_size * 3 // 4
+    paths = []
+    for index in range(corpus_size):
+        # Mostly white page with noisy blocks, close to a scanned document in size
+        image = Image.new('L', (width, height), 255)
+        for _ in range(24):
+            w, h = rng.randint(width // 16, width // 3), rng.randint(8, height // 12)
+            x, y = rng.randint(0, width - w), rng.randint(0, height - h)
+            image.paste(Image.effect_noise((w, h), rng.randint(32, 96)), (x, y))
+        path = directory / f'image-{image_size}-{index:05d}.jpg'
+        image.convert('RGB').save(path, quality=85)
+        paths.append(str(path))
+    return paths
+
+
+def bench_load(config_path:Path, repeat:int) -> dict:
+    timer = StageTimer()
+    for _ in range(repeat):
+        with timer.measure('yaml_load'):
+            config = RailFlowConfig.from_yaml(str(config_path))
+        with timer.measure('compile'):
+            config.rails.compile()
+    return timer.summary()
+
+
+def bench_generate(config_path:Path, image_paths:list, latency, passes:int) -> dict:
+    """Runs every image through `generate_rails`; the first pass encodes images cold."""
+    config = RailFlowConfig.from_yaml(str(config_path))
+    timer = StageTimer()
+    rail_flow = RailFlow(make_engine(config, timer, latency))
+    encoded_image_cache.clear()
+
+    failures = 0
+    with instrumented(timer):
+        start = time.perf_counter()
+        for _ in range(passes):
+            for image_path in image_paths:
+                with timer.measure('generate'):
+                    try:
+                        rail_flow.generate_rails(config.rails, image_path=image_path)
+                    except Exception:
+                        failures += 1
+        wall = time.perf_counter() - start
+
+    requests = len(timer.durations['engine'])
+    generations = len(image_paths) * passes
+    return {
+        'images': generations,
+        'failures': failures,
+        'requests': requests,
+        'wall_s': wall,
+        'images_per_s': generations / wall,
+        'requests_per_s': requests / wall,
+        'overhead_per_image_us': (wall - timer.total('engine')) / generations * 1e6,
+        'overhead_per_request_us': (wall - timer.total('engine')) / requests * 1e6 if requests else None,
+        'stages': timer.summary(),
+    }
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return 'unknown'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split('\n\n')[0])
+    parser.add_argument('--configs', nargs='*', type=Path, default=sorted((ROOT / 'config').glob('*.yml')))
+    parser.add_argument('--image-sizes', nargs='+', type=int, default=[512, 1024, 2048], help='Long edge, in pixels.')
+    parser.add_argument('--corpus-sizes', nargs='+', type=int, default=[10, 100])
+    parser.add_argument('--passes', type=int, default=2, help='Passes over each corpus; later passes hit the encoding cache.')
+    parser.add_argument('--load-repeat', type=int, default=20)
+    parser.add_argument('--latency', type=float, default=0.0, help='Median fake engine latency, in seconds.')
+    parser.add_argument('--latency-p99', type=float, default=None, help='p99 fake engine latency, lognormal if set.')
+    parser.add_argument('--output', type=Path, default=None, help='Defaults to benchmarks/results/<commit>.json.')
+    args = parser.parse_args(argv)
+
+    latency = (
+        lognormal_latency(args.latency, args.latency_p99) if args.latency_p99
+        else constant_latency(args.latency)
+    )
+    commit = git_commit()
+    report = {
+        'meta': {
+            'commit': commit,
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpu_count': os.cpu_count(),
+            'args': {key: [str(v) for v in value] if isinstance(value, list) else str(value) if isinstance(value, Path) else value
+                     for key, value in vars(args).items()},
+        },
+        'configs': {},
+    }
+
+    with tempfile.TemporaryDirectory(prefix='railflow-bench-') as directory:
+        corpora = {
+            (image_size, corpus_size): make_corpus(Path(directory), image_size, corpus_size)
+            for image_size in args.image_sizes
+            for corpus_size in args.corpus_sizes
+        }
+
+        for config_path in args.configs:
+            config = RailFlowConfig.from_yaml(str(config_path))
+            if not config.rails:
+                report['configs'][config_path.name] = {'skipped': 'no rails'}
+                print(f'{config_path.name}: skipped (no rails)')
+                continue
+
+            result = report['configs'][config_path.name] = {
+                'load': bench_load(config_path, args.load_repeat),
+                'runs': [],
+            }
+            for (image_size, corpus_size), image_paths in corpora.items():
+                run = bench_generate(config_path, image_paths, latency, args.passes)
+                result['runs'].append({'image_size': image_size, 'corpus_size': corpus_size, **run})
+                stages = run['stages']
+                print(
+                    f"{config_path.name} size={image_size} corpus={corpus_size}: "
+                    f"{run['requests_per_s']:.0f} req/s, overhead {run['overhead_per_request_us'] or 0:.0f} us/req "
+                    f"(render {stages.get('render', {}).get('p50_us', 0):.0f}, "
+                    f"encode {stages.get('encode_image', {}).get('p50_us', 0):.0f}, "
+                    f"serialize {stages.get('serialize', {}).get('p50_us', 0):.0f} us p50)"
+                    + (f", {run['failures']} failures" if run['failures'] else '')
+                )
+
+    output = args.output or ROOT / 'benchmarks' / 'results' / f'{commit}.json'
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f'Results written to {output}')
+
+
+if __name__ == '__main__':
+    main()
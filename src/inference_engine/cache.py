@@ -0,0 +1,140 @@
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Literal, Union
+
+
+CacheMode = Literal['off', 'read_write', 'read_only', 'refresh']
+
+
+class ResponseCache:
+    """
+    A persistent SQLite cache of chat completion responses, keyed by a request fingerprint.
+
+    The fingerprint is a SHA-256 over the model, the messages and every other generation
+    parameter. Inline images (base64 data URLs) are replaced by the hash of their content, so
+    the key stays small and identical images hit regardless of how they were referenced.
+
+    Modes:
+        - 'read_write': serve hits from the cache, store misses (default).
+        - 'read_only': serve hits from the cache, never write to it.
+        - 'refresh': always call the API and overwrite the cached response.
+        - 'off': bypass the cache entirely.
+
+    Args:
+        path (str | Path): Path of the SQLite database file.
+        mode (CacheMode): One of the modes above.
+        max_bytes (int): Maximum total size of cached responses. The least recently used
+            entries are evicted once it is exceeded.
+    """
+
+    def __init__(
+        self,
+        path:Union[str, Path]='.cache/railflow/responses.sqlite',
+        mode:CacheMode='read_write',
+        max_bytes:int=1024 * 1024 * 1024,
+    ):
+        if mode not in CacheMode.__args__:
+            raise ValueError(f"Invalid cache mode: {mode}. Expected in {CacheMode.__args__}.")
+
+        self.path = Path(path)
+        self.mode = mode
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS responses_accessed_at ON responses (accessed_at)")
+        self._size = self._connection.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+
+    @property
+    def readable(self) -> bool:
+        return self.mode in ('read_write', 'read_only')
+
+    @property
+    def writable(self) -> bool:
+        return self.mode in ('read_write', 'refresh')
+
+    @staticmethod
+    def _strip_images(value):
+        """Replaces inline data URLs by the hash of their content."""
+        if isinstance(value, str) and value.startswith('data:') and ';base64,' in value[:64]:
+            return 'sha256:' + hashlib.sha256(value.encode('utf-8')).hexdigest()
+        if isinstance(value, dict):
+            return {k: ResponseCache._strip_images(v) for k, v in value.items()}
+        if isinstance(value, (list, tuple)):
+            return [ResponseCache._strip_images(v) for v in value]
+        return value
+
+    @staticmethod
+    def fingerprint(params:dict) -> str:
+        """Returns the stable cache key of a chat completion request.
+
+        Args:
+            params (dict): The full keyword arguments of `chat.completions.create`.
+        """
+        payload = json.dumps(ResponseCache._strip_images(params), sort_keys=True, ensure_ascii=False, default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+    def get(self, key:str):
+        """Returns the cached response for `key` or None."""
+        with self._lock:
+            row = self._connection.execute("SELECT response FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.misses += 1
+                return None
+            self._connection.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (time.time(), key))
+            self.hits += 1
+
+        from openai.types.chat import ChatCompletion
+        return ChatCompletion.model_validate_json(row[0])
+
+    def put(self, key:str, response):
+        """Stores `response` under `key`, evicting least recently used entries if needed."""
+        data = response.model_dump_json()
+        with self._lock:
+            previous = self._connection.execute("SELECT size FROM responses WHERE key = ?", (key,)).fetchone()
+            self._connection.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, accessed_at) VALUES (?, ?, ?, ?)",
+                (key, data, len(data), time.time()),
+            )
+            self._size += len(data) - (previous[0] if previous else 0)
+            if self._size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        # Drop the oldest entries down to 90% of the cap, so eviction doesn't run on every put
+        target = self.max_bytes * 0.9
+        rows = self._connection.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+        evicted = []
+        for key, size in rows:
+            if self._size <= target:
+                break
+            evicted.append((key,))
+            self._size -= size
+        self._connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+
+    def cache_info(self) -> dict:
+        with self._lock:
+            entries = self._connection.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+            return {
+                'mode': self.mode,
+                'hits': self.hits,
+                'misses': self.misses,
+                'entries': entries,
+                'currsize': self._size,
+                'max_bytes': self.max_bytes,
+            }
+
+    def close(self):
+        self._connection.close()
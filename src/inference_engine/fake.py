@@ -0,0 +1,305 @@
+import re
+import json
+import math
+import time
+import random
+import asyncio
+import itertools
+import threading
+from typing import Callable, Dict, List, Union
+
+import httpx
+from openai import InternalServerError, RateLimitError
+from openai.types.chat import ChatCompletion, ChatCompletionMessage
+from openai.types.chat.chat_completion import Choice
+from openai.types.completion_usage import CompletionUsage, PromptTokensDetails
+
+from .cache import ResponseCache
+from .generic import GenericOpenAIWrapper
+from .limiter import RateLimiter, estimate_tokens
+
+
+Latency = Callable[[random.Random], float]
+ScriptedResponse = Union[str, List[str], Callable[[dict], str]]
+
+
+def constant_latency(seconds:float) -> Latency:
+    return lambda rng: seconds
+
+
+def uniform_latency(low:float, high:float) -> Latency:
+    return lambda rng: rng.uniform(low, high)
+
+
+def lognormal_latency(median:float, p99:float) -> Latency:
+    """A long-tailed latency distribution given its median and 99th percentile, in seconds."""
+    mu = math.log(median)
+    sigma = (math.log(p99) - mu) / 2.326
+    return lambda rng: rng.lognormvariate(mu, sigma)
+
+
+def empirical_latency(samples:List[float]) -> Latency:
+    """Replays latencies sampled from production, e.g. from a trace file."""
+    samples = list(samples)
+    return lambda rng: rng.choice(samples)
+
+
+def _message_text(message:dict) -> str:
+    content = message.get('content')
+    if isinstance(content, list):
+        return '\n'.join(part.get('text') or '' for part in content if part.get('type') == 'text')
+    return content or ''
+
+
+def _prompt_text(params:dict) -> str:
+    """Returns the text of the system messages and the last user message of a request."""
+    messages = params.get('messages', [])
+    texts = [_message_text(message) for message in messages if message.get('role') == 'system']
+    for message in reversed(messages):
+        if message.get('role') == 'user':
+            texts.append(_message_text(message))
+            break
+    return '\n'.join(texts)
+
+
+def _status_error(error_class:type, status_code:int, message:str, headers:dict=None):
+    request = httpx.Request('POST', 'https://fake.railflow.local/v1/chat/completions')
+    response = httpx.Response(status_code, request=request, headers=headers or {})
+    return error_class(message, response=response, body=None)
+
+
+class _FakeCompletions:
+
+    def __init__(self, client:'FakeOpenAI'):
+        self._client = client
+
+    def create(self, **params):
+        client = self._client
+        latency, error = client._next_outcome()
+        if latency:
+            time.sleep(latency)
+        if error:
+            raise error
+        return client._completion(params)
+
+
+class _AsyncFakeCompletions(_FakeCompletions):
+
+    async def create(self, **params):
+        client = self._client
+        latency, error = client._next_outcome()
+        if latency:
+            await asyncio.sleep(latency)
+        if error:
+            raise error
+        return client._completion(params)
+
+
+class FakeOpenAI:
+    """
+    A deterministic, network-free stand-in for the `OpenAI` client: `chat.completions.create`
+    returns a `ChatCompletion` after a simulated latency, or raises the same errors as the API.
+
+    Responses are scripted by prompt: the first key of `responses` found in the text of the
+    request's system messages and last user message (a substring, or a compiled regex) selects
+    the response, so a key may match a static prefix sent as a system message. A value may be
+    a string, a list of strings returned in turn, or a callable of the request params.
+
+    All randomness comes from one `random.Random(seed)`, so a run is reproducible from its
+    seed given the same call order.
+
+    Args:
+        responses (dict): Scripted responses keyed by prompt text, e.g.
+            `{'following subjects': 'Chemistry'}` for the `guess_subject` condition.
+        default_response (str): The response of prompts matching no key.
+        latency (float | Latency): Seconds per call, or a distribution such as
+            `lognormal_latency(0.8, 6.0)`.
+        error_rate (float): Probability of an HTTP 500 (`InternalServerError`).
+        rate_limit_rate (float): Probability of an HTTP 429 (`RateLimitError`); 429s are
+            returned without latency, like a gateway rejecting the request.
+        retry_after (float): `Retry-After` header of the 429 responses, in seconds.
+        seed (int): Seed of the random generator.
+        prefix_cache (bool): Simulates provider prompt caching: a request whose leading
+            system messages were already sent reports their tokens as `cached_tokens`.
+    """
+
+    _completions_class = _FakeCompletions
+
+    def __init__(
+        self,
+        responses:Dict[Union[str, re.Pattern], ScriptedResponse]=None,
+        default_response:str='',
+        latency:Union[float, Latency]=0.0,
+        error_rate:float=0.0,
+        rate_limit_rate:float=0.0,
+        retry_after:float=None,
+        seed:int=0,
+        prefix_cache:bool=False,
+    ):
+        self.responses = responses or {}
+        self.default_response = default_response
+        self.latency = latency if callable(latency) else constant_latency(latency)
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.retry_after = retry_after
+        self.seed = seed
+        self.prefix_cache = prefix_cache
+
+        self.chat = type('Chat', (), {})()
+        self.chat.completions = self._completions_class(self)
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        """Reseeds the generator and clears the counters and scripted sequences."""
+        with self._lock:
+            self._rng = random.Random(self.seed)
+            self._sequences = {}
+            self._ids = itertools.count()
+            self.calls = 0
+            self.errors = 0
+            self.throttled = 0
+            self._prefixes = set()
+
+    def _next_outcome(self):
+        """Draws the latency and the injected error (or None) of the next call."""
+        with self._lock:
+            self.calls += 1
+            draw = self._rng.random()
+            latency = max(0.0, self.latency(self._rng))
+            if draw < self.rate_limit_rate:
+                self.throttled += 1
+                headers = {'retry-after': str(self.retry_after)} if self.retry_after is not None else None
+                return 0.0, _status_error(RateLimitError, 429, 'Rate limit reached (injected)', headers)
+            if draw < self.rate_limit_rate + self.error_rate:
+                self.errors += 1
+                return latency, _status_error(InternalServerError, 500, 'Internal server error (injected)')
+            return latency, None
+
+    def _respond(self, params:dict) -> str:
+        prompt = _prompt_text(params)
+        for key, response in self.responses.items():
+            if key.search(prompt) if isinstance(key, re.Pattern) else key in prompt:
+                break
+        else:
+            return self.default_response
+
+        if callable(response):
+            return response(params)
+        if isinstance(response, (list, tuple)):
+            with self._lock:
+                index = self._sequences[key] = self._sequences.get(key, -1) + 1
+            return response[index % len(response)]
+        return response
+
+    def _cached_tokens(self, params:dict) -> int:
+        messages = params.get('messages', [])
+        prefix = list(itertools.takewhile(lambda message: message.get('role') == 'system', messages))
+        if not self.prefix_cache or not prefix:
+            return 0
+        key = json.dumps([params.get('model'), prefix], sort_keys=True, default=str)
+        with self._lock:
+            cached = key in self._prefixes
+            self._prefixes.add(key)
+        return estimate_tokens({'messages': prefix}) if cached else 0
+
+    def _completion(self, params:dict) -> ChatCompletion:
+        contents = [self._respond(params) for _ in range(params.get('n') or 1)]
+        prompt_tokens = estimate_tokens({'messages': params.get('messages', [])})
+        completion_tokens = sum(max(1, len(content) // 4) for content in contents)
+        return ChatCompletion.model_construct(
+            id=f'chatcmpl-fake-{next(self._ids)}',
+            object='chat.completion',
+            created=int(time.time()),
+            model=params.get('model', 'fake'),
+            choices=[
+                Choice.model_construct(
+                    index=index,
+                    finish_reason='stop',
+                    logprobs=None,
+                    message=ChatCompletionMessage.model_construct(role='assistant', content=content),
+                )
+                for index, content in enumerate(contents)
+            ],
+            usage=CompletionUsage.model_construct(
+                prompt_tokens=prompt_tokens,
+                completion_tokens=completion_tokens,
+                total_tokens=prompt_tokens + completion_tokens,
+                prompt_tokens_details=PromptTokensDetails.model_construct(cached_tokens=self._cached_tokens(params)),
+                completion_tokens_details=None,
+            ),
+        )
+
+
+class AsyncFakeOpenAI(FakeOpenAI):
+    """Async counterpart of `FakeOpenAI`, the stand-in for `AsyncOpenAI`."""
+
+    _completions_class = _AsyncFakeCompletions
+
+
+class FakeEngine(GenericOpenAIWrapper):
+    """
+    A drop-in replacement of `OpenAIWrapper` backed by `FakeOpenAI`, to load-test flows and
+    measure the framework's own overhead without network.
+
+    Unlike real clients, every engine has its own fake client (random generator, counters and
+    scripted sequences), so independent engines are each deterministic; call
+    `base_client.reset()` to replay a run.
+
+    Args:
+        responses (dict): Scripted responses keyed by prompt text, see `FakeOpenAI`.
+        default_response (str): The response of prompts matching no key.
+        latency (float | Latency): Seconds per call, or a latency distribution.
+        error_rate (float): Probability of an HTTP 500.
+        rate_limit_rate (float): Probability of an HTTP 429.
+        retry_after (float): `Retry-After` of the 429 responses, in seconds.
+        seed (int): Seed of the random generator.
+        prefix_cache (bool): Simulates provider prompt caching, see `FakeOpenAI`.
+        response_cache (ResponseCache): Optional persistent cache of chat completion responses.
+        rate_limiter (RateLimiter): Optional client-side pacing and retries.
+        **chat_params (dict): Default parameters to be used for chat completions.
+    """
+
+    _base = FakeOpenAI
+
+    @staticmethod
+    def _make_client(base, http_options:dict, client_params:dict):
+        return base(**client_params)
+
+    def __init__(
+        self,
+        responses:Dict[Union[str, re.Pattern], ScriptedResponse]=None,
+        default_response:str='',
+        latency:Union[float, Latency]=0.0,
+        error_rate:float=0.0,
+        rate_limit_rate:float=0.0,
+        retry_after:float=None,
+        seed:int=0,
+        prefix_cache:bool=False,
+        response_cache:ResponseCache=None,
+        rate_limiter:RateLimiter=None,
+        **chat_params,
+    ):
+        chat_params.setdefault('model', 'fake')
+        super().__init__(
+            self._base,
+            response_cache=response_cache,
+            rate_limiter=rate_limiter,
+            client_params={
+                'responses': responses,
+                'default_response': default_response,
+                'latency': latency,
+                'error_rate': error_rate,
+                'rate_limit_rate': rate_limit_rate,
+                'retry_after': retry_after,
+                'seed': seed,
+                'prefix_cache': prefix_cache,
+            },
+            **chat_params,
+        )
+
+
+class AsyncFakeEngine(FakeEngine):
+    """Async counterpart of `FakeEngine`, a drop-in replacement of `AsyncOpenAIWrapper`."""
+
+    _base = AsyncFakeOpenAI
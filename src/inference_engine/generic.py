@@ -1,12 +1,64 @@
+import inspect
+
+from .cache import ResponseCache
+from .limiter import RateLimiter
+from .transport import get_base_client
+
+
+def _accepts(base:type, name:str) -> bool:
+    try:
+        return name in inspect.signature(base).parameters
+    except (TypeError, ValueError):
+        return False
+
+
+class _CompletionsProxy:
+    """`chat.completions` of a wrapper: `create` is the wrapper's, everything else is the client's."""
+
+    def __init__(self, completions, create):
+        self._completions = completions
+        self.create = create
+
+    def __getattr__(self, name):
+        return getattr(self._completions, name)
+
+
+class _ChatProxy:
+    """`chat` of a wrapper, see `_CompletionsProxy`."""
+
+    def __init__(self, chat, create):
+        self._chat = chat
+        self.completions = _CompletionsProxy(chat.completions, create)
+
+    def __getattr__(self, name):
+        return getattr(self._chat, name)
+
+
+def is_async_create(create) -> bool:
+    """Whether a client's `chat.completions.create` is a coroutine function; the OpenAI
+    clients wrap it in a sync-looking decorator, so the wrapped function is checked."""
+    return inspect.iscoroutinefunction(inspect.unwrap(create))
+
+
 class GenericOpenAIWrapper:
     """
     A wrapper class to extend the functionality of a given base class by customizing
     the chat completion behavior. It merges default parameters with any provided arguments
     for chat completion calls.
 
+    The base class may be either sync (e.g. OpenAI) or async (e.g. AsyncOpenAI); with an
+    async base, the wrapped `create` returns an awaitable.
+
+    Base clients and their HTTP transport are shared process-wide (see `transport`), so
+    wrappers are cheap to create and reuse the open connections of their endpoint; the
+    wrapper's `chat.completions` is a proxy, the shared client itself is never patched.
+
     Attributes:
         base_client (object): An instance of the base class provided to the wrapper.
         default_chat_params (dict): Default parameters for chat completions.
+        response_cache (ResponseCache): Optional persistent cache of chat completion responses.
+        rate_limiter (RateLimiter): Optional client-side pacing and retries, shared by every user of the wrapper.
+        chat (object): Proxy of the base client's `chat`, whose `completions.create` is `__create`.
         __original_create (function): A reference to the original `create` method of the base class.
 
     Methods:
@@ -18,31 +70,65 @@ class GenericOpenAIWrapper:
 
     Args:
         base (type): The base class to wrap (e.g., OpenAI or AzureOpenAI).
+        response_cache (ResponseCache): Optional persistent cache of chat completion responses.
+        rate_limiter (RateLimiter): Optional client-side pacing and retries. With a limiter, the
+            base class' own retries default to none (`max_retries=0`).
+        client_params (dict): Arguments of the base class, e.g. base_url, api_key, max_retries.
+        http_options (dict): Options of the shared HTTP transport, see `transport.get_http_client`.
         **chat_params (dict): Default parameters to be used for chat completions.
     """
     
-    def __init__(self, base, **chat_params):
+    def __init__(
+        self,
+        base,
+        response_cache:ResponseCache=None,
+        rate_limiter:RateLimiter=None,
+        client_params:dict=None,
+        http_options:dict=None,
+        **chat_params,
+    ):
         """
         Initializes the OpenAIWrapper with a base class and default chat parameters.
 
         Args:
             base (type): The class to wrap (e.g., OpenAI or AzureOpenAI).
+            response_cache (ResponseCache): Optional persistent cache of chat completion responses.
+            rate_limiter (RateLimiter): Optional client-side pacing and retries.
+            client_params (dict): Arguments of the base class, e.g. base_url, api_key, max_retries.
+            http_options (dict): Options of the shared HTTP transport, see `transport.get_http_client`.
             **chat_params (dict): Default parameters to be used for chat completions.
         """
-        self.base_client = base()
+        client_params = dict(client_params or {})
+        if rate_limiter and _accepts(base, 'max_retries'):
+            # The limiter retries 429s and adapts its concurrency to them, so they must reach it
+            client_params.setdefault('max_retries', 0)
+        self.base_client = self._make_client(base, http_options, client_params)
         self.default_chat_params = chat_params
+        self.response_cache = response_cache
+        self.rate_limiter = rate_limiter
         
         # Backup the original method
         self.__original_create = self.base_client.chat.completions.create
+        self.__is_async = is_async_create(self.__original_create)
         
-        # Replace the original method with the wrapped one
-        self.base_client.chat.completions.create = self.__create
+        # Expose the wrapped method through a proxy, the base client may be shared
+        self.chat = _ChatProxy(self.base_client.chat, self.__create)
+
+    @staticmethod
+    def _make_client(base, http_options:dict, client_params:dict):
+        """Returns the base client of a new wrapper, shared by wrappers of the same endpoint."""
+        return get_base_client(base, http_options, **client_params)
+
+    @property
+    def is_async(self) -> bool:
+        """Whether `chat.completions.create` returns an awaitable."""
+        return self.__is_async
 
     def __create(self, **kwargs):
         """
         Merges the default parameters with the provided ones and calls the original `create` method.
 
-        This method is used as a replacement for the original `create` method in `chat.completions`.
+        This method is exposed as `chat.completions.create` of the wrapper.
         It ensures that default parameters are always included, while additional parameters can still be passed.
 
         Args:
@@ -52,7 +138,43 @@ class GenericOpenAIWrapper:
             Response: The response from the original `create` method after completing the chat request.
         """
         merged_params = {**self.default_chat_params, **kwargs}
-        return self.__original_create(**merged_params)
+        if self.__is_async:
+            return self.__acreate(merged_params)
+
+        key = self.__cache_key(merged_params)
+        if key and self.response_cache.readable and (response := self.response_cache.get(key)) is not None:
+            return response
+
+        if self.rate_limiter:
+            response = self.rate_limiter.call(self.__original_create, merged_params)
+        else:
+            response = self.__original_create(**merged_params)
+
+        if key and self.response_cache.writable:
+            self.response_cache.put(key, response)
+        return response
+
+    async def __acreate(self, merged_params):
+        """Async counterpart of `__create`, used when the base client is async."""
+        key = self.__cache_key(merged_params)
+        if key and self.response_cache.readable and (response := self.response_cache.get(key)) is not None:
+            return response
+
+        if self.rate_limiter:
+            response = await self.rate_limiter.acall(self.__original_create, merged_params)
+        else:
+            response = await self.__original_create(**merged_params)
+
+        if key and self.response_cache.writable:
+            self.response_cache.put(key, response)
+        return response
+
+    def __cache_key(self, merged_params):
+        """Returns the response cache key of a request, or None if it must not be cached."""
+        cache = self.response_cache
+        if not cache or cache.mode == 'off' or merged_params.get('stream'):
+            return None
+        return cache.fingerprint(merged_params)
 
     def __getattr__(self, name):
         """
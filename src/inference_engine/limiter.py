@@ -0,0 +1,306 @@
+import math
+import time
+import random
+import asyncio
+import threading
+from collections import deque
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+# Called like `RateLimiter.on_retry` for the retries of any limiter within the current
+# thread/task, e.g. set by `Tracer` to count them on its current span
+retry_listener: ContextVar[Callable[[Exception, int, float], None]] = ContextVar('inference_engine_retry_listener', default=None)
+
+
+class TokenBucket:
+    """
+    A thread-safe token bucket refilled continuously at `rate_per_minute`.
+
+    `reserve` takes tokens immediately (the balance may go negative) and returns how long the
+    caller must wait before using them, so waiting callers are served in arrival order.
+
+    Args:
+        rate_per_minute (float): Refill rate, e.g. the requests/min or tokens/min limit.
+        capacity (float): Maximum burst size, defaults to one minute worth of tokens.
+    """
+
+    def __init__(self, rate_per_minute:float, capacity:float=None):
+        self.rate = rate_per_minute / 60.0
+        self.capacity = capacity or rate_per_minute
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def reserve(self, amount:float=1) -> float:
+        """Takes `amount` tokens and returns the number of seconds to wait before using them."""
+        with self._lock:
+            now = time.monotonic()
+            self._tokens = min(self.capacity, self._tokens + (now - self._updated_at) * self.rate)
+            self._updated_at = now
+            # A request larger than the whole bucket waits for a full bucket instead of forever
+            self._tokens -= min(amount, self.capacity)
+            return max(0.0, -self._tokens / self.rate)
+
+
+class AdaptiveConcurrency:
+    """
+    An AIMD (additive-increase, multiplicative-decrease) concurrency limit usable from both
+    threads and event loops.
+
+    Every success raises the limit by `increase / limit` (about +`increase` per window of
+    requests); an overload signal (e.g. HTTP 429) multiplies it by `decrease_factor`, at most
+    once per `decrease_interval` seconds so that a burst of 429s counts as one signal.
+
+    Args:
+        initial (int): Initial limit.
+        minimum (int): Lowest limit.
+        maximum (int): Highest limit.
+        increase (float): Additive increase per window of successful requests.
+        decrease_factor (float): Multiplicative decrease applied on overload.
+        decrease_interval (float): Minimum number of seconds between two decreases.
+    """
+
+    def __init__(
+        self,
+        initial:int=16,
+        minimum:int=1,
+        maximum:int=256,
+        increase:float=1.0,
+        decrease_factor:float=0.5,
+        decrease_interval:float=1.0,
+    ):
+        self.limit = float(initial)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.increase = increase
+        self.decrease_factor = decrease_factor
+        self.decrease_interval = decrease_interval
+
+        self.in_flight = 0
+        self._last_decrease = 0.0
+        self._waiters = deque()
+        self._lock = threading.Lock()
+
+    def _wake(self):
+        # Must be called with the lock held; wakes as many waiters as there are free slots
+        for _ in range(max(int(self.limit) - self.in_flight, 0)):
+            if not self._waiters:
+                return
+            waiter = self._waiters.popleft()
+            if isinstance(waiter, threading.Event):
+                waiter.set()
+            else:
+                loop, future = waiter
+                loop.call_soon_threadsafe(lambda f=future: f.done() or f.set_result(None))
+
+    def acquire(self):
+        while True:
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                event = threading.Event()
+                self._waiters.append(event)
+            event.wait()
+
+    async def aacquire(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._lock:
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                waiter = (loop, loop.create_future())
+                self._waiters.append(waiter)
+            try:
+                await waiter[1]
+            except asyncio.CancelledError:
+                with self._lock:
+                    if waiter in self._waiters:
+                        self._waiters.remove(waiter)
+                    else:
+                        # Already woken, pass the wake-up on to the next waiter
+                        self._wake()
+                raise
+
+    def release(self):
+        with self._lock:
+            self.in_flight -= 1
+            self._wake()
+
+    def on_success(self):
+        with self._lock:
+            self.limit = min(self.maximum, self.limit + self.increase / self.limit)
+            self._wake()
+
+    def on_overload(self):
+        with self._lock:
+            now = time.monotonic()
+            if now - self._last_decrease >= self.decrease_interval:
+                self.limit = max(self.minimum, self.limit * self.decrease_factor)
+                self._last_decrease = now
+
+
+def estimate_tokens(params:dict) -> int:
+    """Roughly estimates the tokens a chat completion request counts against a tokens/min limit.
+
+    Text is counted as ~4 characters per token; images from the size of their data URL
+    (about one 512px tile per 200 KB, capped at the high-detail maximum); the completion
+    budget (`max_tokens`/`max_completion_tokens`) is added since providers reserve it too.
+    """
+    text_chars = 0
+    image_tokens = 0
+    for message in params.get('messages', []):
+        content = message.get('content')
+        parts = content if isinstance(content, list) else [{'type': 'text', 'text': content or ''}]
+        for part in parts:
+            if part.get('type') == 'text':
+                text_chars += len(part.get('text') or '')
+            elif part.get('type') == 'image_url':
+                image_bytes = len(part['image_url'].get('url', '')) * 3 // 4
+                image_tokens += min(85 + 170 * math.ceil(image_bytes / 200_000), 1105)
+
+    completion_tokens = params.get('max_completion_tokens') or params.get('max_tokens') or 0
+    return text_chars // 4 + image_tokens + completion_tokens * params.get('n', 1)
+
+
+def _status_code(error:Exception) -> Optional[int]:
+    status_code = getattr(error, 'status_code', None)
+    if status_code is None and (response := getattr(error, 'response', None)) is not None:
+        status_code = getattr(response, 'status_code', None)
+    return status_code
+
+
+def _retry_after(error:Exception) -> Optional[float]:
+    """Returns the server-requested delay (Retry-After / retry-after-ms headers) in seconds."""
+    headers = getattr(getattr(error, 'response', None), 'headers', None)
+    if not headers:
+        return None
+    try:
+        if (value := headers.get('retry-after-ms')) is not None:
+            return float(value) / 1000
+        if (value := headers.get('retry-after')) is not None:
+            return float(value)
+    except (TypeError, ValueError):
+        pass
+    return None
+
+
+def is_retryable(error:Exception) -> bool:
+    if _status_code(error) in RETRYABLE_STATUS_CODES:
+        return True
+    # Connection/timeout errors carry no status code (e.g. openai.APIConnectionError)
+    return isinstance(error, (ConnectionError, TimeoutError)) or type(error).__name__ in (
+        'APIConnectionError', 'APITimeoutError',
+    )
+
+
+class RateLimiter:
+    """
+    Client-side pacing for chat completion calls: requests/min and tokens/min token buckets,
+    AIMD adaptive concurrency, and retries with jittered exponential backoff that honor
+    `Retry-After`.
+
+    One instance holds the limiter state, so every wrapper (and every `RailFlow`) it is given to
+    shares the same budget. The wrapped client must not retry 429s itself, so wrappers given a
+    limiter build their client with `max_retries=0` unless `client_params` says otherwise.
+
+    Args:
+        requests_per_minute (float): Requests/min limit, None for no limit.
+        tokens_per_minute (float): Tokens/min limit, None for no limit.
+        concurrency (AdaptiveConcurrency): The concurrency limit, defaults to a new one.
+        max_retries (int): Maximum number of retries of a retryable error.
+        base_delay (float): Backoff base in seconds.
+        max_delay (float): Backoff cap in seconds.
+        token_estimator (Callable): Estimates the tokens of a request from its params.
+        on_retry (Callable): Called as `on_retry(error, attempt, delay)` before each retry, in
+            the caller's thread/task. `retry_listener` is called as well.
+    """
+
+    def __init__(
+        self,
+        requests_per_minute:float=None,
+        tokens_per_minute:float=None,
+        concurrency:AdaptiveConcurrency=None,
+        max_retries:int=6,
+        base_delay:float=1.0,
+        max_delay:float=60.0,
+        token_estimator:Callable[[dict], int]=estimate_tokens,
+        on_retry:Callable[[Exception, int, float], None]=None,
+    ):
+        self.request_bucket = TokenBucket(requests_per_minute) if requests_per_minute else None
+        self.token_bucket = TokenBucket(tokens_per_minute) if tokens_per_minute else None
+        self.concurrency = concurrency or AdaptiveConcurrency()
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.token_estimator = token_estimator
+        self.on_retry = on_retry
+        self.retries = 0
+        self.throttled = 0
+
+    def _pacing_delay(self, params:dict) -> float:
+        delay = 0.0
+        if self.request_bucket:
+            delay = max(delay, self.request_bucket.reserve(1))
+        if self.token_bucket:
+            delay = max(delay, self.token_bucket.reserve(self.token_estimator(params)))
+        return delay
+
+    def _backoff(self, error:Exception, attempt:int) -> Optional[float]:
+        """Returns the delay before retrying `error`, or None if it must be raised."""
+        if attempt >= self.max_retries or not is_retryable(error):
+            return None
+        self.retries += 1
+        if _status_code(error) == 429:
+            self.throttled += 1
+            self.concurrency.on_overload()
+
+        # Full jitter, but never earlier than the server asked for
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        if (retry_after := _retry_after(error)) is not None:
+            delay = max(delay, min(retry_after, self.max_delay))
+        if self.on_retry:
+            self.on_retry(error, attempt, delay)
+        if listener := retry_listener.get():
+            listener(error, attempt, delay)
+        return delay
+
+    def call(self, create:Callable, params:dict):
+        """Calls `create(**params)` within the limits, retrying retryable errors."""
+        for attempt in range(self.max_retries + 1):
+            self.concurrency.acquire()
+            try:
+                if delay := self._pacing_delay(params):
+                    time.sleep(delay)
+                response = create(**params)
+            except Exception as e:
+                if (delay := self._backoff(e, attempt)) is None:
+                    raise
+            else:
+                self.concurrency.on_success()
+                return response
+            finally:
+                self.concurrency.release()
+            time.sleep(delay)
+
+    async def acall(self, create:Callable, params:dict):
+        """Async counterpart of `call`."""
+        for attempt in range(self.max_retries + 1):
+            await self.concurrency.aacquire()
+            try:
+                if delay := self._pacing_delay(params):
+                    await asyncio.sleep(delay)
+                response = await create(**params)
+            except Exception as e:
+                if (delay := self._backoff(e, attempt)) is None:
+                    raise
+            else:
+                self.concurrency.on_success()
+                return response
+            finally:
+                self.concurrency.release()
+            await asyncio.sleep(delay)
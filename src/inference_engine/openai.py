@@ -1,6 +1,8 @@
-from openai import OpenAI
+from openai import AsyncOpenAI, OpenAI
 
+from .cache import ResponseCache
 from .generic import GenericOpenAIWrapper
+from .limiter import RateLimiter
 
 
 class OpenAIWrapper(GenericOpenAIWrapper):
@@ -27,14 +29,72 @@ class OpenAIWrapper(GenericOpenAIWrapper):
         **chat_params (dict): Default parameters to be used for chat completions.
     """
 
-    def __init__(self, **chat_params):
+    def __init__(
+        self,
+        response_cache:ResponseCache=None,
+        rate_limiter:RateLimiter=None,
+        client_params:dict=None,
+        http_options:dict=None,
+        **chat_params,
+    ):
         """
         Initializes the WrapperForOpenAI with default chat parameters.
 
         Args:
+            response_cache (ResponseCache): Optional persistent cache of chat completion responses.
+            rate_limiter (RateLimiter): Optional client-side pacing and retries.
+            client_params (dict): Arguments of the client, e.g. base_url, api_key, max_retries.
+            http_options (dict): Options of the shared HTTP transport, see `transport.get_http_client`.
             **chat_params (dict): Default parameters to be used for chat completions.
         """
-        super().__init__(OpenAI, **chat_params)
+        super().__init__(
+            OpenAI,
+            response_cache=response_cache,
+            rate_limiter=rate_limiter,
+            client_params=client_params,
+            http_options=http_options,
+            **chat_params,
+        )
+
+
+class AsyncOpenAIWrapper(GenericOpenAIWrapper):
+    """
+    Async counterpart of `OpenAIWrapper`, built on `AsyncOpenAI`.
+
+    `chat.completions.create` returns an awaitable, so the wrapper can be used with
+    `RailFlow.agenerate` and `RailFlow.generate_batch` to keep many requests in flight
+    from a single process.
+
+    Args:
+        **chat_params (dict): Default parameters to be used for chat completions.
+    """
+
+    def __init__(
+        self,
+        response_cache:ResponseCache=None,
+        rate_limiter:RateLimiter=None,
+        client_params:dict=None,
+        http_options:dict=None,
+        **chat_params,
+    ):
+        """
+        Initializes the AsyncOpenAIWrapper with default chat parameters.
+
+        Args:
+            response_cache (ResponseCache): Optional persistent cache of chat completion responses.
+            rate_limiter (RateLimiter): Optional client-side pacing and retries.
+            client_params (dict): Arguments of the client, e.g. base_url, api_key, max_retries.
+            http_options (dict): Options of the shared HTTP transport, see `transport.get_http_client`.
+            **chat_params (dict): Default parameters to be used for chat completions.
+        """
+        super().__init__(
+            AsyncOpenAI,
+            response_cache=response_cache,
+            rate_limiter=rate_limiter,
+            client_params=client_params,
+            http_options=http_options,
+            **chat_params,
+        )
 
 
 # class OpenAIWrapper(OpenAI):
@@ -0,0 +1,197 @@
+import time
+import asyncio
+import itertools
+import threading
+from typing import Iterable, List
+
+from .generic import is_async_create
+from .limiter import _status_code, is_retryable
+
+
+def _is_async(engine) -> bool:
+    is_async = getattr(engine, 'is_async', None)
+    return is_async if is_async is not None else is_async_create(engine.chat.completions.create)
+
+
+def _is_unhealthy(error:Exception) -> bool:
+    """Whether `error` points at the endpoint (5xx, timeout, connection) rather than at the
+    request or at a rate limit."""
+    return is_retryable(error) and _status_code(error) != 429
+
+
+class _Endpoint:
+
+    def __init__(self, index:int, engine, fallback:bool):
+        self.index = index
+        self.engine = engine
+        self.fallback = fallback
+        self.outstanding = 0
+        self.failures = 0
+        self.ejections = 0
+        self.ejected_until = 0.0
+        self.requests = 0
+        self.errors = 0
+
+
+class _PoolCompletions:
+
+    def __init__(self, pool:'EnginePool'):
+        self._pool = pool
+
+    def create(self, **params):
+        if self._pool.is_async:
+            return self._pool._acreate(params)
+        return self._pool._create(params)
+
+
+class EnginePool:
+    """
+    Spreads chat completions over several engines, e.g. replicas of a self-hosted vLLM model,
+    with a hosted API as fallback. A drop-in engine for `RailFlow`.
+
+    Each request goes to the healthy replica with the fewest outstanding requests (ties
+    rotate), so a replica slowed down by long generations receives fewer new requests. A
+    retryable error is retried on another endpoint. Endpoints failing `failure_threshold`
+    times in a row (5xx, timeouts, connection errors; 429s only move the request) are ejected
+    for `ejection_seconds`, doubled on each consecutive ejection up to `max_ejection_seconds`,
+    then receive traffic again. Fallbacks are only used while every replica is ejected or
+    already tried by the request.
+
+    Engines may have their own `RateLimiter`; keep its `max_retries` low so that errors reach
+    the pool and get retried on another endpoint instead of the failing one.
+
+    Args:
+        engines: The replicas, e.g. `OpenAIWrapper(client_params={'base_url': ...})` per server;
+            all sync or all async, like the fallbacks.
+        fallbacks: Engines used only when no replica can take the request.
+        max_attempts (int): Number of endpoints a request is tried on before its error is
+            raised, defaults to every endpoint.
+        failure_threshold (int): Consecutive failures that eject an endpoint.
+        ejection_seconds (float): Duration of a first ejection.
+        max_ejection_seconds (float): Maximum duration of an ejection.
+    """
+
+    def __init__(
+        self,
+        engines:Iterable,
+        fallbacks:Iterable=(),
+        max_attempts:int=None,
+        failure_threshold:int=3,
+        ejection_seconds:float=10.0,
+        max_ejection_seconds:float=300.0,
+    ):
+        engines = [(engine, False) for engine in engines] + [(engine, True) for engine in fallbacks]
+        if not engines:
+            raise ValueError("EnginePool requires at least one engine.")
+        self.endpoints: List[_Endpoint] = [_Endpoint(index, engine, fallback) for index, (engine, fallback) in enumerate(engines)]
+
+        kinds = {_is_async(endpoint.engine) for endpoint in self.endpoints}
+        if len(kinds) > 1:
+            raise ValueError("EnginePool engines must be all sync or all async.")
+        self.is_async = kinds.pop()
+
+        self.max_attempts = max_attempts or len(self.endpoints)
+        self.failure_threshold = failure_threshold
+        self.ejection_seconds = ejection_seconds
+        self.max_ejection_seconds = max_ejection_seconds
+        # Pools do not pace requests themselves, their engines do
+        self.rate_limiter = None
+
+        self.chat = type('Chat', (), {})()
+        self.chat.completions = _PoolCompletions(self)
+        self._lock = threading.Lock()
+        self._turns = itertools.count()
+
+    @property
+    def default_chat_params(self) -> dict:
+        """The default chat params of the first engine, e.g. to render batch request bodies."""
+        return getattr(self.endpoints[0].engine, 'default_chat_params', {})
+
+    def _acquire(self, tried:List[_Endpoint]) -> _Endpoint:
+        """Picks the endpoint of the next attempt of a request, or None if none is left."""
+        with self._lock:
+            now = time.monotonic()
+            candidates = [endpoint for endpoint in self.endpoints if endpoint not in tried]
+            if not candidates:
+                return None
+            healthy = [endpoint for endpoint in candidates if endpoint.ejected_until <= now]
+            replicas = [endpoint for endpoint in healthy if not endpoint.fallback]
+            # With every candidate ejected, the one coming back first is still better than failing
+            choices = replicas or healthy or [min(candidates, key=lambda endpoint: endpoint.ejected_until)]
+
+            turn = next(self._turns)
+            endpoint = min(choices, key=lambda endpoint: (endpoint.outstanding, (endpoint.index - turn) % len(self.endpoints)))
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def _release(self, endpoint:_Endpoint, error:Exception=None, cancelled:bool=False):
+        with self._lock:
+            endpoint.outstanding -= 1
+            if cancelled:
+                return
+            if error is None:
+                endpoint.failures = 0
+                endpoint.ejections = 0
+                return
+            endpoint.errors += 1
+            if _is_unhealthy(error):
+                endpoint.failures += 1
+                if endpoint.failures >= self.failure_threshold:
+                    duration = min(self.max_ejection_seconds, self.ejection_seconds * 2 ** endpoint.ejections)
+                    endpoint.ejected_until = time.monotonic() + duration
+                    endpoint.ejections += 1
+                    endpoint.failures = 0
+
+    def _create(self, params:dict):
+        tried = []
+        while (endpoint := self._acquire(tried)) is not None:
+            tried.append(endpoint)
+            try:
+                response = endpoint.engine.chat.completions.create(**params)
+            except Exception as e:
+                self._release(endpoint, e)
+                if not is_retryable(e) or len(tried) >= self.max_attempts:
+                    raise
+                error = e
+                continue
+            self._release(endpoint)
+            return response
+        raise error
+
+    async def _acreate(self, params:dict):
+        """Async counterpart of `_create`."""
+        tried = []
+        while (endpoint := self._acquire(tried)) is not None:
+            tried.append(endpoint)
+            try:
+                response = await endpoint.engine.chat.completions.create(**params)
+            except asyncio.CancelledError:
+                self._release(endpoint, cancelled=True)
+                raise
+            except Exception as e:
+                self._release(endpoint, e)
+                if not is_retryable(e) or len(tried) >= self.max_attempts:
+                    raise
+                error = e
+                continue
+            self._release(endpoint)
+            return response
+        raise error
+
+    def endpoint_stats(self) -> List[dict]:
+        """Returns the state and counters of each endpoint."""
+        now = time.monotonic()
+        with self._lock:
+            return [
+                {
+                    'index': endpoint.index,
+                    'base_url': str(getattr(endpoint.engine, 'base_url', '')) or None,
+                    'fallback': endpoint.fallback,
+                    'outstanding': endpoint.outstanding,
+                    'requests': endpoint.requests,
+                    'errors': endpoint.errors,
+                    'ejected': endpoint.ejected_until > now,
+                }
+                for endpoint in self.endpoints
+            ]
@@ -0,0 +1,148 @@
+import os
+import asyncio
+import inspect
+import threading
+import importlib.util
+from typing import Dict, Optional, Union
+
+import httpx
+
+
+DEFAULT_BASE_URL = 'https://api.openai.com/v1'
+
+DEFAULT_HTTP_OPTIONS = {
+    'http2': True,
+    'max_connections': 512,
+    'max_keepalive_connections': 128,
+    'keepalive_expiry': 60.0,
+    'timeout': 600.0,
+    'connect_timeout': 10.0,
+}
+
+_lock = threading.Lock()
+_http_clients: Dict[tuple, httpx.Client] = {}
+_base_clients: Dict[tuple, object] = {}
+# Async clients' connections belong to the event loop that opened them, so they are shared
+# per loop: {loop: {'http': {key: client}, 'base': {key: client}}}
+_loop_clients: Dict[asyncio.AbstractEventLoop, Dict[str, dict]] = {}
+
+
+def _freeze(options:dict) -> tuple:
+    return tuple(sorted((key, repr(value)) for key, value in options.items()))
+
+
+def _registry(kind:str, is_async:bool) -> Optional[dict]:
+    """Returns where the shared clients of `kind` ('http' or 'base') live for the caller:
+    process-wide if sync, per running event loop if async, or None (not shared) for async
+    clients created outside of an event loop. Must be called with `_lock` held."""
+    if not is_async:
+        return _http_clients if kind == 'http' else _base_clients
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    # Forget the clients of finished loops (e.g. of a previous `asyncio.run`)
+    for closed in [closed for closed in _loop_clients if closed.is_closed()]:
+        del _loop_clients[closed]
+    return _loop_clients.setdefault(loop, {'http': {}, 'base': {}})[kind]
+
+
+def get_http_client(
+    base_url:str=None,
+    is_async:bool=False,
+    **http_options,
+) -> Union[httpx.Client, httpx.AsyncClient]:
+    """
+    Returns the shared `httpx` client for `base_url`, creating it on first use.
+
+    Every wrapper talking to the same endpoint with the same options shares one connection
+    pool, so connections (and their TCP/TLS handshakes) are reused across wrappers.
+    HTTP/2 is used when the optional `h2` package is installed.
+
+    Sync clients are shared process-wide. An async client's connections belong to the event
+    loop that opened them, so async clients are shared within the running event loop only,
+    and not shared at all when created outside of one.
+
+    Args:
+        base_url (str): The endpoint the client is dedicated to.
+        is_async (bool): Whether to return an `httpx.AsyncClient`.
+        **http_options: Overrides of DEFAULT_HTTP_OPTIONS (http2, max_connections,
+            max_keepalive_connections, keepalive_expiry, timeout, connect_timeout).
+    """
+    options = {**DEFAULT_HTTP_OPTIONS, **http_options}
+    options['http2'] = options['http2'] and importlib.util.find_spec('h2') is not None
+    key = (base_url or DEFAULT_BASE_URL, is_async, _freeze(options))
+
+    with _lock:
+        clients = _registry('http', is_async)
+        if clients is None or (client := clients.get(key)) is None:
+            client_class = httpx.AsyncClient if is_async else httpx.Client
+            client = client_class(
+                http2=options['http2'],
+                limits=httpx.Limits(
+                    max_connections=options['max_connections'],
+                    max_keepalive_connections=options['max_keepalive_connections'],
+                    keepalive_expiry=options['keepalive_expiry'],
+                ),
+                timeout=httpx.Timeout(options['timeout'], connect=options['connect_timeout']),
+                follow_redirects=True,
+            )
+            if clients is not None:
+                clients[key] = client
+        return client
+
+
+def _http_client_type(base:type) -> Optional[bool]:
+    """Returns whether `base` takes an async (True) or sync (False) `http_client`, or None if it takes none."""
+    try:
+        parameter = inspect.signature(base).parameters.get('http_client')
+    except (TypeError, ValueError):
+        return None
+    if parameter is None:
+        return None
+    return 'AsyncClient' in str(parameter.annotation)
+
+
+def get_base_client(base:type, http_options:dict=None, **client_params):
+    """
+    Returns a shared instance of the client class `base` (e.g. OpenAI or AsyncOpenAI).
+
+    Instances are cached per class and client params, so creating many wrappers for one
+    endpoint does not create many clients. Clients that accept an `http_client` get the
+    shared transport of their base URL from `get_http_client`; like their transport, async
+    clients are only shared within the running event loop.
+
+    Args:
+        base (type): The client class.
+        http_options (dict): Options of the shared transport, see `get_http_client`.
+        **client_params: Arguments of `base`, e.g. base_url, api_key, max_retries.
+    """
+    key = (base, _freeze(client_params), _freeze(http_options or {}))
+    is_async = _http_client_type(base)
+    with _lock:
+        clients = _registry('base', bool(is_async))
+        if clients is not None and (client := clients.get(key)) is not None:
+            return client
+
+    if is_async is not None and 'http_client' not in client_params:
+        base_url = client_params.get('base_url') or os.environ.get('OPENAI_BASE_URL')
+        client_params = {
+            **client_params,
+            'http_client': get_http_client(str(base_url) if base_url else None, is_async, **(http_options or {})),
+        }
+
+    client = base(**client_params)
+    if clients is None:
+        return client
+    with _lock:
+        return clients.setdefault(key, client)
+
+
+def close_http_clients():
+    """Closes every shared sync client and forgets all shared clients (e.g. before fork)."""
+    with _lock:
+        for client in _http_clients.values():
+            client.close()
+        _http_clients.clear()
+        _base_clients.clear()
+        _loop_clients.clear()
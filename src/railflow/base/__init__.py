@@ -1,2 +1,8 @@
 from .config import *
-from .flow import *
\ No newline at end of file
+from .plan import *
+from .flow import *
+from .work_queue import *
+from .run import *
+from .watch import *
+from .batch import *
+from .tracing import *
\ No newline at end of file
@@ -0,0 +1,318 @@
+import json
+import hashlib
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Union
+
+from utils.image_process import preprocess_image
+from .config import DEFAULT_CONDITION, RailConfig, TaskType
+from .flow import (
+    OUTPUT_RAIL_INPUT_PARAM,
+    FlowResult,
+    NoMatchingFlowError,
+    RailFlow,
+    RailResult,
+    _compile_rails,
+    _condition_key,
+)
+from .plan import RailPlan, TaskPlan
+
+
+def _custom_id(phase:str, key) -> str:
+    """A stable batch custom_id derived from the request identity."""
+    digest = hashlib.sha256(json.dumps(key, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return f'{phase}-{digest[:32]}'
+
+
+def _add_usage(usage:dict, completion_usage:dict) -> dict:
+    for key, value in completion_usage.items():
+        if isinstance(value, int):
+            usage[key] = usage.get(key, 0) + value
+    if cached_tokens := (completion_usage.get('prompt_tokens_details') or {}).get('cached_tokens'):
+        usage['cached_tokens'] = usage.get('cached_tokens', 0) + cached_tokens
+    return usage
+
+
+def read_completions(completion_files:Iterable[Union[str, Path]]) -> Dict[str, dict]:
+    """Reads batch completion files into `{custom_id: {'output', 'usage', 'error'}}`.
+
+    Lines follow the OpenAI batch output format:
+    `{"custom_id": ..., "response": {"status_code": 200, "body": <chat completion>}, "error": null}`.
+    """
+    completions = {}
+    for completion_file in completion_files:
+        with open(completion_file, 'r', encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = json.loads(line)
+                response = record.get('response') or {}
+                body = response.get('body') or {}
+                error = record.get('error')
+                if error is None and response.get('status_code', 200) != 200:
+                    error = body.get('error') or f"HTTP {response.get('status_code')}"
+                completions[record['custom_id']] = {
+                    'output': body['choices'][0]['message']['content'] if error is None else None,
+                    'usage': body.get('usage') or {},
+                    'error': error,
+                }
+    return completions
+
+
+def complete_batch_locally(
+    engine,
+    request_files:Iterable[Union[str, Path]],
+    output_path:Union[str, Path],
+) -> Path:
+    """
+    A local stand-in for a batch endpoint: sends every request of `request_files` to `engine`
+    and writes the completions in the batch output format to `output_path`.
+
+    Args:
+        engine: A sync engine exposing `chat.completions.create` (e.g. a wrapper of a
+            self-hosted model, or a fake engine for tests).
+        request_files: Batch request JSONL files, e.g. from `OfflineBatch.export_conditions`.
+        output_path: The completion JSONL file to write.
+    """
+    output_path = Path(output_path)
+    with open(output_path, 'w', encoding='utf-8') as output:
+        for request_file in request_files:
+            with open(request_file, 'r', encoding='utf-8') as f:
+                for line in f:
+                    if not line.strip():
+                        continue
+                    request = json.loads(line)
+                    record = {'id': f"batch_req_{request['custom_id']}", 'custom_id': request['custom_id']}
+                    try:
+                        response = engine.chat.completions.create(**request['body'])
+                        body = response.model_dump() if hasattr(response, 'model_dump') else response
+                        record.update(response={'status_code': 200, 'body': body}, error=None)
+                    except Exception as e:
+                        record.update(response=None, error={'message': f'{type(e).__name__}: {e}'})
+                    output.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+    return output_path
+
+
+class _ShardWriter:
+    """Writes JSONL lines to `<prefix>-<index>.jsonl` shards bounded in lines and bytes."""
+
+    def __init__(self, directory:Path, prefix:str, max_lines:int, max_bytes:int):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_lines = max_lines
+        self.max_bytes = max_bytes
+        self.paths: List[Path] = []
+        self._file = None
+        self._lines = 0
+        self._bytes = 0
+
+    def write(self, record:dict):
+        line = (json.dumps(record, ensure_ascii=False) + '\n').encode('utf-8')
+        if self._file is None or self._lines >= self.max_lines or self._bytes + len(line) > self.max_bytes:
+            self.close()
+            self.paths.append(self.directory / f'{self.prefix}-{len(self.paths):05d}.jsonl')
+            self._file = open(self.paths[-1], 'wb')
+            self._lines = self._bytes = 0
+        self._file.write(line)
+        self._lines += 1
+        self._bytes += len(line)
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+class OfflineBatch:
+    """
+    Runs flows through offline batch files instead of live calls, e.g. a provider's discounted
+    batch endpoint or a self-hosted vLLM batch runner.
+
+    The run goes through two request phases, with state kept in `work_dir` between them:
+
+    1. `export_conditions(image_paths)` renders every (deduplicated) condition request.
+    2. `export_actions(condition_completions)` picks each image's flow from the condition
+       results, with the same fall-through semantics as `RailFlow.generate`, and renders the
+       selected action requests.
+    3. `import_actions(action_completions)` yields one `RailResult` per image, running the
+       output rail locally (function tasks) or through `rail_flow.engine` (prompt tasks).
+
+    Function tasks never go through the batch files: they run locally during export and
+    their results are written to a `completions-local-*.jsonl` file read on import.
+
+    Args:
+        rail_flow (RailFlow): Renders messages, runs function tasks and output rails; the
+            default chat params (e.g. model) of the engine of each task are included in its
+            request body.
+        rails: The rails (or compiled `RailPlan`) to run.
+        work_dir: Directory of request shards and state files.
+        generation_params (dict): Generation params of every request.
+        max_requests_per_shard (int): Maximum number of requests per request file.
+        max_bytes_per_shard (int): Maximum size in bytes of a request file.
+        url (str): The endpoint of the batch requests.
+    """
+
+    def __init__(
+        self,
+        rail_flow:RailFlow,
+        rails:Union[RailPlan, RailConfig],
+        work_dir:Union[str, Path],
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+        max_requests_per_shard:int=50000,
+        max_bytes_per_shard:int=190 * 1024 * 1024,
+        url:str='/v1/chat/completions',
+    ):
+        self.rail_flow = rail_flow
+        self.plan = rail_flow.check_engines(_compile_rails(rails, action_params, condition_params))
+        self.work_dir = Path(work_dir)
+        self.generation_params = generation_params
+        self.max_requests_per_shard = max_requests_per_shard
+        self.max_bytes_per_shard = max_bytes_per_shard
+        self.url = url
+
+    def _request(self, custom_id:str, task:TaskPlan, image_path:str) -> dict:
+        if task.preprocess and image_path:
+            image_path = preprocess_image(image_path, **task.preprocess.__dict__)
+        generation_params = self.generation_params
+        if task.classifier is not None:
+            generation_params = task.classifier.generation_params(generation_params)
+        body = {
+            **getattr(self.rail_flow.get_engine(task.engine), 'default_chat_params', {}),
+            **generation_params,
+            'messages': self.rail_flow._prepare_messages(task.task, task.params, image_path),
+        }
+        return {'custom_id': custom_id, 'method': 'POST', 'url': self.url, 'body': body}
+
+    def _run_local(self, task:TaskPlan, image_path:str, execute) -> dict:
+        try:
+            output = execute(**task.as_kwargs(), image_path=image_path)
+            return {'response': {'status_code': 200, 'body': {'choices': [{'message': {'content': output}}]}}, 'error': None}
+        except Exception as e:
+            return {'response': None, 'error': {'message': f'{type(e).__name__}: {e}'}}
+
+    def _writers(self, phase:str):
+        self.work_dir.mkdir(parents=True, exist_ok=True)
+        requests = _ShardWriter(self.work_dir, f'requests-{phase}', self.max_requests_per_shard, self.max_bytes_per_shard)
+        local = open(self.work_dir / f'completions-local-{phase}.jsonl', 'w', encoding='utf-8')
+        state = open(self.work_dir / f'state-{phase}.jsonl', 'w', encoding='utf-8')
+        return requests, local, state
+
+    def export_conditions(self, image_paths:Iterable[str]) -> List[Path]:
+        """Writes the condition requests of every image and returns the request files.
+
+        Conditions shared between flows are requested once per image.
+        """
+        requests, local, state = self._writers('conditions')
+        exported = set()
+        try:
+            for image_path in image_paths:
+                image_path = str(image_path)
+                flows = []
+                for flow in self.plan.input:
+                    condition_id = None
+                    if condition := flow.condition:
+                        condition_id = _custom_id('condition', _condition_key(condition, image_path))
+                        if condition_id not in exported:
+                            exported.add(condition_id)
+                            if condition.type == TaskType.function:
+                                local.write(json.dumps({'custom_id': condition_id, **self._run_local(condition, image_path, self.rail_flow.execute_condition)}, default=str) + '\n')
+                            else:
+                                requests.write(self._request(condition_id, condition, image_path))
+                    flows.append([flow.name, condition_id])
+                state.write(json.dumps({'image_path': image_path, 'flows': flows}, ensure_ascii=False) + '\n')
+        finally:
+            requests.close()
+            local.close()
+            state.close()
+        return requests.paths
+
+    def export_actions(self, completion_files:Iterable[Union[str, Path]]) -> List[Path]:
+        """Selects each image's action from the condition completions and writes the action
+        requests; returns the request files."""
+        conditions = read_completions([*completion_files, self.work_dir / 'completions-local-conditions.jsonl'])
+        flows = {flow.name: flow for flow in self.plan.input}
+
+        requests, local, state = self._writers('actions')
+        try:
+            with open(self.work_dir / 'state-conditions.jsonl', 'r', encoding='utf-8') as f:
+                for line in f:
+                    image = json.loads(line)
+                    selection = {'image_path': image['image_path'], 'flow': None, 'condition_response': None,
+                                 'action_id': None, 'usage': {}, 'error': None}
+
+                    for flow_name, condition_id in image['flows']:
+                        flow = flows[flow_name]
+                        if condition_id is None:
+                            key = DEFAULT_CONDITION
+                        elif (completion := conditions.get(condition_id)) is None or completion['error']:
+                            selection['error'] = (completion or {}).get('error') or f'Missing completion {condition_id}'
+                            break
+                        else:
+                            key = completion['output']
+                            if flow.condition.classifier is not None:
+                                key = flow.condition.classifier.match(key)
+                            selection['condition_response'] = key
+                            _add_usage(selection['usage'], completion['usage'])
+                        if (action := flow.actions.get(key)) is None:
+                            continue
+
+                        selection['flow'] = flow_name
+                        selection['action_id'] = _custom_id('action', [image['image_path'], flow_name, key, action.task, dict(action.params)])
+                        if action.type == TaskType.function:
+                            local.write(json.dumps({'custom_id': selection['action_id'], **self._run_local(action, image['image_path'], self.rail_flow.execute_action)}, default=str) + '\n')
+                        else:
+                            requests.write(self._request(selection['action_id'], action, image['image_path']))
+                        break
+                    else:
+                        selection['error'] = str(NoMatchingFlowError(image['image_path'], self.plan.input))
+
+                    state.write(json.dumps(selection, ensure_ascii=False) + '\n')
+        finally:
+            requests.close()
+            local.close()
+            state.close()
+        return requests.paths
+
+    def import_actions(self, completion_files:Iterable[Union[str, Path]]) -> Iterator[Union[RailResult, dict]]:
+        """Yields a `RailResult` per image from the action completions, after running the
+        output rail; images that failed in any phase yield `{'image_path', 'error'}`."""
+        actions = read_completions([*completion_files, self.work_dir / 'completions-local-actions.jsonl'])
+
+        with open(self.work_dir / 'state-actions.jsonl', 'r', encoding='utf-8') as f:
+            for line in f:
+                selection = json.loads(line)
+                image_path = selection['image_path']
+                completion = actions.get(selection['action_id']) if selection['action_id'] else None
+                if selection['error'] or completion is None or completion['error']:
+                    error = selection['error'] or (completion or {}).get('error') or f"Missing completion {selection['action_id']}"
+                    yield {'image_path': image_path, 'error': error}
+                    continue
+
+                usage = _add_usage(dict(selection['usage']), completion['usage'])
+
+                result = RailResult(
+                    image_path=image_path,
+                    input=FlowResult(
+                        image_path=image_path,
+                        flow=selection['flow'],
+                        condition_response=selection['condition_response'],
+                        output=completion['output'],
+                        usage=usage,
+                    ),
+                )
+                try:
+                    if self.plan.output:
+                        rail_input = {OUTPUT_RAIL_INPUT_PARAM: result.input.output}
+                        result.output = self.rail_flow.generate(
+                            self.plan.output,
+                            self.generation_params,
+                            action_params=rail_input,
+                            condition_params=rail_input,
+                            image_path=image_path,
+                            return_result=True,
+                        )
+                except Exception as e:
+                    yield {'image_path': image_path, 'error': f'{type(e).__name__}: {e}'}
+                    continue
+                yield result
@@ -0,0 +1,81 @@
+import re
+import json
+from typing import Dict, Iterable, Optional
+
+
+_PUNCTUATION = ' \t\r\n.,;:!?"\'`*()[]{}<>'
+_ANSWER_PREFIX = re.compile(r'^(?:answer|label|category)\s*[:=-]\s*', re.IGNORECASE)
+_WHITESPACE = re.compile(r'\s+')
+
+
+def normalize_label(text:str) -> str:
+    """Normalizes a label or a model response for lookup: trims whitespace, quotes and
+    punctuation, drops an 'Answer:' prefix, collapses inner whitespace and casefolds."""
+    text = _ANSWER_PREFIX.sub('', str(text).strip(_PUNCTUATION))
+    return _WHITESPACE.sub(' ', text.strip(_PUNCTUATION)).casefold()
+
+
+class LabelClassifier:
+    """
+    Turns a condition into a label decision over a closed set of labels.
+
+    The condition request is capped to a few output tokens at temperature 0, and optionally
+    constrained to the labels with a structured-output enum (`response_format` JSON schema).
+    Responses are mapped back to a label through a dict of normalized labels, so trailing
+    whitespace, punctuation, quotes or a JSON wrapper do not misroute the image.
+
+    Args:
+        labels (Iterable[str]): The allowed labels, e.g. the action keys of the flows using the condition.
+        structured_output (bool): Whether to constrain the response with a JSON schema enum;
+            only enable it for engines supporting `response_format` with `json_schema`.
+        max_tokens (int): Output token cap, by default derived from the longest label.
+    """
+
+    def __init__(self, labels:Iterable[str], structured_output:bool=False, max_tokens:int=None):
+        self.labels = tuple(dict.fromkeys(labels))
+        self.structured_output = structured_output
+        # ~3 characters per token is conservative for short labels; the JSON wrapper takes ~8 more
+        self.max_tokens = max_tokens or max(len(label) for label in self.labels) // 3 + 3 + (8 if structured_output else 0)
+        self._index: Dict[str, str] = {normalize_label(label): label for label in self.labels}
+
+    def generation_params(self, generation_params:dict={}) -> dict:
+        """Returns `generation_params` with the output cap and constraints of the classifier."""
+        params = {**generation_params}
+        params.setdefault('temperature', 0)
+        params['max_completion_tokens' if 'max_completion_tokens' in params else 'max_tokens'] = self.max_tokens
+        if self.structured_output:
+            params['response_format'] = {
+                'type': 'json_schema',
+                'json_schema': {
+                    'name': 'label',
+                    'strict': True,
+                    'schema': {
+                        'type': 'object',
+                        'properties': {'label': {'type': 'string', 'enum': list(self.labels)}},
+                        'required': ['label'],
+                        'additionalProperties': False,
+                    },
+                },
+            }
+        return params
+
+    def match(self, response:Optional[str]) -> Optional[str]:
+        """Returns the label of `response`, or `response` itself if it names no label."""
+        if not isinstance(response, str):
+            return response
+
+        text = response
+        if text.lstrip().startswith('{'):
+            try:
+                text = str(json.loads(text).get('label', text))
+            except (ValueError, AttributeError):
+                pass
+
+        if (label := self._index.get(normalize_label(text))) is not None:
+            return label
+        # A label followed by an explanation, e.g. "Chemistry\nThe image shows..."
+        first_line = text.strip().split('\n', 1)[0]
+        return self._index.get(normalize_label(first_line), response)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(labels={list(self.labels)}, structured_output={self.structured_output})"
@@ -1,9 +1,11 @@
 import yaml
+import importlib
 from dataclasses import dataclass, field
 from pathlib import Path
 from typing import Dict, List, Union
 
 from utils.dict import CaseInsensitiveDict
+from .template import compile_template
 
 
 DEFAULT_CONDITION = 'True'
@@ -16,20 +18,69 @@ class PromptConfig:
 
 @dataclass
 class FunctionConfig:
-    task   :str
-    source :str = None
-    params :dict = field(default_factory=dict)
+    task      :str
+    source    :str  = None
+    params    :dict = field(default_factory=dict)
+    cpu_bound :bool = False
+
+
+def resolve_function(task:str, source:str=None):
+    """Returns the callable of a function task.
+
+    Args:
+        task (str): The function name.
+        source (str): The module defining it, dotted or slash-separated (e.g. 'utils.text');
+            without a source the function is looked up in `railflow.base.flow`.
+
+    Raises:
+        ValueError: If the module or the function does not exist.
+    """
+    if source:
+        source = source.replace('/', '.')
+        try:
+            module = importlib.import_module(source)
+        except ImportError as e:
+            raise ValueError(f"Module '{source}' of function '{task}' could not be imported: {e}") from e
+        function = getattr(module, task, None)
+    else:
+        function = getattr(importlib.import_module(f'{__package__}.flow'), task, None)
+
+    if not callable(function):
+        raise ValueError(
+            f"Function '{task}' not found in {f'module {source!r}' if source else 'global scope'}. "
+            "Please ensure the function exists."
+        )
+    return function
+
+@dataclass
+class PreprocessConfig:
+    max_long_edge   :int  = None
+    format          :str  = 'JPEG'
+    quality         :int  = 85
+    grayscale       :bool = False
+    crop_margins    :bool = False
+    cache_dir       :str  = None
+    cache_max_bytes :int  = 1024 * 1024 * 1024
 
 @dataclass
 class TaskType:
     prompt   :str = 'prompt'
     function :str = 'function'
 
+@dataclass
+class ConditionMode:
+    generate :str = 'generate'
+    classify :str = 'classify'
+
 @dataclass
 class TaskConfig:
     type: Union[str, TaskType]
     task: str
     params: dict = field(default_factory=dict)
+    preprocess: PreprocessConfig = None
+    name: str = None
+    cpu_bound: bool = False
+    engine: str = None
 
     def __init__(
         self,
@@ -37,9 +88,13 @@ class TaskConfig:
         task: Union[str, dict, PromptConfig, FunctionConfig],
         source: str = None,
         params: dict = field(default_factory={}),
+        preprocess: Union[dict, PreprocessConfig] = None,
         *,
         prompt_dict: Dict[str, PromptConfig] = None,
         function_dict: Dict[str, FunctionConfig] = None,
+        name: str = None,
+        cpu_bound: bool = None,
+        engine: str = None,
     ):
 
         base_task_config = {}
@@ -61,6 +116,8 @@ class TaskConfig:
             self.task = base_task_config.task
             self.source = base_task_config.source
             self.params = {**base_task_config.params, **params}
+            if cpu_bound is None:
+                cpu_bound = getattr(base_task_config, 'cpu_bound', False)
 
         else:
             self.type = type
@@ -68,6 +125,15 @@ class TaskConfig:
             self.source = source
             self.params = params
 
+        self.preprocess = PreprocessConfig(**preprocess) if isinstance(preprocess, dict) else preprocess
+        self.name = name
+        self.cpu_bound = bool(cpu_bound)
+        # The name of the `RailFlow` engine serving this task, see `RailFlow(engines=...)`
+        self.engine = engine
+
+        # Resolved once here, so a missing function fails the config load instead of a run
+        self.function = resolve_function(self.task, self.source) if self.type == TaskType.function else None
+
 @dataclass
 class ActionConfig(TaskConfig):
     def __init__(
@@ -76,39 +142,72 @@ class ActionConfig(TaskConfig):
         task: str,
         source: str = None,
         params: dict = {},
+        preprocess: Union[dict, PreprocessConfig] = None,
         *,
         prompt_dict: Dict[str, PromptConfig] = None,
         function_dict: Dict[str, FunctionConfig] = None,
+        name: str = None,
+        cpu_bound: bool = None,
+        engine: str = None,
     ):
         super().__init__(
             type=type,
             task=task,
             source=source,
             params=params,
+            preprocess=preprocess,
             prompt_dict=prompt_dict,
-            function_dict=function_dict
+            function_dict=function_dict,
+            name=name,
+            cpu_bound=cpu_bound,
+            engine=engine,
         )
 
 @dataclass
 class ConditionConfig(TaskConfig):
+    """A condition; in `classify` mode its response is a label among the action keys of the
+    flows using it (or `labels`), see `LabelClassifier`."""
+    mode: Union[str, ConditionMode] = ConditionMode.generate
+    labels: List[str] = None
+    structured_output: bool = False
+    max_tokens: int = None
+
     def __init__(
         self,
         type: Union[str, TaskType],
         task: str,
         source: str = None,
         params: dict = {},
+        preprocess: Union[dict, PreprocessConfig] = None,
+        mode: Union[str, ConditionMode] = ConditionMode.generate,
+        labels: List[str] = None,
+        structured_output: bool = False,
+        max_tokens: int = None,
         *,
         prompt_dict: Dict[str, PromptConfig] = None,
         function_dict: Dict[str, FunctionConfig] = None,
+        name: str = None,
+        cpu_bound: bool = None,
+        engine: str = None,
     ):
         super().__init__(
             type=type,
             task=task,
             source=source,
             params=params,
+            preprocess=preprocess,
             prompt_dict=prompt_dict,
-            function_dict=function_dict
+            function_dict=function_dict,
+            name=name,
+            cpu_bound=cpu_bound,
+            engine=engine,
         )
+        if mode not in (ConditionMode.generate, ConditionMode.classify):
+            raise ValueError(f"Invalid condition mode: {mode}. Expected in {ConditionMode.__annotations__}.")
+        self.mode = mode
+        self.labels = labels
+        self.structured_output = structured_output
+        self.max_tokens = max_tokens
 
 @dataclass
 class FlowConfig:
@@ -159,6 +258,15 @@ class RailConfig:
             raise KeyError(f"Missing required '{cls.name}' field in configuration.")
         return cls.from_dict(config[cls.name])
 
+    def compile(self, action_params: dict = {}, condition_params: dict = {}) -> 'RailPlan':
+        """Compiles the input and output flows into an immutable `RailPlan`, see `compile_flows`."""
+        from .plan import RailPlan, compile_flows
+
+        return RailPlan(
+            input=compile_flows(self.input.flows, action_params, condition_params),
+            output=compile_flows(self.output.flows, action_params, condition_params),
+        )
+
     @classmethod
     def from_dict(
         cls,
@@ -226,16 +334,21 @@ class RailFlowConfig:
 
         _name = 'actions'
         actions = {
-            _name: ActionConfig(**_config, prompt_dict=prompts, function_dict=functions)
+            _name: ActionConfig(**_config, prompt_dict=prompts, function_dict=functions, name=_name)
             for _name, _config in config[_name].items()
         } if config.get(_name) else {}
 
         _name = 'conditions'
         conditions = {
-            _name: ConditionConfig(**_config, prompt_dict=prompts, function_dict=functions)
+            _name: ConditionConfig(**_config, prompt_dict=prompts, function_dict=functions, name=_name)
             for _name, _config in config[_name].items()
         } if config.get(_name) else {}
 
+        # Pre-compile prompt templates so each request only does variable substitution
+        for _config in [*prompts.values(), *actions.values(), *conditions.values()]:
+            if isinstance(_config, PromptConfig) or _config.type == TaskType.prompt:
+                compile_template(_config.task)
+
         _name = 'flows'
         flows = {
             _name: FlowConfig(
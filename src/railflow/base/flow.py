@@ -1,12 +1,19 @@
 import re
-import copy
 import json
-import importlib
-from jinja2 import Template
-from typing import Dict, List
+import asyncio
+import itertools
+import contextlib
+from concurrent.futures import Executor
+from dataclasses import dataclass, field
+from typing import AsyncIterable, AsyncIterator, Dict, Iterable, Iterator, List, Tuple, Union
 
 from .config import *
-from utils.image_process import encode_image
+from .classifier import LabelClassifier
+from .packing import packed_generation_params, parse_packed_response, prepare_packed_messages
+from .plan import ExecutionPlan, RailPlan, compile_flows
+from .template import render_template, split_template
+from .tracing import Tracer, payload_bytes
+from utils.image_process import encode_image, preprocess_image
 
 
 class NoMatchingFlowError(Exception):
@@ -18,6 +25,9 @@ class NoMatchingFlowError(Exception):
             f"Attempted flows: {', '.join(self.flows)}"
         )
 
+# Kept for compatibility only: `RailFlow` no longer mutates flow configs, it merges params into
+# the compiled plan (see `ExecutionPlan.overlay`). These still update configs in place, which
+# only affects plans compiled afterwards.
 def update_params(_dict:dict, key:str=None, params_to_update:dict={}):
     # Determine keys to update
     key_to_update = [key] if _dict and key else list(_dict.keys())
@@ -59,10 +69,263 @@ def update_flow_params(
     update_flow_task_params(_flows, 'condition', condition_params)
 
 
+@dataclass
+class RunStats:
+    """Counters of the model/function calls made by a `RailFlow`.
+
+    `condition_calls_deduplicated` counts condition evaluations shared between flows of an
+    image, `condition_calls_packed` the packed (multi-image) condition requests, and
+    `condition_calls_seeded` the condition evaluations answered by one of them.
+    """
+    condition_calls              :int = 0
+    condition_calls_deduplicated :int = 0
+    condition_calls_packed       :int = 0
+    condition_calls_seeded       :int = 0
+    action_calls                 :int = 0
+    prompt_tokens                :int = 0
+    cached_tokens                :int = 0
+
+    def reset(self):
+        self.condition_calls = 0
+        self.condition_calls_deduplicated = 0
+        self.condition_calls_packed = 0
+        self.condition_calls_seeded = 0
+        self.action_calls = 0
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+
+    @property
+    def cached_token_ratio(self) -> float:
+        """The share of prompt tokens served from the provider's prompt prefix cache."""
+        return self.cached_tokens / self.prompt_tokens if self.prompt_tokens else 0.0
+
+    def record_usage(self, response):
+        """Counts the prompt and cached tokens reported in a chat completion `response`."""
+        if not (usage := getattr(response, 'usage', None)):
+            return
+        self.prompt_tokens += getattr(usage, 'prompt_tokens', None) or 0
+        self.cached_tokens += _cached_tokens(usage)
+
+
+@dataclass
+class FlowResult:
+    """The outcome of evaluating the flows on one image."""
+    image_path         :str    = None
+    flow               :str    = None
+    condition_response :str    = None
+    output             :object = None
+    usage              :dict   = field(default_factory=dict)
+
+
+@dataclass
+class SweepResult(FlowResult):
+    """The outcome of one variant of a sweep: the action params it was rendered with and,
+    when several samples are drawn per variant, the sample index."""
+    params :dict = field(default_factory=dict)
+    sample :int  = 0
+
+
+@dataclass
+class PackedConditions:
+    """Condition responses of one image obtained from packed (multi-image) requests.
+
+    `responses` seeds the per-image condition memo of `generate`, keyed by `_condition_key`;
+    `usage` is the image's even share of the packed requests' token usage.
+    """
+    responses :dict = field(default_factory=dict)
+    usage     :dict = field(default_factory=dict)
+
+
+@dataclass
+class RailResult:
+    """The outcome of running the input rail, then the output rail, on one image."""
+    image_path :str        = None
+    input      :FlowResult = None
+    output     :FlowResult = None
+
+    @property
+    def final_output(self):
+        """The output of the last rail that ran."""
+        return (self.output or self.input).output
+
+
+# Output rails receive the input rail's output under this param (e.g. `text` of match_and_parse_plain_text)
+OUTPUT_RAIL_INPUT_PARAM = 'text'
+
+_PIPELINE_DONE = object()
+
+
+def _compile_rails(rails:Union[RailPlan, RailConfig], action_params:dict={}, condition_params:dict={}) -> RailPlan:
+    if isinstance(rails, RailPlan):
+        return RailPlan(
+            input=rails.input.overlay(action_params, condition_params),
+            output=rails.output.overlay(action_params, condition_params),
+        )
+    return rails.compile(action_params, condition_params)
+
+
+def _cached_tokens(usage) -> int:
+    """Returns the prompt tokens served from the prompt cache (`prompt_tokens_details.cached_tokens`)."""
+    details = getattr(usage, 'prompt_tokens_details', None)
+    return (getattr(details, 'cached_tokens', None) or 0) if details else 0
+
+
+def _add_usage(usage:dict, response):
+    """Accumulates the token usage reported in `response` into `usage`."""
+    if usage is None or not (response_usage := getattr(response, 'usage', None)):
+        return
+    for key in ('prompt_tokens', 'completion_tokens', 'total_tokens'):
+        usage[key] = usage.get(key, 0) + (getattr(response_usage, key, None) or 0)
+    if cached_tokens := _cached_tokens(response_usage):
+        usage['cached_tokens'] = usage.get('cached_tokens', 0) + cached_tokens
+
+
+def expand_param_grid(grid:Union[Dict[str, list], Iterable[dict]]) -> List[dict]:
+    """Returns the action params of each sweep variant.
+
+    Args:
+        grid: Either a list of param dicts, one per variant, or a dict of param name to a
+            list of values, expanded to their cartesian product
+            (e.g. `{'language': ['English', 'French'], 'style': ['short', 'long']}` gives 4 variants).
+    """
+    if isinstance(grid, dict):
+        values = [value if isinstance(value, (list, tuple)) else [value] for value in grid.values()]
+        return [dict(zip(grid.keys(), combination)) for combination in itertools.product(*values)]
+    return [dict(params) for params in grid]
+
+
+def _share_usage(usage:dict, count:int) -> dict:
+    """Splits a request's token usage evenly between the `count` records it produced."""
+    return {key: value // count for key, value in usage.items()}
+
+
+def _seed_packed_conditions(packed:Dict[str, PackedConditions], condition, image_paths:List[str], answers:list, response):
+    """Records the parsed answers of a packed condition request, skipping unparsed ones and,
+    with a classifier, those naming none of its labels (these images fall back to a
+    single-image call)."""
+    usage = {}
+    _add_usage(usage, response)
+    for image_path, answer in zip(image_paths, answers):
+        for key, value in usage.items():
+            packed[image_path].usage[key] = packed[image_path].usage.get(key, 0) + value // len(image_paths)
+        if answer is not None and condition.classifier is not None:
+            answer = condition.classifier.match(answer)
+            if answer not in condition.classifier.labels:
+                continue
+        if answer is not None:
+            packed[image_path].responses[_condition_key(condition, image_path)] = answer
+
+
+def _packed_images_pending(packed:Dict[str, PackedConditions], flow, image_paths:List[str]) -> List[str]:
+    """Returns the images whose seeded response for `flow` selects none of its actions,
+    i.e. that go on to the next flow; images without a seeded response fall back to
+    single-image calls and are not packed further."""
+    pending = []
+    for image_path in image_paths:
+        response = packed[image_path].responses.get(_condition_key(flow.condition, image_path))
+        if response is not None and flow.actions.get(response) is None:
+            pending.append(image_path)
+    return pending
+
+
+async def _take(items:Union[Iterator, AsyncIterator], count:int) -> list:
+    """Returns the next `count` items of a sync or async iterator, fewer at its end."""
+    if not hasattr(items, '__anext__'):
+        return list(itertools.islice(items, count))
+    taken = []
+    while len(taken) < count:
+        try:
+            taken.append(await anext(items))
+        except StopAsyncIteration:
+            break
+    return taken
+
+
+async def _gather_or_cancel(awaitables:Iterable) -> list:
+    """Like `asyncio.gather`, but cancels and awaits the other awaitables when one fails."""
+    tasks = [asyncio.ensure_future(awaitable) for awaitable in awaitables]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+
+def _condition_key(condition, image_path:str=None) -> str:
+    """Identifies a condition evaluation by its task, params and image."""
+    return json.dumps(
+        [
+            condition.type, condition.task, condition.source, dict(condition.params), repr(condition.preprocess),
+            repr(getattr(condition, 'classifier', None)), getattr(condition, 'engine', None), image_path,
+        ],
+        sort_keys=True,
+        default=str,
+    )
+
+
 class RailFlow:
+    """
+    Evaluates flows on images with `engine`.
 
-    def __init__(self, engine=None):
+    Args:
+        engine: A chat completion client, e.g. `OpenAIWrapper` or `AsyncOpenAIWrapper`.
+        tracer (Tracer): Receives a span per condition, action, message preparation and engine
+            call; retries of the engines' rate limiters are counted on the engine span.
+        process_pool (Executor): Runs the function tasks flagged `cpu_bound`, e.g. a
+            `ProcessPoolExecutor`; without it they run in the calling thread (or a worker
+            thread for the async methods).
+        prefix_caching (bool): If True, the static beginning of each prompt (see
+            `split_template`) is sent as a system message, followed by the image and the
+            rendered rest of the prompt, so requests share a long identical prefix that
+            providers and vLLM serve from their prompt cache. Cache hits are reported as
+            `cached_tokens` in the usage and in `stats`.
+        engines (Dict[str, object]): Named engines that tasks are routed to with `engine: <name>`
+            in the config, e.g. conditions to a small fast model and actions to a large one;
+            tasks without `engine` use `engine`. Any engine may be an `EnginePool`.
+    """
+
+    def __init__(
+        self,
+        engine=None,
+        tracer:Tracer=None,
+        process_pool:Executor=None,
+        prefix_caching:bool=False,
+        engines:Dict[str, object]=None,
+    ):
         self.engine = engine
+        self.engines = engines or {}
+        self.stats = RunStats()
+        self.tracer = tracer or Tracer()
+        self.process_pool = process_pool
+        self.prefix_caching = prefix_caching
+
+    def get_engine(self, name:str=None):
+        """Returns the engine named `name` in `engines`, or the default engine if `name` is None."""
+        if name is None:
+            return self.engine
+        try:
+            return self.engines[name]
+        except KeyError:
+            raise ValueError(f"Unknown engine: {name}. Expected in {list(self.engines)}.") from None
+
+    def check_engines(self, plan:Union[ExecutionPlan, RailPlan]):
+        """Checks that the tasks of `plan` only name engines of `engines`, so that a typo in a
+        config fails before any call is made; returns `plan`.
+
+        Raises:
+            ValueError: If a task names an unknown engine.
+        """
+        plans = (plan.input, plan.output) if isinstance(plan, RailPlan) else (plan,)
+        for flow in itertools.chain.from_iterable(_plan for _plan in plans if _plan):
+            for task in (flow.condition, *flow.actions.values()):
+                if task is not None and task.engine is not None and task.engine not in self.engines:
+                    raise ValueError(
+                        f"Unknown engine: {task.engine} (task {task.name} of flow {flow.name}). "
+                        f"Expected in {list(self.engines)}."
+                    )
+        return plan
 
     def _prepare_messages(
         self,
@@ -72,13 +335,32 @@ class RailFlow:
     ):
         # image_url = encode_image(image_path)
 
+        static_prefix = ''
+        if self.prefix_caching:
+            static_prefix, variable_template = split_template(prompt_template)
+            text = render_template(variable_template, prompt_params) if static_prefix else ''
+        # A fully static prompt without image would leave the user message empty, keep it whole
+        if static_prefix and (image_path or text.strip()):
+            # Most reused first: the instructions, then the image (shared by the requests of
+            # one image, e.g. a sweep), then the per-request text
+            return [
+                {"role": "system", "content": static_prefix},
+                {
+                    "role": "user",
+                    "content": [
+                        *([{"type": "image_url", "image_url": {"url": encode_image(image_path)}}] if image_path else []),
+                        *([{"type": "text", "text": text}] if text.strip() else []),
+                    ],
+                },
+            ]
+
         messages = [
             {
                 "role": "user",
                 "content": [
                     {
                         "type": "text",
-                        "text": Template(prompt_template).render(**prompt_params),
+                        "text": render_template(prompt_template, prompt_params),
                     },
                     *(
                         [
@@ -125,17 +407,34 @@ class RailFlow:
         params:dict={},
         generation_params:dict={},
         image_path:str=None,
+        preprocess:PreprocessConfig=None,
+        usage:dict=None,
+        return_choices:bool=False,
+        engine:str=None,
     ):
-        messages = self._prepare_messages(
-            prompt_template=task,
-            prompt_params=params,
-            image_path=image_path,
-        )
+        with self.tracer.span('prepare_messages') as span:
+            if preprocess and image_path:
+                image_path = preprocess_image(image_path, **preprocess.__dict__)
 
-        response = self.engine.chat.completions.create(
-            messages=messages,
-            **generation_params,
-        )
+            messages = self._prepare_messages(
+                prompt_template=task,
+                prompt_params=params,
+                image_path=image_path,
+            )
+            if span.recording:
+                span.payload_bytes = payload_bytes(messages)
+
+        with self.tracer.span('engine', payload_bytes=span.payload_bytes) as span:
+            response = self.get_engine(engine).chat.completions.create(
+                messages=messages,
+                **generation_params,
+            )
+            if span.recording:
+                span.record_usage(response)
+        self.stats.record_usage(response)
+        _add_usage(usage, response)
+        if return_choices:
+            return [choice.message.content for choice in response.choices]
         return response.choices[0].message.content
 
     def execute_function_task(
@@ -145,26 +444,67 @@ class RailFlow:
         params:dict={},
         generation_params:dict={},
         image_path:str=None,
+        preprocess:PreprocessConfig=None,
+        usage:dict=None,
+        function=None,
+        cpu_bound:bool=False,
     ):
-        if source:
-            source = source.replace('/', '.')
-            module = importlib.import_module(source)
-            function = getattr(module, task)
-            if not function:
-                raise ValueError(
-                    f"Function '{task}' not found in module '{source}'.",
-                    "Please ensure the function exists."
-                )
-        else:
-            function = globals().get(task, None)
-            if not function:
-                raise ValueError(
-                    f"Function '{task}' not found in global scope or module '{source}'.",
-                    "Please ensure the function exists."
-                )
+        # Compiled plans carry the callable resolved at config load
+        function = function or resolve_function(task, source)
+        if cpu_bound and self.process_pool is not None:
+            return self.process_pool.submit(function, **params).result()
         return function(**params)
 
-    def execute_condition(self, type:TaskType, **kwargs):
+    async def aexecute_prompt_task(
+        self,
+        task:str,
+        source:str=None,
+        params:dict={},
+        generation_params:dict={},
+        image_path:str=None,
+        preprocess:PreprocessConfig=None,
+        usage:dict=None,
+        return_choices:bool=False,
+        engine:str=None,
+    ):
+        # Preprocessing, rendering and image encoding are blocking, keep them off the event loop
+        with self.tracer.span('prepare_messages') as span:
+            if preprocess and image_path:
+                image_path = await asyncio.to_thread(preprocess_image, image_path, **preprocess.__dict__)
+
+            messages = await asyncio.to_thread(
+                self._prepare_messages,
+                prompt_template=task,
+                prompt_params=params,
+                image_path=image_path,
+            )
+            if span.recording:
+                span.payload_bytes = payload_bytes(messages)
+
+        with self.tracer.span('engine', payload_bytes=span.payload_bytes) as span:
+            response = await self.get_engine(engine).chat.completions.create(
+                messages=messages,
+                **generation_params,
+            )
+            if span.recording:
+                span.record_usage(response)
+        self.stats.record_usage(response)
+        _add_usage(usage, response)
+        if return_choices:
+            return [choice.message.content for choice in response.choices]
+        return response.choices[0].message.content
+
+    async def aexecute_function_task(self, **kwargs):
+        # CPU-bound functions run in the process pool, others (e.g. output parsing) in a worker thread
+        if kwargs.get('cpu_bound') and self.process_pool is not None:
+            function = kwargs.get('function') or resolve_function(kwargs['task'], kwargs.get('source'))
+            return await asyncio.wrap_future(self.process_pool.submit(function, **kwargs.get('params', {})))
+        return await asyncio.to_thread(self.execute_function_task, **kwargs)
+
+    def execute_condition(self, type:TaskType, classifier:LabelClassifier=None, **kwargs):
+        if classifier is not None:
+            kwargs['generation_params'] = classifier.generation_params(kwargs.get('generation_params', {}))
+            return classifier.match(self.execute_condition(type, **kwargs))
         if type == TaskType.prompt:
             return self.execute_prompt_task(**kwargs)
         elif type == TaskType.function:
@@ -178,37 +518,691 @@ class RailFlow:
             return self.execute_function_task(**kwargs)
         return ValueError(f"Invalid TaskType: {type}. Expected in {TaskType.__annotations__}.")
 
+    async def aexecute_condition(self, type:TaskType, classifier:LabelClassifier=None, **kwargs):
+        if classifier is not None:
+            kwargs['generation_params'] = classifier.generation_params(kwargs.get('generation_params', {}))
+            return classifier.match(await self.aexecute_condition(type, **kwargs))
+        if type == TaskType.prompt:
+            return await self.aexecute_prompt_task(**kwargs)
+        elif type == TaskType.function:
+            return await self.aexecute_function_task(**kwargs)
+        return ValueError(f"Invalid TaskType: {type}. Expected in {TaskType.__annotations__}.")
+
+    async def aexecute_action(self, type:TaskType, **kwargs):
+        if type == TaskType.prompt:
+            return await self.aexecute_prompt_task(**kwargs)
+        elif type == TaskType.function:
+            return await self.aexecute_function_task(**kwargs)
+        return ValueError(f"Invalid TaskType: {type}. Expected in {TaskType.__annotations__}.")
+
+    def _prepare_packed_condition(self, condition, image_paths:List[str], generation_params:dict):
+        if condition.preprocess:
+            image_paths = [preprocess_image(image_path, **condition.preprocess.__dict__) for image_path in image_paths]
+        messages = prepare_packed_messages(condition.task, condition.params, image_paths)
+        return messages, packed_generation_params(generation_params, condition.classifier, len(image_paths))
+
+    def execute_packed_condition(self, condition, image_paths:List[str], generation_params:dict={}):
+        """Asks a prompt condition about several images in one request.
+
+        Returns the answer of each image (None where it could not be parsed) and the response.
+        """
+        with self.tracer.span('condition', task=condition.name):
+            with self.tracer.span('prepare_messages') as prepare_span:
+                messages, params = self._prepare_packed_condition(condition, image_paths, generation_params)
+                if prepare_span.recording:
+                    prepare_span.payload_bytes = payload_bytes(messages)
+            with self.tracer.span('engine', payload_bytes=prepare_span.payload_bytes) as engine_span:
+                response = self.get_engine(condition.engine).chat.completions.create(messages=messages, **params)
+                if engine_span.recording:
+                    engine_span.record_usage(response)
+        self.stats.condition_calls_packed += 1
+        self.stats.record_usage(response)
+        return parse_packed_response(response.choices[0].message.content, len(image_paths)), response
+
+    async def aexecute_packed_condition(self, condition, image_paths:List[str], generation_params:dict={}):
+        """Async counterpart of `execute_packed_condition`."""
+        with self.tracer.span('condition', task=condition.name):
+            with self.tracer.span('prepare_messages') as prepare_span:
+                messages, params = await asyncio.to_thread(
+                    self._prepare_packed_condition, condition, image_paths, generation_params,
+                )
+                if prepare_span.recording:
+                    prepare_span.payload_bytes = payload_bytes(messages)
+            with self.tracer.span('engine', payload_bytes=prepare_span.payload_bytes) as engine_span:
+                response = await self.get_engine(condition.engine).chat.completions.create(messages=messages, **params)
+                if engine_span.recording:
+                    engine_span.record_usage(response)
+        self.stats.condition_calls_packed += 1
+        self.stats.record_usage(response)
+        return parse_packed_response(response.choices[0].message.content, len(image_paths)), response
+
+    def pack_conditions(
+        self,
+        flows:Union[ExecutionPlan, Dict[str, FlowConfig]],
+        image_paths:List[str],
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+    ) -> Dict[str, PackedConditions]:
+        """Evaluates the prompt conditions of `flows` for several images with one request per
+        condition, and returns per image the responses to pass to `generate` as `packed_conditions`.
+
+        Flows are walked in order: a condition is only packed for the images that did not
+        select an action of an earlier flow. Images whose answer cannot be parsed (or a failed
+        packed request) are left out, so `generate` falls back to single-image calls for them.
+
+        Args:
+            flows: The flows to be evaluated on each image.
+            image_paths: The images to pack into each condition request.
+        """
+        plan = self.check_engines(compile_flows(flows, action_params, condition_params))
+        packed = {image_path: PackedConditions() for image_path in image_paths}
+        pending = list(packed)
+        for flow in plan:
+            condition = flow.condition
+            # Unconditional flows select every pending image; function conditions run per image
+            if len(pending) < 2 or condition is None or condition.type != TaskType.prompt:
+                break
+            try:
+                answers, response = self.execute_packed_condition(condition, pending, generation_params)
+            except Exception:
+                break
+            _seed_packed_conditions(packed, condition, pending, answers, response)
+            pending = _packed_images_pending(packed, flow, pending)
+        return packed
+
+    async def apack_conditions(
+        self,
+        flows:Union[ExecutionPlan, Dict[str, FlowConfig]],
+        image_paths:List[str],
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+    ) -> Dict[str, PackedConditions]:
+        """Async counterpart of `pack_conditions`."""
+        plan = self.check_engines(compile_flows(flows, action_params, condition_params))
+        packed = {image_path: PackedConditions() for image_path in image_paths}
+        pending = list(packed)
+        for flow in plan:
+            condition = flow.condition
+            if len(pending) < 2 or condition is None or condition.type != TaskType.prompt:
+                break
+            try:
+                answers, response = await self.aexecute_packed_condition(condition, pending, generation_params)
+            except Exception:
+                break
+            _seed_packed_conditions(packed, condition, pending, answers, response)
+            pending = _packed_images_pending(packed, flow, pending)
+        return packed
+
+    def _select_flow(
+        self,
+        plan:ExecutionPlan,
+        generation_params:dict,
+        image_path:str,
+        result:FlowResult,
+        condition_responses:dict,
+        seeded:set=frozenset(),
+    ):
+        """Evaluates the conditions of `plan` in order and returns the first flow whose
+        condition response selects one of its actions, with that action.
+
+        Flows sharing a condition evaluate it once: responses are memoized in `condition_responses`.
+        `seeded` holds the keys of the responses obtained from packed requests, counted apart
+        from the shared ones. The condition response and token usage are recorded in `result`.
+
+        Raises:
+            NoMatchingFlowError: If no flow selects an action.
+        """
+        counted = set()
+        for flow in plan:
+
+            if _condition:=flow.condition:
+                _key = _condition_key(_condition, image_path)
+                if _key in seeded and _key not in counted:
+                    counted.add(_key)
+                    self.stats.condition_calls_seeded += 1
+                elif _key in condition_responses:
+                    self.stats.condition_calls_deduplicated += 1
+                else:
+                    self.stats.condition_calls += 1
+                    with self.tracer.span('condition', flow=flow.name, task=_condition.name, image_path=image_path):
+                        condition_responses[_key] = self.execute_condition(
+                            **_condition.as_kwargs(),
+                            generation_params=generation_params,
+                            image_path=image_path,
+                            usage=result.usage,
+                        )
+                result.condition_response = condition_responses[_key]
+                _selected_action = flow.actions.get(result.condition_response)
+            else:
+                _selected_action = flow.actions.get(DEFAULT_CONDITION)
+
+            # The condition response selects none of this flow's actions, try the next flow
+            if _selected_action is None:
+                continue
+
+            result.flow = flow.name
+            return flow, _selected_action
+        raise NoMatchingFlowError(image_path, plan)
+
+    async def _aselect_flow(
+        self,
+        plan:ExecutionPlan,
+        generation_params:dict,
+        image_path:str,
+        result:FlowResult,
+        condition_responses:dict,
+        seeded:set=frozenset(),
+    ):
+        """Async counterpart of `_select_flow`."""
+        counted = set()
+        for flow in plan:
+
+            if _condition:=flow.condition:
+                _key = _condition_key(_condition, image_path)
+                if _key in seeded and _key not in counted:
+                    counted.add(_key)
+                    self.stats.condition_calls_seeded += 1
+                elif _key in condition_responses:
+                    self.stats.condition_calls_deduplicated += 1
+                else:
+                    self.stats.condition_calls += 1
+                    with self.tracer.span('condition', flow=flow.name, task=_condition.name, image_path=image_path):
+                        condition_responses[_key] = await self.aexecute_condition(
+                            **_condition.as_kwargs(),
+                            generation_params=generation_params,
+                            image_path=image_path,
+                            usage=result.usage,
+                        )
+                result.condition_response = condition_responses[_key]
+                _selected_action = flow.actions.get(result.condition_response)
+            else:
+                _selected_action = flow.actions.get(DEFAULT_CONDITION)
+
+            # The condition response selects none of this flow's actions, try the next flow
+            if _selected_action is None:
+                continue
+
+            result.flow = flow.name
+            return flow, _selected_action
+        raise NoMatchingFlowError(image_path, plan)
+
     def generate(
         self,
-        flows:Dict[str, List[FlowConfig]],
+        flows:Union[ExecutionPlan, Dict[str, FlowConfig]],
         generation_params:dict={},
         action_params:dict={},
         condition_params:dict={},
         image_path:str=None,
+        return_result:bool=False,
+        packed_conditions:PackedConditions=None,
     ):
-        _flows = copy.deepcopy(flows)
-        update_flow_params(
-            _flows,
-            action_params=action_params,
-            condition_params=condition_params
-        )
+        _plan = self.check_engines(compile_flows(flows, action_params, condition_params))
 
-        for _, flow in _flows.items():
+        _result = FlowResult(image_path=image_path)
 
-            if _condition:=flow.condition:
-                _condition_response = self.execute_condition(
-                    **_condition.__dict__,
+        # Flows sharing a condition evaluate it once for this image; packed requests may have already
+        if packed_conditions is not None:
+            _result.usage.update(packed_conditions.usage)
+        _condition_responses = dict(packed_conditions.responses) if packed_conditions is not None else {}
+
+        flow, _selected_action = self._select_flow(_plan, generation_params, image_path, _result, _condition_responses, set(_condition_responses))
+
+        self.stats.action_calls += 1
+        with self.tracer.span('action', flow=flow.name, task=_selected_action.name, image_path=image_path):
+            _result.output = self.execute_action(
+                **_selected_action.as_kwargs(),
+                generation_params=generation_params,
+                image_path=image_path,
+                usage=_result.usage,
+            )
+        return _result if return_result else _result.output
+
+    async def agenerate(
+        self,
+        flows:Union[ExecutionPlan, Dict[str, FlowConfig]],
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+        image_path:str=None,
+        return_result:bool=False,
+        packed_conditions:PackedConditions=None,
+    ):
+        """Async counterpart of `generate`, to be used with an async engine
+        (e.g. `AsyncOpenAIWrapper`)."""
+        _plan = self.check_engines(compile_flows(flows, action_params, condition_params))
+
+        _result = FlowResult(image_path=image_path)
+
+        # Flows sharing a condition evaluate it once for this image; packed requests may have already
+        if packed_conditions is not None:
+            _result.usage.update(packed_conditions.usage)
+        _condition_responses = dict(packed_conditions.responses) if packed_conditions is not None else {}
+
+        flow, _selected_action = await self._aselect_flow(_plan, generation_params, image_path, _result, _condition_responses, set(_condition_responses))
+
+        self.stats.action_calls += 1
+        with self.tracer.span('action', flow=flow.name, task=_selected_action.name, image_path=image_path):
+            _result.output = await self.aexecute_action(
+                **_selected_action.as_kwargs(),
+                generation_params=generation_params,
+                image_path=image_path,
+                usage=_result.usage,
+            )
+        return _result if return_result else _result.output
+
+    def _sweep_requests(self, plan:ExecutionPlan, flow, selection:FlowResult, variants:List[dict]):
+        """Groups the sweep variants by the request they render to.
+
+        Returns `(action, variant indices)` pairs: variants whose prompt renders to the same
+        text (or whose function task gets the same params) share one request.
+        """
+        index = plan.flows.index(flow)
+        action_key = selection.condition_response if flow.condition else DEFAULT_CONDITION
+        requests = {}
+        for number, params in enumerate(variants):
+            action = plan.overlay(params).flows[index].actions.get(action_key)
+            if action.type == TaskType.prompt:
+                key = json.dumps([render_template(action.task, action.params), repr(action.preprocess), action.engine])
+            else:
+                key = _condition_key(action)
+            requests.setdefault(key, (action, []))[1].append(number)
+        return list(requests.values())
+
+    def _sweep_records(
+        self,
+        selection:FlowResult,
+        variants:List[dict],
+        samples:int,
+        requests:list,
+        outputs:List[Tuple[list, dict]],
+    ) -> List[SweepResult]:
+        """Splits the outputs of each sweep request into one record per variant and sample,
+        in variant order. Each record gets an even share of the condition and request usage."""
+        records = [None] * (len(variants) * samples)
+        condition_usage = _share_usage(selection.usage, len(records))
+        for (action, numbers), (choices, usage) in zip(requests, outputs):
+            usage = _share_usage(usage, len(choices))
+            choices = iter(choices)
+            for number in numbers:
+                for sample in range(samples):
+                    records[number * samples + sample] = SweepResult(
+                        image_path=selection.image_path,
+                        flow=selection.flow,
+                        condition_response=selection.condition_response,
+                        output=next(choices),
+                        usage={key: condition_usage.get(key, 0) + usage.get(key, 0) for key in dict.fromkeys([*condition_usage, *usage])},
+                        params=variants[number],
+                        sample=sample,
+                    )
+        return records
+
+    def _execute_sweep_action(self, action, count:int, generation_params:dict, image_path:str, use_n:bool):
+        """Returns `count` outputs of `action` and the usage of the requests made for them."""
+        usage = {}
+        kwargs = dict(**action.as_kwargs(), image_path=image_path, usage=usage)
+        if action.type != TaskType.prompt:
+            self.stats.action_calls += 1
+            return [self.execute_action(**kwargs, generation_params=generation_params)] * count, usage
+
+        choices = []
+        while len(choices) < count:
+            # Engines that ignore `n` return a single choice, the remaining ones are requested again
+            n = count - len(choices) if use_n else 1
+            self.stats.action_calls += 1
+            choices += self.execute_action(
+                **kwargs,
+                generation_params={**generation_params, 'n': n} if n > 1 else generation_params,
+                return_choices=True,
+            )[:n]
+        return choices, usage
+
+    async def _aexecute_sweep_action(self, action, count:int, generation_params:dict, image_path:str, use_n:bool):
+        """Async counterpart of `_execute_sweep_action`."""
+        usage = {}
+        kwargs = dict(**action.as_kwargs(), image_path=image_path, usage=usage)
+        if action.type != TaskType.prompt:
+            self.stats.action_calls += 1
+            return [await self.aexecute_action(**kwargs, generation_params=generation_params)] * count, usage
+
+        choices = []
+        while len(choices) < count:
+            n = count - len(choices) if use_n else 1
+            self.stats.action_calls += 1
+            choices += (await self.aexecute_action(
+                **kwargs,
+                generation_params={**generation_params, 'n': n} if n > 1 else generation_params,
+                return_choices=True,
+            ))[:n]
+        return choices, usage
+
+    def sweep(
+        self,
+        flows:Union[ExecutionPlan, Dict[str, FlowConfig]],
+        action_param_grid:Union[Dict[str, list], Iterable[dict]],
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+        image_path:str=None,
+        samples:int=1,
+        use_n:bool=True,
+        return_result:bool=False,
+    ) -> List[Union[object, SweepResult]]:
+        """Runs the selected action of an image with every variant of `action_param_grid`.
+
+        The conditions are evaluated once for the image, then each variant's params are laid
+        over the selected action (with the same flow/action-key scoping as `action_params`).
+        Variants rendering to the same prompt are collapsed into one request, which asks for
+        all their choices at once with the engine's `n` parameter.
+
+        Args:
+            flows: The flows to evaluate on the image.
+            action_param_grid: The action params of each variant, see `expand_param_grid`.
+            image_path: The image to evaluate.
+            samples: Number of outputs per variant; use a sampling temperature in
+                `generation_params` for them to differ.
+            use_n: If False, every output is its own request, for engines without `n` support.
+            return_result: If True, returns `SweepResult`s instead of the action outputs.
+
+        Returns:
+            One output (or `SweepResult`) per variant and sample, in variant order.
+        """
+        if samples < 1:
+            raise ValueError(f"samples must be >= 1, got {samples}.")
+
+        plan = self.check_engines(compile_flows(flows, action_params, condition_params))
+        selection = FlowResult(image_path=image_path)
+        flow, _ = self._select_flow(plan, generation_params, image_path, selection, {})
+
+        variants = expand_param_grid(action_param_grid)
+        requests = self._sweep_requests(plan, flow, selection, variants)
+        outputs = []
+        for action, numbers in requests:
+            with self.tracer.span('action', flow=flow.name, task=action.name, image_path=image_path):
+                outputs.append(self._execute_sweep_action(action, len(numbers) * samples, generation_params, image_path, use_n))
+
+        records = self._sweep_records(selection, variants, samples, requests, outputs)
+        return records if return_result else [record.output for record in records]
+
+    async def asweep(
+        self,
+        flows:Union[ExecutionPlan, Dict[str, FlowConfig]],
+        action_param_grid:Union[Dict[str, list], Iterable[dict]],
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+        image_path:str=None,
+        samples:int=1,
+        use_n:bool=True,
+        return_result:bool=False,
+    ) -> List[Union[object, SweepResult]]:
+        """Async counterpart of `sweep`; the requests of distinct prompts run concurrently."""
+        if samples < 1:
+            raise ValueError(f"samples must be >= 1, got {samples}.")
+
+        plan = self.check_engines(compile_flows(flows, action_params, condition_params))
+        selection = FlowResult(image_path=image_path)
+        flow, _ = await self._aselect_flow(plan, generation_params, image_path, selection, {})
+
+        variants = expand_param_grid(action_param_grid)
+        requests = self._sweep_requests(plan, flow, selection, variants)
+
+        async def _execute(action, numbers):
+            with self.tracer.span('action', flow=flow.name, task=action.name, image_path=image_path):
+                return await self._aexecute_sweep_action(action, len(numbers) * samples, generation_params, image_path, use_n)
+
+        outputs = await asyncio.gather(*(_execute(action, numbers) for action, numbers in requests))
+        records = self._sweep_records(selection, variants, samples, requests, outputs)
+        return records if return_result else [record.output for record in records]
+
+    async def generate_batch(
+        self,
+        flows:Union[ExecutionPlan, Dict[str, FlowConfig]],
+        image_paths:Union[Iterable[str], AsyncIterable[str]],
+        max_concurrency:int=16,
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+        return_exceptions:bool=False,
+        return_result:bool=False,
+        condition_pack_size:int=1,
+    ) -> AsyncIterator[Tuple[str, Union[str, FlowResult]]]:
+        """Runs `agenerate` over many images and yields `(image_path, result)` pairs
+        in completion order.
+
+        At most `max_concurrency` images are in flight at any time and `image_paths`
+        is consumed lazily, so it can be a generator over an arbitrarily large corpus.
+
+        Args:
+            flows: The flows to evaluate for each image.
+            image_paths: Paths of the images to process, an iterable or an async iterable
+                (e.g. one leasing inputs from a queue without blocking the event loop).
+            max_concurrency: Maximum number of images evaluated concurrently.
+            return_exceptions: If True, a failing image yields `(image_path, exception)`
+                instead of aborting the whole batch.
+            return_result: If True, yields `FlowResult`s instead of the action outputs.
+            condition_pack_size: If > 1, images are taken in groups of this size whose prompt
+                conditions are asked in one request per group (see `pack_conditions`), cutting
+                condition requests about N-fold; `max_concurrency` still bounds the images in flight,
+                so packs hold at most `max_concurrency` images.
+        """
+        if max_concurrency < 1:
+            raise ValueError(f"max_concurrency must be >= 1, got {max_concurrency}.")
+        condition_pack_size = min(max(condition_pack_size, 1), max_concurrency)
+
+        # Compile and apply the overrides once for the whole batch
+        plan = self.check_engines(compile_flows(flows, action_params, condition_params))
+
+        async def _generate(image_path, packed_conditions=None):
+            try:
+                return image_path, await self.agenerate(
+                    plan,
                     generation_params=generation_params,
                     image_path=image_path,
+                    return_result=return_result,
+                    packed_conditions=packed_conditions,
                 )
-                _action = flow.action
-                _selected_action = _action[_condition_response]
-            else:
-                _action = flow.action
-                _selected_action = _action[DEFAULT_CONDITION]
-            return self.execute_action(
-                **_selected_action.__dict__,
-                generation_params=generation_params,
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return image_path, e
+
+        async def _generate_unit(image_paths):
+            if len(image_paths) == 1:
+                return [await _generate(image_paths[0])]
+            packed = await self.apack_conditions(plan, image_paths, generation_params)
+            return await _gather_or_cancel(_generate(image_path, packed[image_path]) for image_path in image_paths)
+
+        # Each unit of work is one image, or one pack of images sharing condition requests
+        image_paths = aiter(image_paths) if hasattr(image_paths, '__aiter__') else iter(image_paths)
+        max_units = max_concurrency // condition_pack_size
+
+        pending = set()
+        try:
+            while True:
+                while len(pending) < max_units and (unit := await _take(image_paths, condition_pack_size)):
+                    pending.add(asyncio.create_task(_generate_unit(unit)))
+                if not pending:
+                    return
+
+                done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    for item in task.result():
+                        yield item
+        finally:
+            # Stop the requests still in flight before the generator closes
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+
+    def generate_rails(
+        self,
+        rails:Union[RailPlan, RailConfig],
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+        image_path:str=None,
+        return_result:bool=False,
+    ):
+        """Runs the input rail, then feeds its output to the output rail (if any).
+
+        The output rail receives the input rail's output as the `text` param.
+        """
+        plan = self.check_engines(_compile_rails(rails, action_params, condition_params))
+        result = RailResult(
+            image_path=image_path,
+            input=self.generate(plan.input, generation_params, image_path=image_path, return_result=True),
+        )
+        if plan.output:
+            rail_input = {OUTPUT_RAIL_INPUT_PARAM: result.input.output}
+            result.output = self.generate(
+                plan.output,
+                generation_params,
+                action_params=rail_input,
+                condition_params=rail_input,
                 image_path=image_path,
+                return_result=True,
             )
-        raise NoMatchingFlowError(image_path, _flows)
\ No newline at end of file
+        return result if return_result else result.final_output
+
+    async def agenerate_rails(
+        self,
+        rails:Union[RailPlan, RailConfig],
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+        image_path:str=None,
+        return_result:bool=False,
+    ):
+        """Async counterpart of `generate_rails`."""
+        plan = self.check_engines(_compile_rails(rails, action_params, condition_params))
+        result = RailResult(
+            image_path=image_path,
+            input=await self.agenerate(plan.input, generation_params, image_path=image_path, return_result=True),
+        )
+        if plan.output:
+            rail_input = {OUTPUT_RAIL_INPUT_PARAM: result.input.output}
+            result.output = await self.agenerate(
+                plan.output,
+                generation_params,
+                action_params=rail_input,
+                condition_params=rail_input,
+                image_path=image_path,
+                return_result=True,
+            )
+        return result if return_result else result.final_output
+
+    async def generate_pipeline(
+        self,
+        rails:Union[RailPlan, RailConfig],
+        image_paths:Iterable[str],
+        input_concurrency:int=16,
+        output_concurrency:int=4,
+        queue_size:int=None,
+        generation_params:dict={},
+        action_params:dict={},
+        condition_params:dict={},
+        return_exceptions:bool=False,
+        return_result:bool=False,
+        condition_pack_size:int=1,
+    ) -> AsyncIterator[Tuple[str, Union[object, RailResult]]]:
+        """Runs input -> output rails as a two-stage pipeline and yields `(image_path, output)`
+        pairs as images leave the last stage.
+
+        The input stage is `generate_batch` over the input rail; its results go through a
+        bounded queue to `output_concurrency` output workers, so output rails (e.g. parsing
+        functions, which run in worker threads) overlap with the requests of the input stage.
+
+        Args:
+            rails: The rails (or compiled `RailPlan`) to run.
+            image_paths: Paths of the images to process (an iterable or an async iterable),
+                consumed lazily.
+            input_concurrency: Maximum number of images in flight in the input stage.
+            output_concurrency: Number of concurrent output-rail workers.
+            queue_size: Capacity of the queues between stages, defaults to 2 * output_concurrency.
+            return_exceptions: If True, a failing image yields `(image_path, exception)`
+                instead of aborting the whole pipeline.
+            return_result: If True, yields `RailResult`s instead of the final outputs.
+            condition_pack_size: Packs the input rail's conditions, see `generate_batch`.
+        """
+        if output_concurrency < 1:
+            raise ValueError(f"output_concurrency must be >= 1, got {output_concurrency}.")
+
+        plan = self.check_engines(_compile_rails(rails, action_params, condition_params))
+        handoff = asyncio.Queue(maxsize=queue_size or 2 * output_concurrency)
+        results = asyncio.Queue(maxsize=queue_size or 2 * output_concurrency)
+
+        async def input_stage():
+            batch = self.generate_batch(
+                plan.input,
+                image_paths,
+                max_concurrency=input_concurrency,
+                generation_params=generation_params,
+                return_exceptions=True,
+                return_result=True,
+                condition_pack_size=condition_pack_size,
+            )
+            cancelled = False
+            try:
+                async with contextlib.aclosing(batch):
+                    async for image_path, input_result in batch:
+                        await handoff.put((image_path, input_result))
+            except asyncio.CancelledError:
+                cancelled = True
+                raise
+            finally:
+                # A cancelled pipeline has no output worker left to wake up (and a full queue)
+                if not cancelled:
+                    for _ in range(output_concurrency):
+                        await handoff.put(_PIPELINE_DONE)
+
+        async def output_stage():
+            while (item := await handoff.get()) is not _PIPELINE_DONE:
+                image_path, input_result = item
+                if isinstance(input_result, Exception):
+                    await results.put((image_path, input_result))
+                    continue
+
+                result = RailResult(image_path=image_path, input=input_result)
+                try:
+                    if plan.output:
+                        rail_input = {OUTPUT_RAIL_INPUT_PARAM: input_result.output}
+                        result.output = await self.agenerate(
+                            plan.output,
+                            generation_params,
+                            action_params=rail_input,
+                            condition_params=rail_input,
+                            image_path=image_path,
+                            return_result=True,
+                        )
+                except Exception as e:
+                    result = e
+                await results.put((image_path, result))
+            await results.put(_PIPELINE_DONE)
+
+        input_task = asyncio.create_task(input_stage())
+        output_tasks = [asyncio.create_task(output_stage()) for _ in range(output_concurrency)]
+        try:
+            finished = 0
+            while finished < output_concurrency:
+                item = await results.get()
+                if item is _PIPELINE_DONE:
+                    finished += 1
+                    continue
+
+                image_path, result = item
+                if isinstance(result, Exception):
+                    if not return_exceptions:
+                        raise result
+                    yield image_path, result
+                else:
+                    yield image_path, result if return_result else result.final_output
+
+            # Surface errors raised while feeding the pipeline (e.g. by the image_paths iterator)
+            await input_task
+        finally:
+            tasks = [input_task, *output_tasks]
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
@@ -0,0 +1,91 @@
+import re
+import json
+from typing import List, Optional
+
+from utils.image_process import encode_image
+from .classifier import LabelClassifier
+from .template import render_template
+
+
+PACKING_INSTRUCTION = (
+    "You are given {count} images, numbered 1 to {count}. Answer the instruction above for each "
+    "image separately. Reply with exactly one line per image, in order, formatted as "
+    "`<image number>: <answer>`, and nothing else."
+)
+
+_ANSWER_LINE = re.compile(r'^\W*(?:image\s*)?#?(\d+)\s*[:.)\-]\s*(.*?)\s*$', re.IGNORECASE | re.MULTILINE)
+
+
+def prepare_packed_messages(prompt_template:str, prompt_params:dict, image_paths:List[str]) -> list:
+    """Builds one user message asking `prompt_template` about every image of `image_paths`."""
+    content = [
+        {
+            "type": "text",
+            "text": render_template(prompt_template, prompt_params) + "\n\n" + PACKING_INSTRUCTION.format(count=len(image_paths)),
+        },
+    ]
+    for number, image_path in enumerate(image_paths, 1):
+        content.append({"type": "text", "text": f"Image {number}:"})
+        content.append({"type": "image_url", "image_url": {"url": encode_image(image_path)}})
+    return [{"role": "user", "content": content}]
+
+
+def packed_generation_params(generation_params:dict, classifier:LabelClassifier, count:int) -> dict:
+    """Returns the generation params of a packed condition request over `count` images.
+
+    Classify-mode conditions keep their per-label output cap, scaled by `count`; with
+    structured output the response is constrained to an array of `count` labels.
+    """
+    if classifier is None:
+        return generation_params
+
+    params = classifier.generation_params(generation_params)
+    cap_key = 'max_completion_tokens' if 'max_completion_tokens' in params else 'max_tokens'
+    params[cap_key] = (classifier.max_tokens + 4) * count
+    if classifier.structured_output:
+        params['response_format'] = {
+            'type': 'json_schema',
+            'json_schema': {
+                'name': 'labels',
+                'strict': True,
+                'schema': {
+                    'type': 'object',
+                    'properties': {
+                        'labels': {
+                            'type': 'array',
+                            'items': {'type': 'string', 'enum': list(classifier.labels)},
+                            'minItems': count,
+                            'maxItems': count,
+                        },
+                    },
+                    'required': ['labels'],
+                    'additionalProperties': False,
+                },
+            },
+        }
+    return params
+
+
+def parse_packed_response(content:str, count:int) -> List[Optional[str]]:
+    """Returns the answer for each of the `count` images, None where it cannot be parsed.
+
+    Accepts `{"labels": [...]}` (structured output) or one `<number>: <answer>` line per image.
+    """
+    if not isinstance(content, str):
+        return [None] * count
+
+    try:
+        labels = json.loads(content)
+        if isinstance(labels, dict):
+            labels = labels.get('labels')
+        if isinstance(labels, list) and len(labels) == count:
+            return [str(label) for label in labels]
+    except ValueError:
+        pass
+
+    answers = {}
+    for match in _ANSWER_LINE.finditer(content):
+        number = int(match.group(1))
+        if 1 <= number <= count and match.group(2):
+            answers.setdefault(number, match.group(2))
+    return [answers.get(number) for number in range(1, count + 1)]
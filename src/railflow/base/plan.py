@@ -0,0 +1,241 @@
+from types import MappingProxyType
+from typing import Dict, Iterable, Iterator, Mapping
+
+from utils.dict import CaseInsensitiveDict
+from .classifier import LabelClassifier
+from .config import DEFAULT_CONDITION, ConditionMode, FlowConfig, PreprocessConfig, TaskConfig, TaskType
+
+
+_EMPTY_PARAMS = MappingProxyType({})
+
+
+class _Immutable:
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"'{self.__class__.__name__}' object is immutable")
+
+    def __delattr__(self, name):
+        raise AttributeError(f"'{self.__class__.__name__}' object is immutable")
+
+
+class TaskPlan(_Immutable):
+    """An immutable, ready-to-execute condition or action."""
+
+    __slots__ = ('type', 'task', 'source', 'params', 'preprocess', 'name', 'function', 'cpu_bound', 'classifier', 'engine')
+
+    def __init__(
+        self,
+        type:TaskType,
+        task:str,
+        source:str=None,
+        params:Mapping=_EMPTY_PARAMS,
+        preprocess:PreprocessConfig=None,
+        name:str=None,
+        function=None,
+        cpu_bound:bool=False,
+        classifier:LabelClassifier=None,
+        engine:str=None,
+    ):
+        object.__setattr__(self, 'type', type)
+        object.__setattr__(self, 'task', task)
+        object.__setattr__(self, 'source', source)
+        object.__setattr__(self, 'params', MappingProxyType(dict(params)) if params else _EMPTY_PARAMS)
+        object.__setattr__(self, 'preprocess', preprocess)
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'function', function)
+        object.__setattr__(self, 'cpu_bound', cpu_bound)
+        object.__setattr__(self, 'classifier', classifier)
+        object.__setattr__(self, 'engine', engine)
+
+    @classmethod
+    def from_config(cls, config:TaskConfig, labels:Iterable[str]=()) -> 'TaskPlan':
+        """Compiles a task config; `labels` are the action keys a classify-mode condition chooses from."""
+        classifier = None
+        if getattr(config, 'mode', None) == ConditionMode.classify:
+            labels = list(config.labels or labels)
+            # A yes/no condition (only the default 'True' key) must also be able to answer no
+            if labels == [DEFAULT_CONDITION]:
+                labels.append('False')
+            classifier = LabelClassifier(labels, config.structured_output, config.max_tokens)
+
+        return cls(
+            type=config.type,
+            task=config.task,
+            source=config.source,
+            params=config.params or {},
+            preprocess=config.preprocess,
+            name=getattr(config, 'name', None),
+            function=getattr(config, 'function', None),
+            cpu_bound=getattr(config, 'cpu_bound', False),
+            classifier=classifier,
+            engine=getattr(config, 'engine', None),
+        )
+
+    def with_params(self, params:Mapping) -> 'TaskPlan':
+        """Returns a plan with `params` laid over the compiled params (self if there is nothing to override)."""
+        if not params:
+            return self
+        return TaskPlan(
+            self.type, self.task, self.source, {**self.params, **params},
+            self.preprocess, self.name, self.function, self.cpu_bound, self.classifier, self.engine,
+        )
+
+    def as_kwargs(self) -> dict:
+        """Returns the keyword arguments of `RailFlow.execute_condition`/`execute_action`."""
+        kwargs = {
+            'type': self.type,
+            'task': self.task,
+            'source': self.source,
+            'params': self.params,
+            'preprocess': self.preprocess,
+        }
+        if self.type == TaskType.function:
+            kwargs.update(function=self.function, cpu_bound=self.cpu_bound)
+        if self.classifier is not None:
+            kwargs['classifier'] = self.classifier
+        if self.engine is not None and self.type == TaskType.prompt:
+            kwargs['engine'] = self.engine
+        return kwargs
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(type={self.type!r}, task={self.task[:32]!r}, params={dict(self.params)})"
+
+
+class FlowPlan(_Immutable):
+    """An immutable flow: an optional condition and the actions selected by its response."""
+
+    __slots__ = ('name', 'condition', 'actions')
+
+    def __init__(self, name:str, condition:TaskPlan, actions:CaseInsensitiveDict):
+        object.__setattr__(self, 'name', name)
+        object.__setattr__(self, 'condition', condition)
+        object.__setattr__(self, 'actions', actions)
+
+    def overlay(self, action_params:Mapping=None, condition_params:Mapping=None) -> 'FlowPlan':
+        """Returns a flow with the given params laid over its tasks.
+
+        `action_params` maps either action keys (e.g. a condition response such as 'Chemistry')
+        to params for that action only, or param names to values for every action of the flow.
+        """
+        if not action_params and not condition_params:
+            return self
+
+        action_params = CaseInsensitiveDict(action_params or {})
+        shared_params = {key: value for key, value in action_params.items() if key not in self.actions}
+
+        # An action shared by several keys gets the shared params laid over only once
+        overlaid = {}
+        def overlay_action(key, action):
+            if key_params := action_params.get(key):
+                return action.with_params({**shared_params, **key_params})
+            if id(action) not in overlaid:
+                overlaid[id(action)] = action.with_params(shared_params)
+            return overlaid[id(action)]
+
+        actions = CaseInsensitiveDict({key: overlay_action(key, action) for key, action in self.actions.items()})
+        condition = self.condition.with_params(condition_params) if self.condition else None
+        return FlowPlan(self.name, condition, actions)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(name={self.name!r}, condition={self.condition!r}, actions={list(self.actions.keys())})"
+
+
+class ExecutionPlan(_Immutable):
+    """An immutable, ordered sequence of compiled flows.
+
+    Built once with `compile_flows` (or `RailConfig.compile`), then passed to `RailFlow.generate`
+    for every request; per-request params are applied with `overlay`, which only re-creates the
+    tasks it actually overrides.
+    """
+
+    __slots__ = ('flows',)
+
+    def __init__(self, flows):
+        object.__setattr__(self, 'flows', tuple(flows))
+
+    def __iter__(self) -> Iterator[FlowPlan]:
+        return iter(self.flows)
+
+    def __len__(self):
+        return len(self.flows)
+
+    def __bool__(self):
+        return bool(self.flows)
+
+    def keys(self):
+        return [flow.name for flow in self.flows]
+
+    def overlay(self, action_params:Mapping={}, condition_params:Mapping={}) -> 'ExecutionPlan':
+        """Returns a plan with per-request params laid over the compiled ones.
+
+        Keys of `action_params`/`condition_params` naming a flow hold params for that flow only;
+        any other key is a param applied to every flow. Flow-specific params take precedence.
+        """
+        if not action_params and not condition_params:
+            return self
+
+        names = set(self.keys())
+        global_action_params = {k: v for k, v in action_params.items() if k not in names}
+        global_condition_params = {k: v for k, v in condition_params.items() if k not in names}
+        return ExecutionPlan(
+            flow.overlay(
+                action_params={**global_action_params, **action_params.get(flow.name, {})},
+                condition_params={**global_condition_params, **condition_params.get(flow.name, {})},
+            )
+            for flow in self.flows
+        )
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}({list(self.flows)})"
+
+
+class RailPlan(_Immutable):
+    """Compiled input and output rails."""
+
+    __slots__ = ('input', 'output')
+
+    def __init__(self, input:ExecutionPlan, output:ExecutionPlan):
+        object.__setattr__(self, 'input', input)
+        object.__setattr__(self, 'output', output)
+
+    def __repr__(self):
+        return f"{self.__class__.__name__}(input={self.input!r}, output={self.output!r})"
+
+
+def compile_flows(
+    flows:Dict[str, FlowConfig],
+    action_params:Mapping={},
+    condition_params:Mapping={},
+) -> ExecutionPlan:
+    """Compiles flow configs, plus optional param overrides, into an immutable `ExecutionPlan`.
+
+    Args:
+        flows: Flow configs by name, e.g. `RailConfig.input.flows`.
+        action_params: Param overrides for actions (see `ExecutionPlan.overlay`).
+        condition_params: Param overrides for conditions (see `ExecutionPlan.overlay`).
+    """
+    if isinstance(flows, ExecutionPlan):
+        return flows.overlay(action_params, condition_params)
+
+    # A condition shared between flows classifies over the action keys of all of them
+    labels = {}
+    for flow in flows.values():
+        if flow.condition:
+            labels.setdefault(id(flow.condition), {}).update(dict.fromkeys(flow.action.keys()))
+
+    # Configs shared between flows or action keys compile to a single shared plan
+    compiled = {}
+    compile_task = lambda config: compiled.get(id(config)) or compiled.setdefault(
+        id(config), TaskPlan.from_config(config, labels.get(id(config), ())),
+    )
+
+    plan = ExecutionPlan(
+        FlowPlan(
+            name=name,
+            condition=compile_task(flow.condition) if flow.condition else None,
+            actions=CaseInsensitiveDict({key: compile_task(action) for key, action in flow.action.items()}),
+        )
+        for name, flow in flows.items()
+    )
+    return plan.overlay(action_params, condition_params)
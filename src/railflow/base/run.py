@@ -0,0 +1,372 @@
+import os
+import re
+import gzip
+import json
+import time
+import zlib
+import asyncio
+from dataclasses import asdict, dataclass, is_dataclass
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, Set, Union
+
+from .config import FlowConfig
+from .flow import FlowResult, RailFlow, RailResult
+from .plan import ExecutionPlan, compile_flows
+from .work_queue import WorkQueue, default_worker_id, select_shard
+
+
+def _lines(path:Path) -> Iterator[bytes]:
+    with open(path, 'rb') as f:
+        yield from f
+
+
+def _gzip_lines(path:Path, chunk_size:int=1 << 16) -> Iterator[bytes]:
+    """Yields the lines of a gzip file, up to where it was cut off by a crash (`gzip.open`
+    would drop everything decompressed since its last buffer refill)."""
+    decompressor = zlib.decompressobj(wbits=31)
+    pending = b''
+    with open(path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            try:
+                data = decompressor.decompress(chunk)
+                while decompressor.unused_data:
+                    # Appended gzip members
+                    chunk, decompressor = decompressor.unused_data, zlib.decompressobj(wbits=31)
+                    data += decompressor.decompress(chunk)
+            except zlib.error:
+                break
+            *lines, pending = (pending + data).split(b'\n')
+            for line in lines:
+                yield line + b'\n'
+    if pending:
+        yield pending
+
+
+class JSONLResultSink:
+    """
+    An append-only sink that streams results to sharded JSONL files, optionally gzip-compressed.
+
+    Each run writes to new shards (`<prefix>-<index>.jsonl[.gz]`), so shards left by a crashed
+    run are never reopened for writing. Records are flushed as they are written and fsynced
+    every `fsync_every` records or `fsync_interval` seconds, whichever comes first.
+
+    Args:
+        directory (str | Path): Directory of the shards.
+        prefix (str): File name prefix of the shards.
+        shard_size (int): Maximum number of records per shard.
+        compress (bool): Whether to gzip the shards.
+        fsync_every (int): Number of records between two fsyncs.
+        fsync_interval (float): Maximum number of seconds between two fsyncs.
+    """
+
+    def __init__(
+        self,
+        directory:Union[str, Path],
+        prefix:str='results',
+        shard_size:int=10000,
+        compress:bool=False,
+        fsync_every:int=100,
+        fsync_interval:float=5.0,
+    ):
+        self.directory = Path(directory)
+        self.prefix = prefix
+        self.shard_size = shard_size
+        self.compress = compress
+        self.fsync_every = fsync_every
+        self.fsync_interval = fsync_interval
+
+        self._file = None
+        self._raw_file = None
+        self._shard_index = None
+        self._shard_records = 0
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def shards(self):
+        """Returns the existing shards, in write order."""
+        pattern = re.compile(rf'^{re.escape(self.prefix)}-(\d+)\.jsonl(\.gz)?$')
+        shards = [
+            (int(match.group(1)), path)
+            for path in self.directory.glob(f'{self.prefix}-*.jsonl*')
+            if (match := pattern.match(path.name))
+        ]
+        return [path for _, path in sorted(shards)]
+
+    def read(self) -> Iterator[dict]:
+        """Yields the records of every existing shard.
+
+        A record truncated by a crash (last line of a shard) is skipped.
+        """
+        for path in self.shards():
+            for line in _gzip_lines(path) if path.suffix == '.gz' else _lines(path):
+                try:
+                    yield json.loads(line)
+                except (json.JSONDecodeError, UnicodeDecodeError):
+                    continue
+
+    def done_set(self) -> Set[str]:
+        """Returns the input paths that already have a successful record."""
+        return {
+            record['image_path']
+            for record in self.read()
+            if record.get('error') is None
+        }
+
+    def _open_next_shard(self):
+        self.close()
+        if self._shard_index is None:
+            self.directory.mkdir(parents=True, exist_ok=True)
+            existing = self.shards()
+            self._shard_index = int(existing[-1].name.split('-')[-1].split('.')[0]) + 1 if existing else 0
+        else:
+            self._shard_index += 1
+
+        suffix = '.jsonl.gz' if self.compress else '.jsonl'
+        path = self.directory / f'{self.prefix}-{self._shard_index:05d}{suffix}'
+        self._raw_file = open(path, 'xb')
+        self._file = gzip.open(self._raw_file, 'wt', encoding='utf-8') if self.compress else None
+        self._shard_records = 0
+
+    def write(self, record:Union[FlowResult, RailResult, dict]):
+        """Appends one record, rolling over to a new shard when the current one is full."""
+        if is_dataclass(record):
+            record = asdict(record)
+        if self._raw_file is None or self._shard_records >= self.shard_size:
+            self._open_next_shard()
+
+        line = json.dumps(record, ensure_ascii=False, default=str) + '\n'
+        if self._file is not None:
+            self._file.write(line)
+        else:
+            self._raw_file.write(line.encode('utf-8'))
+        self._shard_records += 1
+        self._unsynced += 1
+
+        if self._unsynced >= self.fsync_every or time.monotonic() - self._last_sync >= self.fsync_interval:
+            self.sync()
+        else:
+            self.flush()
+
+    def flush(self):
+        if self._file is not None:
+            self._file.flush()
+        if self._raw_file is not None:
+            self._raw_file.flush()
+
+    def sync(self):
+        """Flushes and fsyncs the current shard."""
+        if self._raw_file is None:
+            return
+        self.flush()
+        os.fsync(self._raw_file.fileno())
+        self._unsynced = 0
+        self._last_sync = time.monotonic()
+
+    def close(self):
+        if self._raw_file is None:
+            return
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        self._raw_file.flush()
+        os.fsync(self._raw_file.fileno())
+        self._raw_file.close()
+        self._raw_file = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+@dataclass
+class RunSummary:
+    """Counters of a `RunManager` run."""
+    skipped   :int = 0
+    succeeded :int = 0
+    failed    :int = 0
+
+
+class RunManager:
+    """
+    Runs a `RailFlow` over a corpus, streaming every result to a `JSONLResultSink` as it
+    completes and skipping inputs already recorded by a previous run.
+
+    Failed inputs are recorded with an `error` field and retried on the next run.
+
+    To spread a corpus over several workers (processes or nodes), either give each worker the
+    same inputs and its own `shard_index` (a static split by a stable hash of the path), or
+    fill a shared `WorkQueue` once and run `run_queue`/`arun_queue` on every worker, which
+    balances the load and takes over the inputs of crashed workers. Each worker should write
+    to its own sink prefix (e.g. `results-<worker>`), as shard file names are per prefix.
+
+    Args:
+        rail_flow (RailFlow): The flow runner; use an async engine for `arun`.
+        flows: The flows (or compiled plan) to evaluate on each input.
+        sink (JSONLResultSink): Where results are written.
+        shard_index (int): The shard of the inputs processed by `run`/`arun`, see `select_shard`.
+        num_shards (int): The number of shards the inputs are split into.
+        **generate_kwargs: Forwarded to `RailFlow.generate` (e.g. generation_params).
+    """
+
+    def __init__(
+        self,
+        rail_flow:RailFlow,
+        flows:Union[ExecutionPlan, Dict[str, FlowConfig]],
+        sink:JSONLResultSink,
+        shard_index:int=0,
+        num_shards:int=1,
+        **generate_kwargs,
+    ):
+        if not 0 <= shard_index < num_shards:
+            raise ValueError(f"shard_index must be in [0, {num_shards}), got {shard_index}.")
+        self.rail_flow = rail_flow
+        self.plan = rail_flow.check_engines(compile_flows(
+            flows,
+            generate_kwargs.pop('action_params', {}),
+            generate_kwargs.pop('condition_params', {}),
+        ))
+        self.sink = sink
+        self.shard_index = shard_index
+        self.num_shards = num_shards
+        self.generate_kwargs = generate_kwargs
+
+    def _pending(self, image_paths:Iterable[str], summary:RunSummary) -> Iterator[str]:
+        done = self.sink.done_set()
+        for image_path in select_shard(map(str, image_paths), self.shard_index, self.num_shards):
+            if str(image_path) in done:
+                summary.skipped += 1
+                continue
+            yield str(image_path)
+
+    def _record(self, image_path:str, result, summary:RunSummary):
+        if isinstance(result, Exception):
+            summary.failed += 1
+            self.sink.write({'image_path': image_path, 'error': f'{type(result).__name__}: {result}'})
+        else:
+            summary.succeeded += 1
+            self.sink.write(result)
+
+    def run(self, image_paths:Iterable[str]) -> RunSummary:
+        """Processes the inputs one at a time with a sync engine."""
+        summary = RunSummary()
+        with self.sink:
+            for image_path in self._pending(image_paths, summary):
+                try:
+                    result = self.rail_flow.generate(
+                        self.plan,
+                        image_path=image_path,
+                        return_result=True,
+                        **self.generate_kwargs,
+                    )
+                except Exception as e:
+                    result = e
+                self._record(image_path, result, summary)
+        return summary
+
+    async def arun(self, image_paths:Iterable[str], max_concurrency:int=16) -> RunSummary:
+        """Processes the inputs concurrently with an async engine, see `RailFlow.generate_batch`."""
+        summary = RunSummary()
+        with self.sink:
+            async for image_path, result in self.rail_flow.generate_batch(
+                self.plan,
+                self._pending(image_paths, summary),
+                max_concurrency=max_concurrency,
+                return_exceptions=True,
+                return_result=True,
+                **self.generate_kwargs,
+            ):
+                self._record(image_path, result, summary)
+        return summary
+
+    def _settle(self, queue:WorkQueue, worker_id:str, image_path:str, result):
+        if isinstance(result, Exception):
+            queue.fail(worker_id, image_path, f'{type(result).__name__}: {result}')
+        else:
+            queue.complete(worker_id, image_path)
+
+    def run_queue(self, queue:WorkQueue, worker_id:str=None, lease_size:int=8) -> RunSummary:
+        """Processes inputs leased from `queue` one at a time with a sync engine, until no
+        input is left to lease.
+
+        Results are written to the sink before the input is completed in the queue, so a
+        crash in between only causes the input to be processed again.
+
+        Args:
+            queue (WorkQueue): The queue shared by the workers.
+            worker_id (str): The lease owner, defaults to `<hostname>-<pid>`.
+            lease_size (int): Number of inputs leased at a time.
+        """
+        summary = RunSummary()
+        worker_id = worker_id or default_worker_id()
+        with self.sink:
+            while leased := queue.lease(worker_id, lease_size):
+                for index, image_path in enumerate(leased):
+                    # Keep the leases of the inputs still waiting in this worker
+                    if index and image_path in queue.renew(worker_id, leased[index:]):
+                        continue
+                    try:
+                        result = self.rail_flow.generate(
+                            self.plan,
+                            image_path=image_path,
+                            return_result=True,
+                            **self.generate_kwargs,
+                        )
+                    except Exception as e:
+                        result = e
+                    self._record(image_path, result, summary)
+                    self._settle(queue, worker_id, image_path, result)
+        return summary
+
+    async def arun_queue(
+        self,
+        queue:WorkQueue,
+        worker_id:str=None,
+        max_concurrency:int=16,
+        lease_size:int=None,
+    ) -> RunSummary:
+        """Processes inputs leased from `queue` concurrently with an async engine, until no
+        input is left to lease; the leases of the inputs held are renewed in the background.
+
+        Args:
+            queue (WorkQueue): The queue shared by the workers.
+            worker_id (str): The lease owner, defaults to `<hostname>-<pid>`.
+            max_concurrency (int): Maximum number of inputs in flight.
+            lease_size (int): Number of inputs leased at a time, defaults to `max_concurrency`.
+        """
+        summary = RunSummary()
+        worker_id = worker_id or default_worker_id()
+        held = set()
+
+        # The queue is a SQLite database, its calls run in worker threads so as not to stall
+        # the requests in flight
+        async def leased():
+            while batch := await asyncio.to_thread(queue.lease, worker_id, lease_size or max_concurrency):
+                held.update(batch)
+                for image_path in batch:
+                    yield image_path
+
+        async def renew():
+            while True:
+                await asyncio.sleep(queue.lease_seconds / 3)
+                if held:
+                    await asyncio.to_thread(queue.renew, worker_id, list(held))
+
+        renewer = asyncio.create_task(renew())
+        try:
+            with self.sink:
+                async for image_path, result in self.rail_flow.generate_batch(
+                    self.plan,
+                    leased(),
+                    max_concurrency=max_concurrency,
+                    return_exceptions=True,
+                    return_result=True,
+                    **self.generate_kwargs,
+                ):
+                    self._record(image_path, result, summary)
+                    await asyncio.to_thread(self._settle, queue, worker_id, image_path, result)
+                    held.discard(image_path)
+        finally:
+            renewer.cancel()
+        return summary
@@ -0,0 +1,103 @@
+import os
+import hashlib
+from jinja2 import BaseLoader, Environment, FileSystemBytecodeCache, Template, TemplateNotFound
+from typing import Dict, Tuple
+
+
+class _PromptLoader(BaseLoader):
+    """Serves prompt sources registered in memory, named by their content hash."""
+
+    def __init__(self):
+        self.sources: Dict[str, str] = {}
+
+    def register(self, source: str) -> str:
+        name = hashlib.sha256(source.encode('utf-8')).hexdigest()
+        self.sources[name] = source
+        return name
+
+    def get_source(self, environment, name):
+        if name not in self.sources:
+            raise TemplateNotFound(name)
+        # Sources are content-addressed, so a registered template never goes stale
+        return self.sources[name], None, lambda: True
+
+
+_loader = _PromptLoader()
+
+# Shared by every prompt
+environment = Environment(
+    loader=_loader,
+    cache_size=-1,
+    auto_reload=False,
+)
+
+_templates: Dict[str, Template] = {}
+
+
+def enable_bytecode_cache(directory: str = '.cache/railflow/templates'):
+    """Stores compiled templates in `directory`, so new processes skip compiling them too.
+
+    Templates compiled before the call are not written to the cache.
+    """
+    os.makedirs(directory, exist_ok=True)
+    environment.bytecode_cache = FileSystemBytecodeCache(directory)
+
+
+def compile_template(source: str) -> Template:
+    """Returns the compiled template for `source`, compiling it on first use only.
+
+    Args:
+        source (str): The Jinja template source of a prompt task.
+
+    Returns:
+        Template: The compiled template, shared by every caller with the same source.
+    """
+    template = _templates.get(source)
+    if template is None:
+        template = _templates[source] = environment.get_template(_loader.register(source))
+    return template
+
+
+def render_template(source: str, params: dict = {}) -> str:
+    """Renders `source` with `params` using the cached compiled template."""
+    return compile_template(source).render(**params)
+
+
+# Static text shorter than ~64 tokens (256 chars) stays in the user message. vLLM caches prefixes
+# per 16-token block, so longer ones already pay off there; hosted APIs only cache prompts of
+# ~1024 tokens (~4k chars) or more, shorter ones are sent the same either way
+MIN_STATIC_PREFIX_CHARS = 256
+
+_splits: Dict[str, Tuple[str, str]] = {}
+
+
+def split_template(source: str) -> Tuple[str, str]:
+    """Splits `source` into a static prefix, rendered once, and the source of the rest.
+
+    The prefix holds the lines before the first Jinja tag, so it is the same for every params
+    and can be served from a provider's (or vLLM's) prompt prefix cache. It is empty if shorter
+    than `MIN_STATIC_PREFIX_CHARS`.
+
+    Returns:
+        Tuple[str, str]: The rendered static prefix and the template source of the rest.
+    """
+    split = _splits.get(source)
+    if split is None:
+        starts = [
+            index for index in (
+                source.find(environment.variable_start_string),
+                source.find(environment.block_start_string),
+                source.find(environment.comment_start_string),
+            ) if index >= 0
+        ]
+        # Split at the start of the line of the first tag, so the rest keeps whole lines
+        end = source.rfind('\n', 0, min(starts)) + 1 if starts else len(source)
+        if end < MIN_STATIC_PREFIX_CHARS:
+            split = ('', source)
+        else:
+            prefix = compile_template(source[:end]).render()
+            # Before a tag the prefix ends with a line break, which rendering it alone drops
+            # (keep_trailing_newline), unlike rendering the whole source
+            split = (prefix + environment.newline_sequence if starts else prefix, source[end:])
+        _splits[source] = split
+    return split
@@ -0,0 +1,226 @@
+import json
+import time
+import bisect
+import threading
+import itertools
+from contextlib import contextmanager
+from contextvars import ContextVar
+from dataclasses import asdict, dataclass
+from pathlib import Path
+from typing import Callable, Dict, Iterable, Iterator, Union
+
+from inference_engine.limiter import retry_listener
+
+
+@dataclass
+class Span:
+    """
+    One timed stage of a request: a condition or action evaluation, the preparation of its
+    messages, or the engine call.
+
+    Child spans inherit the flow, task and image of their parent, and their tokens and retries
+    are added to it, so a condition/action span carries the cost of its engine call.
+    """
+    name              :str   = None
+    flow              :str   = None
+    task              :str   = None
+    image_path        :str   = None
+    span_id           :int   = None
+    parent_id         :int   = None
+    start             :float = None
+    duration          :float = None
+    payload_bytes     :int   = 0
+    prompt_tokens     :int   = 0
+    completion_tokens :int   = 0
+    cached_tokens     :int   = 0
+    retries           :int   = 0
+    error             :str   = None
+
+    @property
+    def recording(self) -> bool:
+        return self is not _NULL_SPAN
+
+    def record_usage(self, response):
+        """Records the token usage reported in a chat completion `response`."""
+        if not (usage := getattr(response, 'usage', None)):
+            return
+        self.prompt_tokens += getattr(usage, 'prompt_tokens', None) or 0
+        self.completion_tokens += getattr(usage, 'completion_tokens', None) or 0
+        if details := getattr(usage, 'prompt_tokens_details', None):
+            self.cached_tokens += getattr(details, 'cached_tokens', None) or 0
+
+
+# Handed out when no hook is installed, so disabled tracing costs one attribute check
+_NULL_SPAN = Span()
+
+_current_span: ContextVar[Span] = ContextVar('railflow_current_span', default=None)
+
+
+def payload_bytes(messages:list) -> int:
+    """Approximates the request body size of `messages` from their text and image URLs."""
+    size = 0
+    for message in messages:
+        content = message.get('content')
+        for part in content if isinstance(content, list) else [{'text': content or ''}]:
+            size += len(part.get('text') or '') + len((part.get('image_url') or {}).get('url', ''))
+    return size
+
+
+class Tracer:
+    """
+    Emits a `Span` per instrumented stage to pluggable hooks.
+
+    A hook is any callable taking the finished span, e.g. a `MetricsHook`, a `JSONLTraceHook`,
+    or a function forwarding spans to an external tracing system. The current span is kept in
+    a context variable, so spans nest correctly across threads and asyncio tasks, and the
+    retries of any `RateLimiter` called within a span (including those of `EnginePool`
+    members) are counted on it.
+
+    Args:
+        hooks (Iterable[Callable[[Span], None]]): Receivers of the finished spans.
+    """
+
+    def __init__(self, hooks:Iterable[Callable[[Span], None]]=()):
+        self.hooks = list(hooks)
+        self._ids = itertools.count(1)
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.hooks)
+
+    @contextmanager
+    def span(self, name:str, **attributes) -> Iterator[Span]:
+        """Times the enclosed block as a span named `name`, a child of the current span."""
+        if not self.hooks:
+            yield _NULL_SPAN
+            return
+
+        parent = _current_span.get()
+        span = Span(name=name, span_id=next(self._ids), start=time.time())
+        if parent is not None:
+            span.parent_id = parent.span_id
+            span.flow, span.task, span.image_path = parent.flow, parent.task, parent.image_path
+        for key, value in attributes.items():
+            setattr(span, key, value)
+
+        token = _current_span.set(span)
+        listener_token = retry_listener.set(self.record_retry)
+        started = time.perf_counter()
+        try:
+            yield span
+        except BaseException as e:
+            span.error = f'{type(e).__name__}: {e}'
+            raise
+        finally:
+            span.duration = time.perf_counter() - started
+            retry_listener.reset(listener_token)
+            _current_span.reset(token)
+            if parent is not None:
+                parent.prompt_tokens += span.prompt_tokens
+                parent.completion_tokens += span.completion_tokens
+                parent.cached_tokens += span.cached_tokens
+                parent.retries += span.retries
+            for hook in self.hooks:
+                hook(span)
+
+    def record_retry(self, *args, **kwargs):
+        """Counts a retry on the current span, see `retry_listener`."""
+        if (span := _current_span.get()) is not None:
+            span.retries += 1
+
+
+class MetricsHook:
+    """
+    Prometheus-style metrics aggregated from spans, labelled by stage and flow:
+
+        railflow_spans_total{stage, flow, status}
+        railflow_span_duration_seconds{stage, flow} (histogram)
+        railflow_tokens_total{stage, flow, kind}    (kind: prompt, completion, cached)
+        railflow_payload_bytes_total{stage, flow}
+        railflow_retries_total{stage, flow}
+
+    `exposition()` renders them in the Prometheus text format, e.g. to serve on /metrics.
+
+    Args:
+        buckets (Iterable[float]): Upper bounds of the duration histogram, in seconds.
+    """
+
+    DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+    def __init__(self, buckets:Iterable[float]=DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        self.counters: Dict[tuple, float] = {}
+        self.histograms: Dict[tuple, list] = {}
+        self._lock = threading.Lock()
+
+    def _inc(self, name:str, labels:tuple, value:float=1):
+        if value:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def __call__(self, span:Span):
+        labels = (('stage', span.name), ('flow', span.flow or ''))
+        with self._lock:
+            self._inc('railflow_spans_total', labels + (('status', 'error' if span.error else 'ok'),))
+            self._inc('railflow_payload_bytes_total', labels, span.payload_bytes)
+            self._inc('railflow_retries_total', labels, span.retries)
+            for kind in ('prompt', 'completion', 'cached'):
+                self._inc('railflow_tokens_total', labels + (('kind', kind),), getattr(span, f'{kind}_tokens'))
+
+            # [bucket counts..., +Inf count, sum]
+            histogram = self.histograms.setdefault(labels, [0] * (len(self.buckets) + 2))
+            histogram[bisect.bisect_left(self.buckets, span.duration)] += 1
+            histogram[-1] += span.duration
+
+    def exposition(self) -> str:
+        """Returns the metrics in the Prometheus text exposition format."""
+        format_labels = lambda labels: ','.join(f'{key}="{value}"' for key, value in labels)
+        lines = []
+        with self._lock:
+            for name in sorted({name for name, _ in self.counters}):
+                lines.append(f'# TYPE {name} counter')
+                for (_name, labels), value in sorted(self.counters.items()):
+                    if _name == name:
+                        lines.append(f'{name}{{{format_labels(labels)}}} {value:g}')
+
+            name = 'railflow_span_duration_seconds'
+            lines.append(f'# TYPE {name} histogram')
+            for labels, histogram in sorted(self.histograms.items()):
+                cumulative = 0
+                for bound, count in zip((*self.buckets, '+Inf'), histogram[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket{{{format_labels(labels + (("le", bound),))}}} {cumulative}')
+                lines.append(f'{name}_sum{{{format_labels(labels)}}} {histogram[-1]:g}')
+                lines.append(f'{name}_count{{{format_labels(labels)}}} {cumulative}')
+        return '\n'.join(lines) + '\n'
+
+
+class JSONLTraceHook:
+    """
+    Appends every span as one JSON line to `path`, for offline analysis of slow stages and
+    token cost per flow.
+
+    Args:
+        path (str | Path): The trace file, created with its parent directories.
+    """
+
+    def __init__(self, path:Union[str, Path]):
+        self.path = Path(path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._file = open(self.path, 'a', encoding='utf-8')
+        self._lock = threading.Lock()
+
+    def __call__(self, span:Span):
+        line = json.dumps(asdict(span), ensure_ascii=False) + '\n'
+        with self._lock:
+            self._file.write(line)
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
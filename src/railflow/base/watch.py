@@ -0,0 +1,427 @@
+import os
+import json
+import time
+import select
+import struct
+import asyncio
+import fnmatch
+import sqlite3
+import hashlib
+import threading
+import ctypes
+import ctypes.util
+from dataclasses import asdict
+from pathlib import Path
+from typing import Dict, Iterable, List, Set, Union
+
+from .config import RailFlowConfig
+from .flow import RailFlow, _condition_key
+from .plan import ExecutionPlan, FlowPlan, RailPlan
+from .run import JSONLResultSink
+
+
+PDF_PATTERNS = ('*.pdf',)
+IMAGE_PATTERNS = ('*.jpg', '*.jpeg', '*.png', '*.webp')
+
+# inotify(7) event masks
+_IN_CLOSE_WRITE = 0x00000008
+_IN_MOVED_TO    = 0x00000080
+_IN_CREATE      = 0x00000100
+_IN_Q_OVERFLOW  = 0x00004000
+_IN_ISDIR       = 0x40000000
+_EVENT_HEADER   = struct.Struct('iIII')
+
+
+def _hash_file(file_path:Path, chunk_size:int=1 << 20) -> str:
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def _walk_files(directories:Iterable[Path]) -> Iterable[Path]:
+    for directory in directories:
+        for root, _, files in os.walk(directory):
+            for name in files:
+                yield Path(root) / name
+
+
+def flow_fingerprint(flow:FlowPlan) -> str:
+    """Identifies what a flow sends for an image: its condition and actions (task, params,
+    preprocessing), so a config edit that leaves a flow untouched keeps its fingerprint."""
+    tasks = [_condition_key(flow.condition) if flow.condition else None]
+    tasks += [[key, _condition_key(action)] for key, action in flow.actions.items()]
+    return hashlib.sha256(json.dumps(tasks, sort_keys=True).encode('utf-8')).hexdigest()[:16]
+
+
+def _evaluated_flows(plan:ExecutionPlan, selected_flow:str) -> Dict[str, str]:
+    """Returns the fingerprints of the flows an image went through to reach `selected_flow`,
+    i.e. whose conditions or action decided its output."""
+    fingerprints = {}
+    for flow in plan:
+        fingerprints[flow.name] = flow_fingerprint(flow)
+        if flow.name == selected_flow:
+            return fingerprints
+    return None
+
+
+class _PollingWatcher:
+    """Reports files whose size or mtime changed, once they kept it for a whole interval
+    (so files still being copied are not picked up half-written)."""
+
+    def __init__(self, directories:List[Path]):
+        self.directories = directories
+        self._stats = self._scan()
+        self._changed: Dict[Path, tuple] = {}
+
+    def _scan(self) -> Dict[Path, tuple]:
+        stats = {}
+        for path in _walk_files(self.directories):
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            stats[path] = (stat.st_size, stat.st_mtime_ns)
+        return stats
+
+    def wait(self, timeout:float) -> Set[Path]:
+        time.sleep(timeout)
+        stats = self._scan()
+        ready = {path for path, stat in self._changed.items() if stats.get(path) == stat}
+        self._changed = {
+            path: stat for path, stat in stats.items()
+            if path not in ready and (self._stats.get(path) != stat or path in self._changed)
+        }
+        self._stats = stats
+        return ready
+
+    def close(self):
+        pass
+
+
+class _InotifyWatcher:
+    """Reports files closed after writing or moved into the watched directories (recursively),
+    through inotify(7)."""
+
+    def __init__(self, directories:List[Path]):
+        self._libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        self._fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self._fd < 0:
+            raise OSError(ctypes.get_errno(), 'inotify_init1 failed')
+        self.directories = directories
+        self._watches: Dict[int, Path] = {}
+        for directory in directories:
+            for root, _, _ in os.walk(directory):
+                self._add_watch(Path(root))
+
+    def _add_watch(self, directory:Path):
+        wd = self._libc.inotify_add_watch(self._fd, os.fsencode(directory), _IN_CLOSE_WRITE | _IN_MOVED_TO | _IN_CREATE)
+        if wd < 0:
+            raise OSError(ctypes.get_errno(), f'inotify_add_watch failed for {directory}')
+        self._watches[wd] = directory
+
+    def wait(self, timeout:float) -> Set[Path]:
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return set()
+
+        changed = set()
+        while True:
+            try:
+                data = os.read(self._fd, 64 * 1024)
+            except BlockingIOError:
+                return changed
+
+            offset = 0
+            while offset < len(data):
+                wd, mask, _, length = _EVENT_HEADER.unpack_from(data, offset)
+                name = data[offset + _EVENT_HEADER.size:offset + _EVENT_HEADER.size + length].rstrip(b'\0')
+                offset += _EVENT_HEADER.size + length
+
+                if mask & _IN_Q_OVERFLOW:
+                    # Events were dropped, fall back to every file
+                    changed.update(_walk_files(self.directories))
+                    continue
+                if wd not in self._watches:
+                    continue
+                path = self._watches[wd] / os.fsdecode(name)
+                if mask & _IN_ISDIR:
+                    if mask & (_IN_CREATE | _IN_MOVED_TO):
+                        # Files may have landed before the watch of a new directory was added
+                        for root, _, _ in os.walk(path):
+                            self._add_watch(Path(root))
+                        changed.update(_walk_files([path]))
+                elif mask & (_IN_CLOSE_WRITE | _IN_MOVED_TO):
+                    changed.add(path)
+
+    def close(self):
+        os.close(self._fd)
+
+
+class WatchLedger:
+    """
+    Records which inputs were processed, in a SQLite file, so only new or changed content is
+    converted and generated again.
+
+    Sources (PDFs or images dropped in the watched directories) are keyed by path with the
+    hash of their content; images by path with their content hash and, per rail, the
+    fingerprints of the flows they went through.
+    """
+
+    def __init__(self, path:Union[str, Path]):
+        self.path = Path(path)
+        self._lock = threading.Lock()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self._connection = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._connection.execute("PRAGMA journal_mode=WAL")
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS sources (path TEXT PRIMARY KEY, hash TEXT NOT NULL, images TEXT NOT NULL)"
+        )
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS images ("
+            "image_path TEXT PRIMARY KEY, hash TEXT NOT NULL, source TEXT, flows TEXT, error TEXT, updated_at REAL)"
+        )
+
+    def source_hash(self, path:Union[str, Path]) -> str:
+        with self._lock:
+            row = self._connection.execute("SELECT hash FROM sources WHERE path = ?", (str(path),)).fetchone()
+        return row[0] if row else None
+
+    def record_source(self, path:Union[str, Path], source_hash:str, image_paths:List[str]):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO sources (path, hash, images) VALUES (?, ?, ?)",
+                (str(path), source_hash, json.dumps(image_paths)),
+            )
+
+    def record_image(self, image_path:str, image_hash:str, source:str, flows:dict=None, error:str=None):
+        with self._lock:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO images (image_path, hash, source, flows, error, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (image_path, image_hash, source, json.dumps(flows) if flows else None, error, time.time()),
+            )
+
+    def image(self, image_path:str) -> dict:
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT hash, source, flows, error FROM images WHERE image_path = ?", (image_path,),
+            ).fetchone()
+        if row is None:
+            return None
+        return {'hash': row[0], 'source': row[1], 'flows': json.loads(row[2]) if row[2] else None, 'error': row[3]}
+
+    def images(self) -> Iterable[tuple]:
+        """Returns `(image_path, source, flows)` of every recorded image; `flows` is None for
+        the images whose generation failed."""
+        with self._lock:
+            rows = self._connection.execute("SELECT image_path, source, flows FROM images").fetchall()
+        return [(image_path, source, json.loads(flows) if flows else None) for image_path, source, flows in rows]
+
+    def close(self):
+        self._connection.close()
+
+
+def _is_stale(plan:RailPlan, flows:dict) -> bool:
+    """Whether a recorded generation went through a flow that has changed since."""
+    if not flows:
+        return True
+    for rail, plan_rail in (('input', plan.input), ('output', plan.output)):
+        recorded = flows.get(rail)
+        if recorded is None:
+            # The output rail did not run (or did not exist), it only matters if it exists now
+            if rail == 'output' and not plan_rail:
+                continue
+            return True
+        if _evaluated_flows(plan_rail, recorded['flow']) != recorded['fingerprints']:
+            return True
+    return False
+
+
+class WatchFolder:
+    """
+    A long-running incremental mode: watches input directories and converts and generates
+    only new or changed files, writing one record per image to `sink` seconds after the
+    file lands.
+
+    PDFs are converted with `PDF2ImagesCorpusConverter` into `work_dir/pages`, images are
+    generated directly. Every input is keyed by its content hash in a `WatchLedger`
+    (`work_dir/ledger.sqlite`), so unchanged files, including at a restart, are skipped.
+
+    Edits of the YAML config are picked up without a restart: the config is reloaded and
+    only the images whose generation went through a flow whose condition or actions
+    changed are generated again. A config that fails to load keeps the previous one running
+    (see `reload_error`).
+
+    Files are detected with inotify on Linux, or by polling the directories every
+    `poll_interval` seconds elsewhere (or with `use_inotify=False`, e.g. on network
+    filesystems, which do not report remote writes through inotify).
+
+    Args:
+        rail_flow (RailFlow): The flow runner, with an async engine.
+        config_path: The YAML config (see `RailFlowConfig.from_yaml`), whose rails are run.
+        input_dirs: The directories to watch, recursively.
+        work_dir: Directory of the converted pages and of the ledger.
+        sink (JSONLResultSink): Where records are written; defaults to `work_dir/results`.
+        patterns: File name patterns of the inputs, defaults to PDFs and images.
+        poll_interval (float): Seconds between two checks for new files and config edits.
+        max_concurrency (int): Maximum number of images in flight, see `generate_pipeline`.
+        generation_params (dict): Generation params of every request.
+        converter_kwargs (dict): Arguments of `PDF2ImagesCorpusConverter` (e.g. format, dpi).
+    """
+
+    def __init__(
+        self,
+        rail_flow:RailFlow,
+        config_path:Union[str, Path],
+        input_dirs:Iterable[Union[str, Path]],
+        work_dir:Union[str, Path],
+        sink:JSONLResultSink=None,
+        patterns:Iterable[str]=PDF_PATTERNS + IMAGE_PATTERNS,
+        poll_interval:float=1.0,
+        max_concurrency:int=16,
+        generation_params:dict={},
+        converter_kwargs:dict={},
+        use_inotify:bool=True,
+    ):
+        from utils.pdf2images import PDF2ImagesCorpusConverter
+
+        self.rail_flow = rail_flow
+        self.config_path = Path(config_path)
+        self.input_dirs = [Path(directory) for directory in input_dirs]
+        self.work_dir = Path(work_dir)
+        self.sink = sink or JSONLResultSink(self.work_dir / 'results')
+        self.patterns = tuple(patterns)
+        self.poll_interval = poll_interval
+        self.max_concurrency = max_concurrency
+        self.generation_params = generation_params
+        self.use_inotify = use_inotify
+        self.converter = PDF2ImagesCorpusConverter(self.work_dir / 'pages', max_workers=1, **converter_kwargs)
+        self.ledger = WatchLedger(self.work_dir / 'ledger.sqlite')
+
+        self.config: RailFlowConfig = None
+        self.plan: RailPlan = None
+        self.reload_error: Exception = None
+        self._config_mtime = None
+        # Images to generate again at start: failed ones, and those the config changed for
+        self._requeued = self.reload_config()
+        if self.plan is None:
+            raise self.reload_error
+
+    def _matches(self, path:Path) -> bool:
+        return any(fnmatch.fnmatch(path.name.lower(), pattern) for pattern in self.patterns)
+
+    def _watcher(self):
+        if self.use_inotify:
+            try:
+                return _InotifyWatcher(self.input_dirs)
+            except (OSError, AttributeError):
+                # Not Linux, or out of inotify watches
+                pass
+        return _PollingWatcher(self.input_dirs)
+
+    def reload_config(self) -> List[str]:
+        """Reloads the config if the YAML changed since it was loaded, and returns the
+        images to generate again: those that went through a flow that changed, and those
+        whose generation failed."""
+        try:
+            mtime = self.config_path.stat().st_mtime_ns
+            if mtime == self._config_mtime:
+                return []
+            self._config_mtime = mtime
+            config = RailFlowConfig.from_yaml(self.config_path)
+            plan = self.rail_flow.check_engines(config.rails.compile())
+        except Exception as e:
+            self.reload_error = e
+            return []
+
+        self.config, self.plan, self.reload_error = config, plan, None
+        return [image_path for image_path, _, flows in self.ledger.images() if _is_stale(plan, flows)]
+
+    def _flows(self, result) -> dict:
+        flows = {'input': {'flow': result.input.flow, 'fingerprints': _evaluated_flows(self.plan.input, result.input.flow)}}
+        if result.output is not None:
+            flows['output'] = {'flow': result.output.flow, 'fingerprints': _evaluated_flows(self.plan.output, result.output.flow)}
+        return flows
+
+    async def _collect(self, changed:Iterable[Path]) -> Dict[Path, tuple]:
+        """Converts the new or changed sources and returns their `(hash, image paths)`, by
+        source path.
+
+        Sources are only recorded in the ledger once all their images are (see `process`), so
+        a source interrupted before its images were generated is collected again at a restart.
+        """
+        sources = {}
+        for path in sorted(set(changed)):
+            if not self._matches(path) or not path.is_file():
+                continue
+            try:
+                source_hash = await asyncio.to_thread(_hash_file, path)
+                if self.ledger.source_hash(path) == source_hash:
+                    continue
+                if path.suffix.lower() == '.pdf':
+                    entries = await asyncio.to_thread(lambda: list(self.converter.convert([path])))
+                    if 'error' in entries[0]:
+                        raise RuntimeError(entries[0]['error'])
+                    image_paths = entries[0]['pages']
+                else:
+                    image_paths = [str(path)]
+            except Exception as e:
+                self.sink.write({'image_path': str(path), 'error': f'{type(e).__name__}: {e}'})
+                continue
+            sources[path] = (source_hash, image_paths)
+        return sources
+
+    async def process(self, changed:Iterable[Path]=(), requeued:Iterable[str]=()) -> int:
+        """Converts and generates the changed files and the requeued images; returns the number
+        of images generated."""
+        sources = await self._collect(changed)
+
+        pending = {}
+        for source, (_, image_paths) in sources.items():
+            for image_path in image_paths:
+                image_hash = await asyncio.to_thread(_hash_file, Path(image_path))
+                recorded = self.ledger.image(image_path)
+                if recorded is None or recorded['hash'] != image_hash or recorded['error'] or _is_stale(self.plan, recorded['flows']):
+                    pending[image_path] = (image_hash, str(source))
+        for image_path in requeued:
+            if image_path not in pending and (recorded := self.ledger.image(image_path)) is not None:
+                pending[image_path] = (recorded['hash'], recorded['source'])
+
+        if pending:
+            await self._generate(pending)
+        for source, (source_hash, image_paths) in sources.items():
+            self.ledger.record_source(source, source_hash, image_paths)
+        return len(pending)
+
+    async def _generate(self, pending:Dict[str, tuple]):
+        """Generates the `pending` images, given with their `(hash, source)`, and records each
+        in the ledger and the sink."""
+        async for image_path, result in self.rail_flow.generate_pipeline(
+            self.plan,
+            list(pending),
+            input_concurrency=self.max_concurrency,
+            generation_params=self.generation_params,
+            return_exceptions=True,
+            return_result=True,
+        ):
+            image_hash, source = pending[image_path]
+            if isinstance(result, Exception):
+                error = f'{type(result).__name__}: {result}'
+                self.ledger.record_image(image_path, image_hash, source, error=error)
+                self.sink.write({'image_path': image_path, 'source': source, 'error': error})
+            else:
+                self.ledger.record_image(image_path, image_hash, source, flows=self._flows(result))
+                self.sink.write({**asdict(result), 'source': source, 'image_hash': image_hash})
+
+    async def run(self, stop:asyncio.Event=None):
+        """Processes the files not yet in the ledger, then watches for new files and config
+        edits until `stop` is set."""
+        watcher = self._watcher()
+        try:
+            with self.sink:
+                await self.process(_walk_files(self.input_dirs), self._requeued)
+                while stop is None or not stop.is_set():
+                    changed = await asyncio.to_thread(watcher.wait, self.poll_interval)
+                    await self.process(changed, self.reload_config())
+        finally:
+            watcher.close()
@@ -0,0 +1,173 @@
+import os
+import time
+import socket
+import sqlite3
+import hashlib
+import threading
+from pathlib import Path
+from typing import Dict, Iterable, Iterator, List, Union
+
+
+def shard_of(image_path:str, num_shards:int) -> int:
+    """Returns the shard of `image_path` among `num_shards`, stable across processes and
+    machines (unlike the built-in `hash`, which is salted per process)."""
+    digest = hashlib.sha256(str(image_path).encode('utf-8')).digest()
+    return int.from_bytes(digest[:8], 'big') % num_shards
+
+
+def select_shard(image_paths:Iterable[str], shard_index:int=0, num_shards:int=1) -> Iterator[str]:
+    """Yields the paths of `image_paths` belonging to shard `shard_index` of `num_shards`.
+
+    Every worker given the same corpus and its own `shard_index` processes a disjoint part of it,
+    without any coordination.
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"shard_index must be in [0, {num_shards}), got {shard_index}.")
+    for image_path in image_paths:
+        if num_shards == 1 or shard_of(image_path, num_shards) == shard_index:
+            yield image_path
+
+
+def default_worker_id() -> str:
+    return f'{socket.gethostname()}-{os.getpid()}'
+
+
+class WorkQueue:
+    """
+    A lease-based work queue of input paths in a SQLite file, shared by workers on any number
+    of processes or nodes.
+
+    A worker leases a few items at a time for `lease_seconds`, renews the leases of the items it
+    still holds, and completes (or fails) each item. Leases of a crashed worker expire and
+    its items are leased again by the others, so an item is only processed twice if its worker
+    stopped renewing before completing it. Failed items are retried up to `max_attempts` times.
+
+    The file must be on a filesystem with working POSIX locks (local disk or a shared volume
+    such as NFSv4 with locking); transactions take the database write lock, so all workers
+    see a consistent queue.
+
+    Args:
+        path (str | Path): Path of the SQLite database file.
+        lease_seconds (float): Duration of a lease; renew well before it expires.
+        max_attempts (int): Number of leases of an item before it is marked failed.
+        timeout (float): Seconds to wait for the database lock held by another worker.
+    """
+
+    def __init__(
+        self,
+        path:Union[str, Path],
+        lease_seconds:float=300.0,
+        max_attempts:int=3,
+        timeout:float=60.0,
+    ):
+        self.path = Path(path)
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        self._lock = threading.Lock()
+
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        # No WAL: its shared-memory index does not work across nodes
+        self._connection = sqlite3.connect(self.path, timeout=timeout, check_same_thread=False, isolation_level=None)
+        self._connection.execute(
+            "CREATE TABLE IF NOT EXISTS items ("
+            "image_path TEXT PRIMARY KEY, state TEXT NOT NULL DEFAULT 'pending', worker TEXT, "
+            "lease_expires REAL, attempts INTEGER NOT NULL DEFAULT 0, error TEXT, updated_at REAL)"
+        )
+        self._connection.execute("CREATE INDEX IF NOT EXISTS items_state ON items (state, lease_expires)")
+
+    def _transaction(self, statements):
+        """Runs `statements(cursor)` in an immediate (write-locked) transaction."""
+        with self._lock:
+            cursor = self._connection.cursor()
+            cursor.execute("BEGIN IMMEDIATE")
+            try:
+                result = statements(cursor)
+                cursor.execute("COMMIT")
+                return result
+            except BaseException:
+                cursor.execute("ROLLBACK")
+                raise
+
+    def add(self, image_paths:Iterable[str], chunk_size:int=10000) -> int:
+        """Enqueues the paths not already in the queue and returns how many were added."""
+        added = 0
+        image_paths = iter(image_paths)
+        while chunk := [(str(image_path), time.time()) for _, image_path in zip(range(chunk_size), image_paths)]:
+            def insert(cursor):
+                before = self._connection.total_changes
+                cursor.executemany("INSERT OR IGNORE INTO items (image_path, updated_at) VALUES (?, ?)", chunk)
+                return self._connection.total_changes - before
+            added += self._transaction(insert)
+        return added
+
+    def lease(self, worker_id:str, count:int=1) -> List[str]:
+        """Leases up to `count` pending items, or items whose lease expired, to `worker_id`."""
+        def lease(cursor):
+            now = time.time()
+            rows = cursor.execute(
+                "SELECT image_path FROM items WHERE (state = 'pending' OR (state = 'leased' AND lease_expires < ?)) "
+                "AND attempts < ? ORDER BY rowid LIMIT ?",
+                (now, self.max_attempts, count),
+            ).fetchall()
+            cursor.executemany(
+                "UPDATE items SET state = 'leased', worker = ?, lease_expires = ?, attempts = attempts + 1, updated_at = ? "
+                "WHERE image_path = ?",
+                [(worker_id, now + self.lease_seconds, now, row[0]) for row in rows],
+            )
+            # Expired leases that used up their attempts will never be leased again
+            cursor.execute(
+                "UPDATE items SET state = 'failed', error = COALESCE(error, 'Lease expired'), updated_at = ? "
+                "WHERE state = 'leased' AND lease_expires < ? AND attempts >= ?",
+                (now, now, self.max_attempts),
+            )
+            return [row[0] for row in rows]
+        return self._transaction(lease)
+
+    def renew(self, worker_id:str, image_paths:Iterable[str]) -> List[str]:
+        """Extends the leases of `image_paths` held by `worker_id`; returns the paths whose
+        lease was lost (expired and taken over by another worker)."""
+        image_paths = [str(image_path) for image_path in image_paths]
+        def renew(cursor):
+            now = time.time()
+            lost = []
+            for image_path in image_paths:
+                cursor.execute(
+                    "UPDATE items SET lease_expires = ?, updated_at = ? WHERE image_path = ? AND worker = ? AND state = 'leased'",
+                    (now + self.lease_seconds, now, image_path, worker_id),
+                )
+                if cursor.rowcount == 0:
+                    lost.append(image_path)
+            return lost
+        return self._transaction(renew)
+
+    def complete(self, worker_id:str, image_path:str) -> bool:
+        """Marks an item done; returns False if `worker_id` no longer held its lease."""
+        def complete(cursor):
+            cursor.execute(
+                "UPDATE items SET state = 'done', lease_expires = NULL, error = NULL, updated_at = ? "
+                "WHERE image_path = ? AND worker = ? AND state = 'leased'",
+                (time.time(), str(image_path), worker_id),
+            )
+            return cursor.rowcount == 1
+        return self._transaction(complete)
+
+    def fail(self, worker_id:str, image_path:str, error:str=None) -> bool:
+        """Releases a failed item for a retry, or marks it failed after `max_attempts` leases;
+        returns False if `worker_id` no longer held its lease."""
+        def fail(cursor):
+            cursor.execute(
+                "UPDATE items SET state = CASE WHEN attempts >= ? THEN 'failed' ELSE 'pending' END, "
+                "lease_expires = NULL, error = ?, updated_at = ? WHERE image_path = ? AND worker = ? AND state = 'leased'",
+                (self.max_attempts, error, time.time(), str(image_path), worker_id),
+            )
+            return cursor.rowcount == 1
+        return self._transaction(fail)
+
+    def counts(self) -> Dict[str, int]:
+        """Returns the number of items per state ('pending', 'leased', 'done', 'failed')."""
+        with self._lock:
+            rows = self._connection.execute("SELECT state, COUNT(*) FROM items GROUP BY state").fetchall()
+        return {'pending': 0, 'leased': 0, 'done': 0, 'failed': 0, **dict(rows)}
+
+    def close(self):
+        self._connection.close()
@@ -1,19 +1,256 @@
+import os
 import base64
-from typing import Literal
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import Literal, Tuple
+
+
+_IMAGE_SIGNATURES = (
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
+    (b'BM', 'image/bmp'),
+    (b'II*\x00', 'image/tiff'),
+    (b'MM\x00*', 'image/tiff'),
+)
+
+def detect_mime_type(data:bytes, default:str='image/jpeg') -> str:
+    """Detects the MIME type of an image from its leading magic bytes.
+
+    Args:
+        data (bytes): The image content (only the first few bytes are inspected).
+        default (str): The MIME type returned when the format is not recognized.
+
+    Returns:
+        str: The detected MIME type, e.g. 'image/png'.
+    """
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'image/webp'
+    for signature, mime_type in _IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return mime_type
+    return default
+
+
+class EncodedImageCache:
+    """
+    A thread-safe LRU cache of encoded images, bounded by the total size of the cached data.
+
+    Entries are keyed by (absolute path, mtime, file size), so an image that changes on disk
+    is re-encoded while an unchanged one is read and encoded at most once.
+
+    Args:
+        max_bytes (int): Maximum total size of cached data URLs. Least recently used entries
+            are evicted once it is exceeded; 0 disables caching.
+    """
+
+    def __init__(self, max_bytes:int=256 * 1024 * 1024):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._currsize = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry:Tuple[str, int]):
+        size = len(entry[0])
+        with self._lock:
+            if size > self.max_bytes:
+                return
+            if key in self._entries:
+                self._currsize -= len(self._entries.pop(key)[0])
+            self._entries[key] = entry
+            self._currsize += size
+            while self._currsize > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._currsize -= len(evicted[0])
+                self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._currsize = 0
+
+    def cache_info(self) -> dict:
+        """Returns hit/miss/eviction counters and the current memory footprint."""
+        with self._lock:
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'entries': len(self._entries),
+                'currsize': self._currsize,
+                'max_bytes': self.max_bytes,
+            }
+
+
+encoded_image_cache = EncodedImageCache()
 
 def encode_image(
     image_path:str,
     return_format:Literal['base64', 'decoded_base64', 'data_url']='data_url',
+    cache:EncodedImageCache=encoded_image_cache,
 ):
-  with open(image_path, "rb") as image_file:
+    """Encodes an image file as base64, by default as a data URL with its detected MIME type.
 
-    data = base64.b64encode(image_file.read())
-    if return_format == 'base64':
-        return data
+    Args:
+        image_path (str): Path of the image file.
+        return_format (str): 'base64' (bytes), 'decoded_base64' (str) or 'data_url' (str).
+        cache (EncodedImageCache): Cache of encoded images; pass None to bypass it.
+
+    Returns:
+        The encoded image in the requested format.
+    """
+    stat = os.stat(image_path)
+    key = (os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size)
+
+    # The data URL is cached as-is since it is what every request sends
+    entry = cache.get(key) if cache is not None else None
+    if entry is None:
+        with open(image_path, "rb") as image_file:
+            content = image_file.read()
+        prefix = f"data:{detect_mime_type(content)};base64,"
+        entry = (prefix + base64.b64encode(content).decode('utf-8'), len(prefix))
+        if cache is not None:
+            cache.put(key, entry)
 
-    data = data.decode('utf-8')
+    data_url, prefix_length = entry
+    if return_format == 'base64':
+        return data_url[prefix_length:].encode('utf-8')
     if return_format == 'decoded_base64':
-        return data
+        return data_url[prefix_length:]
+    return data_url
+
+
+def _crop_blank_margins(image, threshold:int=245, padding:int=8):
+    """Crops the near-white margins around the content of a page image."""
+    from PIL import ImageOps
+
+    mask = ImageOps.invert(image.convert('L')).point(lambda p: 255 if p > 255 - threshold else 0)
+    bbox = mask.getbbox()
+    if not bbox:
+        return image
+    left, top, right, bottom = bbox
+    return image.crop((
+        max(left - padding, 0),
+        max(top - padding, 0),
+        min(right + padding, image.width),
+        min(bottom + padding, image.height),
+    ))
+
+PREPROCESS_CACHE_DIR = '.cache/railflow/preprocess'
+
+_cache_lock = threading.Lock()
+# Total size of the files of each preprocessing cache directory, scanned on first use
+_cache_sizes = {}
+
+
+def _add_to_cache(cache_dir:str, size:int, max_bytes:int):
+    """Accounts a new file of `cache_dir` and, once the directory exceeds `max_bytes`, removes
+    its least recently used files (by mtime, refreshed on every hit) down to 90% of it."""
+    with _cache_lock:
+        if cache_dir not in _cache_sizes:
+            _cache_sizes[cache_dir] = sum(entry.stat().st_size for entry in os.scandir(cache_dir) if entry.is_file())
+        else:
+            _cache_sizes[cache_dir] += size
+        if _cache_sizes[cache_dir] <= max_bytes:
+            return
+
+        entries = []
+        for entry in os.scandir(cache_dir):
+            try:
+                if entry.is_file() and not entry.name.endswith('.tmp'):
+                    stat = entry.stat()
+                    entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+            except FileNotFoundError:
+                continue
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes * 0.9:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+        _cache_sizes[cache_dir] = total
+
+
+def preprocess_image(
+    image_path:str,
+    max_long_edge:int=None,
+    format:str='JPEG',
+    quality:int=85,
+    grayscale:bool=False,
+    crop_margins:bool=False,
+    cache_dir:str=None,
+    cache_max_bytes:int=1024 * 1024 * 1024,
+) -> str:
+    """Downscales and recompresses an image before it is encoded and uploaded.
+
+    The result is written to `cache_dir` under a name derived from the source file
+    (path, mtime, size) and the options, so reruns reuse the processed file. The least
+    recently used files are removed once the directory exceeds `cache_max_bytes`.
+
+    Args:
+        image_path (str): Path of the source image.
+        max_long_edge (int): Maximum size in pixels of the longest edge; None keeps the size.
+        format (str): Output format understood by PIL, e.g. 'JPEG', 'PNG' or 'WEBP'.
+        quality (int): Output quality (1-100) for lossy formats.
+        grayscale (bool): Whether to convert to grayscale, e.g. for text-only exam pages.
+        crop_margins (bool): Whether to crop blank margins around the content.
+        cache_dir (str): Directory of processed images, defaults to PREPROCESS_CACHE_DIR (relative
+            to the working directory).
+        cache_max_bytes (int): Maximum total size of the processed images.
+
+    Returns:
+        str: Path of the processed image.
+    """
+    from PIL import Image
+
+    stat = os.stat(image_path)
+    options = (max_long_edge, format.upper(), quality, grayscale, crop_margins)
+    key = hashlib.sha256(
+        repr((os.path.abspath(image_path), stat.st_mtime_ns, stat.st_size, options)).encode('utf-8')
+    ).hexdigest()
+
+    cache_dir = cache_dir or PREPROCESS_CACHE_DIR
+    output_path = os.path.join(cache_dir, f'{key}.{format.lower()}')
+    try:
+        # A hit refreshes the mtime, which orders the files for eviction
+        os.utime(output_path)
+        return output_path
+    except FileNotFoundError:
+        pass
+
+    with Image.open(image_path) as image:
+        image.load()
+        if crop_margins:
+            image = _crop_blank_margins(image)
+        if max_long_edge and max(image.size) > max_long_edge:
+            image.thumbnail((max_long_edge, max_long_edge), Image.LANCZOS)
+        if grayscale:
+            image = image.convert('L')
+        elif image.mode not in ('RGB', 'L') and format.upper() == 'JPEG':
+            image = image.convert('RGB')
 
-    data_url = f"data:image/jpeg;base64,{data}"
-    return data_url
\ No newline at end of file
+        # Write to a temporary name first so concurrent workers never read a partial file
+        os.makedirs(cache_dir, exist_ok=True)
+        temp_path = f'{output_path}.{os.getpid()}.{threading.get_ident()}.tmp'
+        image.save(temp_path, format, quality=quality, optimize=True)
+    os.replace(temp_path, output_path)
+    _add_to_cache(cache_dir, os.path.getsize(output_path), cache_max_bytes)
+    return output_path
@@ -1,32 +1,68 @@
+import os
+import json
+import hashlib
 import pdf2image
 import shutil
+from concurrent.futures import ProcessPoolExecutor, as_completed
 from pathlib import Path
 from PIL import Image
-from typing import List, Union
+from typing import Iterable, Iterator, List, Optional, Union
 
 
 class PDF2ImagesConverter:
     """PDF to Image converter class with a transformers-like API style"""
     
-    def __init__(self, images: List[Image.Image], source_path: Path):
+    def __init__(self,
+                 images: List[Image.Image],
+                 source_path: Path,
+                 first_page: int = 1,
+                 last_page: int = None,
+                 chunk_size: int = 4,
+                 convert_kwargs: dict = None,
+                 page_count: int = None):
         """
         Initialize the converter with converted images
         
         Args:
-            images: List of converted PDF images
+            images: List of converted PDF images, or None to render pages lazily
             source_path: Original PDF file path
+            first_page: First page to render in lazy mode (1-based)
+            last_page: Last page to render in lazy mode (inclusive)
+            chunk_size: Number of pages rendered per pdf2image call in lazy mode
+            convert_kwargs: Arguments passed to pdf2image.convert_from_path in lazy mode
+            page_count: Number of pages of the whole document, known in lazy mode
         """
         self.images = images
         self.source_path = source_path
+        self.first_page = first_page
+        self.last_page = last_page
+        self.chunk_size = chunk_size
+        self.convert_kwargs = convert_kwargs or {}
+        self.page_count = page_count
+
+    @property
+    def lazy(self) -> bool:
+        """Whether pages are rendered on demand instead of held in memory"""
+        return self.images is None
     
     @classmethod
-    def convert_from(cls, file_path: Union[str, Path], **kwargs):
+    def convert_from(cls,
+                     file_path: Union[str, Path],
+                     lazy: bool = False,
+                     chunk_size: int = 4,
+                     **kwargs):
         """
         Create a converter instance from a PDF file, similar to transformers' from_pretrained
         
         Args:
             file_path: Path to the PDF file
-            **kwargs: Additional arguments to pass to pdf2image.convert_from_path
+            lazy: If True, nothing is rendered up front; pages are rendered `chunk_size` at a
+                  time (via first_page/last_page) while iterating, so memory stays constant
+                  regardless of the document length. Defaults to False
+            chunk_size: Number of pages rendered per pdf2image call in lazy mode
+            **kwargs: Additional arguments to pass to pdf2image.convert_from_path. In lazy mode,
+                      passing output_folder with paths_only=True makes iteration yield the
+                      paths of pages written directly by pdf2image
             
         Returns:
             PDF2ImagesConverter: A new converter instance
@@ -46,6 +82,29 @@ class PDF2ImagesConverter:
         if file_path.suffix.lower() != '.pdf':
             raise ValueError(f"File must be PDF format: {file_path}")
             
+        if chunk_size < 1:
+            raise ValueError(f"chunk_size must be >= 1, got {chunk_size}")
+
+        if lazy:
+            try:
+                # Only read the page count, pages are rendered while iterating
+                info_kwargs = {key: kwargs[key] for key in ('poppler_path', 'userpw', 'ownerpw') if key in kwargs}
+                page_count = pdf2image.pdfinfo_from_path(str(file_path), **info_kwargs)['Pages']
+            except Exception as e:
+                raise RuntimeError(f"Error reading PDF info: {str(e)}")
+
+            first_page = max(kwargs.pop('first_page', None) or 1, 1)
+            last_page = min(kwargs.pop('last_page', None) or page_count, page_count)
+            return cls(
+                images=None,
+                source_path=file_path,
+                first_page=first_page,
+                last_page=last_page,
+                chunk_size=chunk_size,
+                convert_kwargs=kwargs,
+                page_count=page_count,
+            )
+
         try:
             # Convert PDF to images
             images = pdf2image.convert_from_path(str(file_path), **kwargs)
@@ -87,8 +146,12 @@ class PDF2ImagesConverter:
             elif not save_directory.exists():
                 save_directory.mkdir(parents=True)
             
-            # Save all images
-            for i, image in enumerate(self.images):
+            # Save all images, one at a time so lazy converters never hold the whole document
+            for i, image in enumerate(self):
+                # Pages rendered with paths_only are already on disk, load them back to convert
+                if isinstance(image, (str, Path)):
+                    with Image.open(image) as page:
+                        image = page.copy()
                 output_file = save_directory / f'page_{i+1}.{format.lower()}'
                 image.save(
                     str(output_file),
@@ -100,10 +163,225 @@ class PDF2ImagesConverter:
         except Exception as e:
             raise RuntimeError(f"Error saving images: {str(e)}")
 
+    def _render(self, first_page: int, last_page: int) -> List[Union[Image.Image, str]]:
+        """Render a range of pages (1-based, inclusive)"""
+        try:
+            return pdf2image.convert_from_path(
+                str(self.source_path),
+                first_page=first_page,
+                last_page=last_page,
+                **self.convert_kwargs
+            )
+        except Exception as e:
+            raise RuntimeError(f"Error converting PDF: {str(e)}")
+
+    def __iter__(self) -> Iterator[Union[Image.Image, str]]:
+        """Iterate over pages, rendering them chunk by chunk in lazy mode"""
+        if not self.lazy:
+            yield from self.images
+            return
+
+        for start in range(self.first_page, self.last_page + 1, self.chunk_size):
+            yield from self._render(start, min(start + self.chunk_size - 1, self.last_page))
+
     def __len__(self) -> int:
-        """Return the number of converted images"""
+        """Return the number of converted images, without rendering in lazy mode"""
+        if self.lazy:
+            return max(self.last_page - self.first_page + 1, 0)
         return len(self.images)
 
     def __getitem__(self, index: int) -> Image.Image:
         """Support indexing to access converted images"""
-        return self.images[index]
\ No newline at end of file
+        if not self.lazy:
+            return self.images[index]
+
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("page index out of range")
+        page = self.first_page + index
+        return self._render(page, page)[0]
+
+
+def _hash_file(file_path: Path, chunk_size: int = 1 << 20) -> str:
+    """Return the SHA-256 hex digest of a file's content"""
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as f:
+        while chunk := f.read(chunk_size):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+# pdf2image arguments that change how a document is rendered but not its pages
+_EXECUTION_KWARGS = ('thread_count', 'poppler_path', 'userpw', 'ownerpw', 'timeout', 'first_page', 'last_page')
+
+
+def _options_key(format: str, quality: int, convert_kwargs: dict) -> str:
+    """Return a short digest of the options that determine the content of the pages"""
+    options = {key: value for key, value in convert_kwargs.items() if key not in _EXECUTION_KWARGS}
+    options.update(format=format.upper(), quality=quality)
+    return hashlib.sha256(json.dumps(options, sort_keys=True, default=repr).encode('utf-8')).hexdigest()[:8]
+
+
+def _marker_range(done_marker: Path, convert_kwargs: dict) -> Optional[range]:
+    """
+    Return the pages recorded by a `.done` marker (`<first>-<last>/<page count>`) when they are
+    the ones requested by `convert_kwargs`, without reading the PDF info
+    """
+    try:
+        pages, page_count = done_marker.read_text().strip().split('/')
+        first, last = (int(page) for page in pages.split('-'))
+        page_count = int(page_count)
+    except (FileNotFoundError, ValueError):
+        return None
+
+    requested_last = convert_kwargs.get('last_page')
+    if first != max(convert_kwargs.get('first_page') or 1, 1):
+        return None
+    if last != (min(requested_last, page_count) if requested_last else page_count):
+        return None
+    return range(first, last + 1)
+
+
+def _convert_document(file_path: Path,
+                      output_dir: Path,
+                      format: str,
+                      quality: int,
+                      chunk_size: int,
+                      convert_kwargs: dict) -> dict:
+    """
+    Convert one PDF into `output_dir/<stem>-<hash>-<options>/page_<n>.<ext>`, skipping pages
+    already written
+
+    The directory is keyed by the source hash and by the rendering options (format, quality,
+    dpi, ...), and its `.done` marker records the page range, so a rerun with other options or
+    pages never reuses pages rendered differently. A completed document is skipped from its
+    marker alone, without running pdfinfo.
+
+    Runs in a worker process of PDF2ImagesCorpusConverter.
+    """
+    source_hash = _hash_file(file_path)
+    document_dir = output_dir / f'{file_path.stem}-{source_hash[:16]}-{_options_key(format, quality, convert_kwargs)}'
+    done_marker = document_dir / '.done'
+    page_path = lambda page: document_dir / f'page_{page}.{format.lower()}'
+
+    page_numbers = _marker_range(done_marker, convert_kwargs)
+    skipped = page_numbers is not None
+    if not skipped:
+        converter = PDF2ImagesConverter.convert_from(file_path, lazy=True, chunk_size=chunk_size, **convert_kwargs)
+        page_numbers = range(converter.first_page, converter.last_page + 1)
+        document_dir.mkdir(parents=True, exist_ok=True)
+        missing = [page for page in page_numbers if not page_path(page).exists()]
+
+        # Render runs of consecutive missing pages, chunk_size pages per call
+        while missing:
+            start = end = missing.pop(0)
+            while missing and missing[0] == end + 1 and end - start + 1 < chunk_size:
+                end = missing.pop(0)
+
+            for page, image in zip(range(start, end + 1), converter._render(start, end)):
+                # Write to a temporary name first so an interrupted run never leaves a partial page
+                temp_path = page_path(page).with_suffix('.tmp')
+                image.save(str(temp_path), format, quality=quality, optimize=True)
+                os.replace(temp_path, page_path(page))
+        done_marker.write_text(f'{converter.first_page}-{converter.last_page}/{converter.page_count}')
+
+    return {
+        'source': str(file_path),
+        'source_hash': source_hash,
+        'output_dir': str(document_dir),
+        'pages': [str(page_path(page)) for page in page_numbers],
+        'skipped': skipped,
+    }
+
+
+class PDF2ImagesCorpusConverter:
+    """
+    Convert many PDFs in parallel, with resume support
+
+    Documents are spread across a process pool and pdf2image's `thread_count` is used within
+    each document. Output directories are keyed by the source content hash and the rendering
+    options, so documents and pages already written by a previous (possibly interrupted) run
+    are skipped. Every converted document is recorded in `output_dir/manifest.jsonl`; a
+    document that fails to convert does not stop the others.
+    """
+
+    MANIFEST_NAME = 'manifest.jsonl'
+
+    def __init__(self,
+                 output_dir: Union[str, Path],
+                 max_workers: int = None,
+                 thread_count: int = 1,
+                 format: str = 'JPEG',
+                 quality: int = 95,
+                 chunk_size: int = 4,
+                 **kwargs):
+        """
+        Args:
+            output_dir: Root directory of converted pages and of the manifest
+            max_workers: Number of worker processes, defaults to the number of CPUs
+            thread_count: pdf2image threads used within each document
+            format: Image format, defaults to 'JPEG'
+            quality: Image quality (1-100), defaults to 95
+            chunk_size: Number of pages rendered per pdf2image call
+            **kwargs: Additional arguments to pass to pdf2image.convert_from_path
+        """
+        self.output_dir = Path(output_dir)
+        self.max_workers = max_workers
+        self.format = format
+        self.quality = quality
+        self.chunk_size = chunk_size
+        self.convert_kwargs = {'thread_count': thread_count, **kwargs}
+
+    @property
+    def manifest_path(self) -> Path:
+        return self.output_dir / self.MANIFEST_NAME
+
+    def load_manifest(self) -> dict:
+        """Return the manifest entries written so far, keyed by output directory (one per
+        source hash and rendering options)"""
+        if not self.manifest_path.exists():
+            return {}
+        with open(self.manifest_path, 'r', encoding='utf-8') as f:
+            entries = (json.loads(line) for line in f if line.strip())
+            return {entry['output_dir']: entry for entry in entries}
+
+    def convert(self, file_paths: Iterable[Union[str, Path]]) -> Iterator[dict]:
+        """
+        Convert PDFs and yield one manifest entry per document as it completes
+
+        A document that fails to convert yields `{'source': ..., 'error': ...}` instead, and is
+        not recorded in the manifest so the next run tries it again.
+
+        Args:
+            file_paths: Paths of the PDF files to convert
+        """
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        recorded = {(entry['output_dir'], tuple(entry['pages'])) for entry in self.load_manifest().values()}
+
+        with ProcessPoolExecutor(max_workers=self.max_workers) as executor, \
+             open(self.manifest_path, 'a', encoding='utf-8') as manifest:
+            futures = {
+                executor.submit(
+                    _convert_document,
+                    Path(file_path),
+                    self.output_dir,
+                    self.format,
+                    self.quality,
+                    self.chunk_size,
+                    self.convert_kwargs,
+                ): file_path
+                for file_path in file_paths
+            }
+            for future in as_completed(futures):
+                try:
+                    entry = future.result()
+                except Exception as e:
+                    yield {'source': str(futures[future]), 'error': f"Error converting {futures[future]}: {str(e)}"}
+                    continue
+
+                if (key := (entry['output_dir'], tuple(entry['pages']))) not in recorded:
+                    recorded.add(key)
+                    manifest.write(json.dumps(entry, ensure_ascii=False) + '\n')
+                    manifest.flush()
+                yield entry
@@ -0,0 +1,5 @@
+import sys
+from pathlib import Path
+
+# Modules are imported from src/ with flat imports (railflow, inference_engine, utils)
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / 'src'))
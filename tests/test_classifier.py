@@ -0,0 +1,64 @@
+import pytest
+
+from railflow.base.classifier import LabelClassifier, normalize_label
+from railflow.base.config import ActionConfig, ConditionConfig, ConditionMode, FlowConfig
+from railflow.base.plan import compile_flows
+
+
+LABELS = ['Chemistry', 'Biology', 'Earth Science']
+
+
+@pytest.mark.parametrize('text, expected', [
+    ('Chemistry', 'chemistry'),
+    ('  "CHEMISTRY."\n', 'chemistry'),
+    ('Answer: Earth   Science!', 'earth science'),
+    ('**label = biology**', 'biology'),
+])
+def test_normalize_label(text, expected):
+    assert normalize_label(text) == expected
+
+
+@pytest.mark.parametrize('response, expected', [
+    ('chemistry', 'Chemistry'),
+    ('Earth science.', 'Earth Science'),
+    ("'Biology'", 'Biology'),
+    ('Category: BIOLOGY', 'Biology'),
+    ('Chemistry\nThe page shows a titration curve.', 'Chemistry'),
+    ('{"label": "Earth Science"}', 'Earth Science'),
+])
+def test_match_maps_responses_to_labels(response, expected):
+    assert LabelClassifier(LABELS).match(response) == expected
+
+
+@pytest.mark.parametrize('response', ['Physics', 'Chemistry or Biology', '{"label": "Physics"}', '{not json', ''])
+def test_match_keeps_unknown_responses(response):
+    assert LabelClassifier(LABELS).match(response) == response
+
+
+def test_match_passes_non_text_responses_through():
+    assert LabelClassifier(LABELS).match(None) is None
+
+
+def test_structured_output_constrains_the_response_to_the_labels():
+    classifier = LabelClassifier(LABELS, structured_output=True)
+    params = classifier.generation_params({'temperature': 0.7, 'max_completion_tokens': 1000})
+
+    schema = params['response_format']['json_schema']['schema']
+    assert schema['properties']['label']['enum'] == LABELS
+    assert params['temperature'] == 0.7
+    assert params['max_completion_tokens'] == classifier.max_tokens > LabelClassifier(LABELS).max_tokens
+    assert 'max_tokens' not in params
+    assert classifier.match('{"label": "Biology"}') == 'Biology'
+
+
+def test_yes_no_condition_can_answer_false():
+    condition = ConditionConfig(type='prompt', task='Is this an exam page?', mode=ConditionMode.classify)
+    action = ActionConfig(type='prompt', task='Transcribe the questions.')
+    plan = compile_flows({'exam': FlowConfig(action={'True': action}, condition=condition)})
+
+    flow, = plan
+    classifier = flow.condition.classifier
+    assert classifier.labels == ('True', 'False')
+    assert classifier.match('false.') == 'False'
+    assert classifier.match('TRUE') == 'True'
+    assert 'False' not in flow.actions
@@ -0,0 +1,24 @@
+from inference_engine.fake import FakeEngine
+
+
+def _outcomes(engine, count:int=20) -> list:
+    outcomes = []
+    for _ in range(count):
+        try:
+            outcomes.append(engine.chat.completions.create(messages=[{'role': 'user', 'content': 'hi'}]).choices[0].message.content)
+        except Exception as e:
+            outcomes.append(type(e).__name__)
+    return outcomes
+
+
+def test_engines_with_equal_arguments_are_independent():
+    kwargs = {'responses': {'hi': ['a', 'b', 'c']}, 'error_rate': 0.3, 'seed': 7}
+    first, second = FakeEngine(**kwargs), FakeEngine(**kwargs)
+
+    assert first.base_client is not second.base_client
+    expected = _outcomes(first)
+    assert 'InternalServerError' in expected
+    assert _outcomes(second) == expected
+
+    first.base_client.reset()
+    assert _outcomes(first) == expected
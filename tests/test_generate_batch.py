@@ -0,0 +1,95 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from inference_engine.fake import AsyncFakeEngine
+from railflow.base import RailFlow, RailFlowConfig
+
+CONFIG_PATH = Path(__file__).resolve().parent.parent / 'config' / 'sample_for_exam.yml'
+RESPONSES = {'numbered 1 to': '1: Chemistry\n2: Chemistry\n3: Chemistry\n4: Chemistry', 'Would this image': 'Chemistry'}
+
+
+@pytest.fixture
+def flows():
+    return RailFlowConfig.from_yaml(CONFIG_PATH).rails.input.flows
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    paths = []
+    for index in range(8):
+        path = tmp_path / f'{index}.jpg'
+        Image.new('RGB', (32, 32), (index * 30, 0, 0)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+def _other_tasks():
+    return asyncio.all_tasks() - {asyncio.current_task()}
+
+
+@pytest.mark.parametrize('condition_pack_size', [1, 4])
+def test_closing_the_batch_early_stops_requests_in_flight(flows, image_paths, condition_pack_size):
+    # Spread latencies, so that other images are still in flight when the first one is done
+    rail_flow = RailFlow(AsyncFakeEngine(responses=RESPONSES, default_response='QA', latency=lambda rng: rng.uniform(0.01, 0.2)))
+
+    async def run():
+        batch = rail_flow.generate_batch(flows, image_paths, max_concurrency=4, condition_pack_size=condition_pack_size)
+        async for _ in batch:
+            break
+        await batch.aclose()
+        return _other_tasks()
+
+    assert asyncio.run(run()) == set()
+
+
+def test_failing_image_of_a_pack_cancels_its_siblings(flows, image_paths):
+    rail_flow = RailFlow(AsyncFakeEngine(responses=RESPONSES, default_response='QA', latency=0.2))
+    image_paths = image_paths[:3] + ['missing.jpg']
+
+    async def run():
+        with pytest.raises(FileNotFoundError):
+            async for _ in rail_flow.generate_batch(flows, image_paths, max_concurrency=4, condition_pack_size=4):
+                pass
+        return _other_tasks()
+
+    assert asyncio.run(run()) == set()
+
+
+def test_closing_the_pipeline_early_stops_its_stages(image_paths):
+    rails = RailFlowConfig.from_yaml(CONFIG_PATH).rails
+    rail_flow = RailFlow(AsyncFakeEngine(responses=RESPONSES, default_response='QA', latency=lambda rng: rng.uniform(0.01, 0.05)))
+
+    async def run():
+        # A single-slot handoff queue is full by the time the consumer stops
+        pipeline = rail_flow.generate_pipeline(rails, image_paths, input_concurrency=4, output_concurrency=1, queue_size=1)
+        async for _ in pipeline:
+            await asyncio.sleep(0.3)
+            break
+        await asyncio.wait_for(pipeline.aclose(), timeout=5)
+        return _other_tasks()
+
+    assert asyncio.run(run()) == set()
+
+
+@pytest.mark.parametrize('condition_pack_size', [1, 2, 8])
+def test_images_in_flight_never_exceed_max_concurrency(flows, image_paths, condition_pack_size):
+    rail_flow = RailFlow(AsyncFakeEngine(responses=RESPONSES, default_response='QA', latency=0.02))
+    generate, in_flight, peak = rail_flow.agenerate, set(), []
+
+    async def agenerate(*args, image_path, **kwargs):
+        in_flight.add(image_path)
+        peak.append(len(in_flight))
+        try:
+            return await generate(*args, image_path=image_path, **kwargs)
+        finally:
+            in_flight.discard(image_path)
+    rail_flow.agenerate = agenerate
+
+    async def run():
+        return [item async for item in rail_flow.generate_batch(flows, image_paths, max_concurrency=3, condition_pack_size=condition_pack_size)]
+
+    assert len(asyncio.run(run())) == len(image_paths)
+    assert max(peak) <= 3
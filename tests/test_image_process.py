@@ -0,0 +1,40 @@
+import os
+import time
+
+from PIL import Image
+
+from utils.image_process import preprocess_image
+
+
+def _image(path, seed:int):
+    Image.effect_noise((64, 64), 50 + seed).convert('RGB').save(path)
+    return str(path)
+
+
+def test_processed_images_are_reused(tmp_path):
+    source = _image(tmp_path / 'page.png', 0)
+    cache_dir = str(tmp_path / 'cache')
+
+    first = preprocess_image(source, max_long_edge=32, cache_dir=cache_dir)
+    second = preprocess_image(source, max_long_edge=32, cache_dir=cache_dir)
+    other = preprocess_image(source, max_long_edge=16, cache_dir=cache_dir)
+
+    assert first == second != other
+    assert Image.open(first).size == (32, 32)
+    assert os.path.dirname(first) == cache_dir
+
+
+def test_cache_evicts_least_recently_used_files(tmp_path):
+    cache_dir = str(tmp_path / 'cache')
+    sources = [_image(tmp_path / f'{index}.png', index) for index in range(4)]
+
+    outputs = [preprocess_image(sources[0], format='PNG', cache_dir=cache_dir)]
+    size = os.path.getsize(outputs[0])
+    outputs.append(preprocess_image(sources[1], format='PNG', cache_dir=cache_dir))
+    time.sleep(0.01)
+    # A hit makes the first file the most recently used
+    preprocess_image(sources[0], format='PNG', cache_dir=cache_dir)
+    time.sleep(0.01)
+    outputs.append(preprocess_image(sources[2], format='PNG', cache_dir=cache_dir, cache_max_bytes=int(size * 2.5)))
+
+    assert [os.path.exists(output) for output in outputs] == [True, False, True]
@@ -0,0 +1,67 @@
+import asyncio
+
+import httpx
+
+from inference_engine.limiter import RateLimiter
+from inference_engine.openai import AsyncOpenAIWrapper, OpenAIWrapper
+
+
+class _ThrottlingServer:
+    """Answers the first `throttled` requests with a 429, the others with a completion."""
+
+    def __init__(self, throttled:int):
+        self.throttled = throttled
+        self.requests = 0
+
+    def __call__(self, request:httpx.Request) -> httpx.Response:
+        self.requests += 1
+        if self.requests <= self.throttled:
+            return httpx.Response(429, headers={'retry-after-ms': '1'}, json={'error': {'message': 'slow down'}})
+        return httpx.Response(200, json={
+            'id': 'chatcmpl-1', 'object': 'chat.completion', 'created': 0, 'model': 'test',
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'hi'}}],
+        })
+
+
+def _client_params(server, is_async:bool) -> dict:
+    client_class = httpx.AsyncClient if is_async else httpx.Client
+    return {'api_key': 'test', 'base_url': 'http://test/v1', 'http_client': client_class(transport=httpx.MockTransport(server))}
+
+
+MESSAGES = [{'role': 'user', 'content': 'hello'}]
+
+
+def test_sync_limiter_sees_and_retries_429s():
+    server = _ThrottlingServer(throttled=2)
+    limiter = RateLimiter(base_delay=0.001)
+    engine = OpenAIWrapper(rate_limiter=limiter, client_params=_client_params(server, False), model='test')
+
+    response = engine.chat.completions.create(messages=MESSAGES)
+
+    assert response.choices[0].message.content == 'hi'
+    assert engine.base_client.max_retries == 0
+    assert (server.requests, limiter.retries, limiter.throttled) == (3, 2, 2)
+
+
+def test_async_limiter_sees_and_retries_429s():
+    server = _ThrottlingServer(throttled=2)
+    limiter = RateLimiter(base_delay=0.001)
+
+    async def run():
+        engine = AsyncOpenAIWrapper(rate_limiter=limiter, client_params=_client_params(server, True), model='test')
+        return await engine.chat.completions.create(messages=MESSAGES)
+
+    response = asyncio.run(run())
+
+    assert response.choices[0].message.content == 'hi'
+    assert (server.requests, limiter.retries, limiter.throttled) == (3, 2, 2)
+    # Retries are over, the concurrency slot of the request was released
+    assert limiter.concurrency.in_flight == 0
+
+
+def test_explicit_client_retries_are_kept():
+    engine = OpenAIWrapper(
+        rate_limiter=RateLimiter(),
+        client_params={**_client_params(_ThrottlingServer(0), False), 'max_retries': 3},
+    )
+    assert engine.base_client.max_retries == 3
@@ -0,0 +1,72 @@
+import asyncio
+from pathlib import Path
+
+import pytest
+from PIL import Image
+
+from inference_engine.fake import AsyncFakeEngine, FakeEngine
+from railflow.base import RailFlow, RailFlowConfig
+from railflow.base.packing import parse_packed_response
+
+
+CONFIG_PATH = Path(__file__).resolve().parent.parent / 'config' / 'sample_for_exam.yml'
+
+
+@pytest.fixture
+def flows():
+    return RailFlowConfig.from_yaml(CONFIG_PATH).rails.input.flows
+
+
+@pytest.fixture
+def image_paths(tmp_path):
+    paths = []
+    for index in range(4):
+        path = tmp_path / f'{index}.jpg'
+        Image.new('RGB', (32, 32), (index * 60, 0, 0)).save(path)
+        paths.append(str(path))
+    return paths
+
+
+@pytest.mark.parametrize('content, expected', [
+    ('1: Chemistry\n2: Biology\n3: Physics', ['Chemistry', 'Biology', 'Physics']),
+    ('Sure! Here are the answers:\n\nImage 1: Chemistry\n2. Biology\n#3) Physics\nHope this helps.', ['Chemistry', 'Biology', 'Physics']),
+    ('1: Chemistry\n3: Physics', ['Chemistry', None, 'Physics']),
+    ('1: Chemistry\n1: Biology\n2: Physics\n3:', ['Chemistry', 'Physics', None]),
+    ('0: Chemistry\n4: Biology\n2: Physics', [None, 'Physics', None]),
+    ('{"labels": ["Chemistry", "Biology", "Physics"]}', ['Chemistry', 'Biology', 'Physics']),
+    ('{"labels": ["Chemistry", "Biology"]}', [None, None, None]),
+    ('Chemistry', [None, None, None]),
+    (None, [None, None, None]),
+])
+def test_parse_packed_response(content, expected):
+    assert parse_packed_response(content, 3) == expected
+
+
+def test_malformed_packed_answers_fall_back_to_single_image_calls(flows, image_paths):
+    # Image 1 is answered twice, 2 is missing, 3 names no label and 4 is a valid label
+    packed_answer = 'Here you go:\n1: Biology\n1: Physics\n3: Maybe chemistry?\n4: earth science.\nDone.'
+    engine = FakeEngine(responses={'numbered 1 to': packed_answer, 'Would this image': 'Chemistry'}, default_response='QA')
+    rail_flow = RailFlow(engine)
+
+    packed = rail_flow.pack_conditions(flows, image_paths)
+
+    assert [list(packed[path].responses.values()) for path in image_paths] == [['Biology'], [], [], ['Earth Science']]
+    assert all(packed[path].usage for path in image_paths)
+
+    for image_path in image_paths:
+        rail_flow.generate(flows, image_path=image_path, packed_conditions=packed[image_path])
+    assert (rail_flow.stats.condition_calls_packed, rail_flow.stats.condition_calls_seeded) == (1, 2)
+    assert rail_flow.stats.condition_calls == 2
+
+
+def test_batch_answers_every_image_of_a_malformed_pack(flows, image_paths):
+    engine = AsyncFakeEngine(responses={'numbered 1 to': 'I cannot see any images.', 'Would this image': 'Physics'}, default_response='QA')
+    rail_flow = RailFlow(engine)
+
+    async def run():
+        return dict([item async for item in rail_flow.generate_batch(flows, image_paths, condition_pack_size=4, return_result=True)])
+
+    results = asyncio.run(run())
+    assert sorted(results) == sorted(image_paths)
+    assert rail_flow.stats.condition_calls_seeded == 0
+    assert rail_flow.stats.condition_calls == len(image_paths)
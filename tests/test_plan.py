@@ -0,0 +1,65 @@
+from pathlib import Path
+
+import pytest
+
+from railflow.base import RailFlowConfig
+from railflow.base.plan import compile_flows
+
+
+CONFIG_PATH = Path(__file__).resolve().parent.parent / 'config' / 'sample_for_exam.yml'
+
+
+@pytest.fixture
+def plan():
+    return compile_flows(RailFlowConfig.from_yaml(CONFIG_PATH).rails.input.flows)
+
+
+def _params(plan):
+    flow, = plan
+    return dict(flow.condition.params), {key: dict(action.params) for key, action in flow.actions.items()}
+
+
+def test_overlay_wins_over_compiled_params(plan):
+    overlaid = plan.overlay(
+        action_params={'language': 'en', 'qa': {'chemistry': {'subject': 'Organic Chemistry'}}},
+        condition_params={'options': 'Chemistry/Physics'},
+    )
+
+    condition_params, action_params = _params(overlaid)
+    assert condition_params == {'options': 'Chemistry/Physics'}
+    assert action_params['Chemistry']['subject'] == 'Organic Chemistry'
+    assert action_params['Biology']['subject'] == 'Chemistry'
+    assert {params['language'] for params in action_params.values()} == {'en'}
+    assert action_params['Chemistry']['max_turn'] == 3
+
+
+def test_flow_params_win_over_global_params(plan):
+    overlaid = plan.overlay(action_params={'language': 'en', 'qa': {'language': 'fr'}})
+
+    _, action_params = _params(overlaid)
+    assert {params['language'] for params in action_params.values()} == {'fr'}
+
+
+def test_overlay_leaves_the_compiled_plan_unchanged(plan):
+    before = _params(plan)
+    flow, = plan
+    shared = flow.actions['Biology']
+
+    overlaid = plan.overlay(action_params={'language': 'en', 'qa': {'Chemistry': {'subject': 'Physics'}}})
+
+    assert _params(plan) == before
+    assert flow.actions['Biology'] is shared
+    # Actions sharing a compiled task still share a single overlaid task
+    overlaid_flow, = overlaid
+    assert overlaid_flow.actions['Biology'] is overlaid_flow.actions['Physics'] is not shared
+    assert overlaid_flow.condition is flow.condition
+
+
+def test_plans_are_immutable(plan):
+    flow, = plan
+
+    assert plan.overlay() is plan
+    with pytest.raises(AttributeError):
+        flow.condition = None
+    with pytest.raises(TypeError):
+        flow.condition.params['options'] = 'Cat/Dog'
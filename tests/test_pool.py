@@ -0,0 +1,78 @@
+import time
+import asyncio
+
+import openai
+import pytest
+
+from inference_engine.fake import AsyncFakeEngine, FakeEngine
+from inference_engine.pool import EnginePool
+
+
+MESSAGES = [{'role': 'user', 'content': 'Which subject is this exam page about?'}]
+
+
+def _ask(pool):
+    return pool.chat.completions.create(messages=MESSAGES).choices[0].message.content
+
+
+def _stats(pool, key):
+    return [stats[key] for stats in pool.endpoint_stats()]
+
+
+def test_failing_replica_is_retried_elsewhere_then_ejected_and_restored():
+    pool = EnginePool(
+        [FakeEngine(error_rate=1.0), FakeEngine(default_response='Chemistry', seed=1)],
+        failure_threshold=2,
+        ejection_seconds=0.2,
+    )
+
+    # Every request succeeds on the healthy replica, until the failing one is ejected
+    assert [_ask(pool) for _ in range(6)] == ['Chemistry'] * 6
+    assert _stats(pool, 'requests') == [2, 6]
+    assert _stats(pool, 'errors') == [2, 0]
+    assert _stats(pool, 'ejected') == [True, False]
+
+    time.sleep(0.25)
+    assert _stats(pool, 'ejected') == [False, False]
+    assert [_ask(pool) for _ in range(4)] == ['Chemistry'] * 4
+    assert _stats(pool, 'requests') == [4, 10]
+    # The second ejection lasts twice as long
+    assert _stats(pool, 'ejected') == [True, False]
+    assert pool.endpoints[0].ejected_until - time.monotonic() > 0.2
+
+
+def test_fallback_only_serves_requests_no_replica_can_take():
+    pool = EnginePool(
+        [FakeEngine(error_rate=1.0)],
+        fallbacks=[FakeEngine(default_response='Biology', seed=1)],
+        failure_threshold=1,
+        ejection_seconds=60,
+    )
+
+    assert [_ask(pool) for _ in range(3)] == ['Biology'] * 3
+    # Once ejected, the replica is skipped instead of failing each request first
+    assert _stats(pool, 'requests') == [1, 3]
+
+
+def test_error_is_raised_once_every_endpoint_failed():
+    pool = EnginePool([FakeEngine(error_rate=1.0), FakeEngine(error_rate=1.0, seed=1)])
+
+    with pytest.raises(openai.InternalServerError):
+        _ask(pool)
+    assert _stats(pool, 'requests') == [1, 1]
+    assert _stats(pool, 'outstanding') == [0, 0]
+
+
+def test_async_pool_retries_on_another_replica():
+    pool = EnginePool([AsyncFakeEngine(error_rate=1.0), AsyncFakeEngine(default_response='Physics', seed=1)], failure_threshold=2)
+
+    async def ask():
+        response = await pool.chat.completions.create(messages=MESSAGES)
+        return response.choices[0].message.content
+
+    async def run():
+        return await asyncio.gather(*(ask() for _ in range(8)))
+
+    assert asyncio.run(run()) == ['Physics'] * 8
+    assert _stats(pool, 'errors')[0] == _stats(pool, 'requests')[0] >= 1
+    assert _stats(pool, 'ejected') == [True, False]
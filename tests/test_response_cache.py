@@ -0,0 +1,79 @@
+import json
+import asyncio
+
+import httpx
+
+from inference_engine.cache import ResponseCache
+from inference_engine.openai import AsyncOpenAIWrapper, OpenAIWrapper
+
+
+def _completion(content:str='hi') -> dict:
+    return {
+        'id': 'chatcmpl-1', 'object': 'chat.completion', 'created': 0, 'model': 'test',
+        'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': content}}],
+        'usage': {'prompt_tokens': 1, 'completion_tokens': 1, 'total_tokens': 2},
+    }
+
+
+class _Server:
+    """Records the requests of a mock transport and answers each with a completion."""
+
+    def __init__(self):
+        self.requests = []
+
+    def __call__(self, request:httpx.Request) -> httpx.Response:
+        self.requests.append(json.loads(request.content))
+        return httpx.Response(200, json=_completion(f'answer {len(self.requests)}'))
+
+
+def _client_params(server:_Server, is_async:bool) -> dict:
+    client_class = httpx.AsyncClient if is_async else httpx.Client
+    return {'api_key': 'test', 'base_url': 'http://test/v1', 'http_client': client_class(transport=httpx.MockTransport(server))}
+
+
+MESSAGES = [{'role': 'user', 'content': 'hello'}]
+
+
+def test_sync_wrapper_serves_repeated_requests_from_cache(tmp_path):
+    server = _Server()
+    cache = ResponseCache(tmp_path / 'responses.sqlite')
+    engine = OpenAIWrapper(response_cache=cache, client_params=_client_params(server, False), model='test')
+
+    first = engine.chat.completions.create(messages=MESSAGES)
+    second = engine.chat.completions.create(messages=MESSAGES)
+
+    assert len(server.requests) == 1
+    assert second.choices[0].message.content == first.choices[0].message.content == 'answer 1'
+
+
+def test_async_wrapper_is_detected_and_cached(tmp_path):
+    server = _Server()
+    cache = ResponseCache(tmp_path / 'responses.sqlite')
+
+    async def run():
+        engine = AsyncOpenAIWrapper(response_cache=cache, client_params=_client_params(server, True), model='test')
+        assert engine.is_async
+        first = await engine.chat.completions.create(messages=MESSAGES)
+        second = await engine.chat.completions.create(messages=MESSAGES)
+        return first, second
+
+    first, second = asyncio.run(run())
+
+    assert len(server.requests) == 1
+    assert second.choices[0].message.content == first.choices[0].message.content == 'answer 1'
+    assert cache.cache_info()['entries'] == 1
+
+
+def test_refresh_mode_calls_the_api_and_overwrites(tmp_path):
+    server = _Server()
+    path = tmp_path / 'responses.sqlite'
+    OpenAIWrapper(response_cache=ResponseCache(path), client_params=_client_params(server, False), model='test') \
+        .chat.completions.create(messages=MESSAGES)
+
+    engine = OpenAIWrapper(response_cache=ResponseCache(path, mode='refresh'), client_params=_client_params(server, False), model='test')
+    refreshed = engine.chat.completions.create(messages=MESSAGES)
+    cached = OpenAIWrapper(response_cache=ResponseCache(path, mode='read_only'), client_params=_client_params(server, False), model='test') \
+        .chat.completions.create(messages=MESSAGES)
+
+    assert len(server.requests) == 2
+    assert refreshed.choices[0].message.content == cached.choices[0].message.content == 'answer 2'
@@ -0,0 +1,84 @@
+import gzip
+import json
+
+import pytest
+
+from railflow.base.flow import RailFlow
+from railflow.base.run import JSONLResultSink, RunManager
+
+
+class _StubFlow(RailFlow):
+    """A `RailFlow` without engine, failing the inputs in `failing`."""
+
+    def __init__(self, failing=()):
+        super().__init__()
+        self.failing = set(failing)
+        self.calls = []
+
+    def generate(self, plan, image_path, **kwargs):
+        self.calls.append(image_path)
+        if image_path in self.failing:
+            raise RuntimeError('boom')
+        return {'image_path': image_path, 'error': None}
+
+
+@pytest.mark.parametrize('compress', [False, True])
+def test_sink_rolls_shards_and_reads_records_back(tmp_path, compress):
+    with JSONLResultSink(tmp_path, shard_size=2, compress=compress) as sink:
+        for index in range(5):
+            sink.write({'image_path': f'{index}.jpg'})
+
+    assert [path.name for path in sink.shards()] == [
+        f'results-{index:05d}.jsonl' + ('.gz' if compress else '') for index in range(3)
+    ]
+    assert [record['image_path'] for record in sink.read()] == [f'{index}.jpg' for index in range(5)]
+
+
+def test_sink_never_reopens_shards_of_a_previous_run(tmp_path):
+    with JSONLResultSink(tmp_path) as sink:
+        sink.write({'image_path': 'a.jpg'})
+    with JSONLResultSink(tmp_path) as sink:
+        sink.write({'image_path': 'b.jpg'})
+
+    assert [path.name for path in sink.shards()] == ['results-00000.jsonl', 'results-00001.jsonl']
+
+
+def test_sink_skips_records_truncated_by_a_crash(tmp_path):
+    (tmp_path / 'results-00000.jsonl').write_text(
+        json.dumps({'image_path': 'a.jpg'}) + '\n' + '{"image_path": "b.j'
+    )
+    # A gzip shard cut off mid-stream keeps the records before the cut
+    lines = [json.dumps({'image_path': f'{index}.jpg', 'answer': str(index * 7919 % 10007)}) + '\n' for index in range(2000)]
+    data = gzip.compress(''.join(lines).encode('utf-8'))
+    (tmp_path / 'results-00001.jsonl.gz').write_bytes(data[:len(data) // 2])
+
+    sink = JSONLResultSink(tmp_path)
+    records = list(sink.read())
+
+    assert records[0] == {'image_path': 'a.jpg'}
+    recovered = [record['image_path'] for record in records[1:]]
+    assert 0 < len(recovered) < 2000
+    assert recovered == [f'{index}.jpg' for index in range(len(recovered))]
+    assert sink.done_set() == {'a.jpg', *recovered}
+
+
+def test_done_set_excludes_failed_records(tmp_path):
+    with JSONLResultSink(tmp_path) as sink:
+        sink.write({'image_path': 'a.jpg', 'error': None})
+        sink.write({'image_path': 'b.jpg', 'error': 'RuntimeError: boom'})
+
+    assert sink.done_set() == {'a.jpg'}
+
+
+def test_run_manager_resumes_and_retries_failures(tmp_path):
+    image_paths = [f'{index}.jpg' for index in range(4)]
+
+    first = _StubFlow(failing={'2.jpg'})
+    summary = RunManager(first, {}, JSONLResultSink(tmp_path)).run(image_paths)
+    assert (summary.skipped, summary.succeeded, summary.failed) == (0, 3, 1)
+
+    second = _StubFlow()
+    summary = RunManager(second, {}, JSONLResultSink(tmp_path)).run(image_paths)
+    assert (summary.skipped, summary.succeeded, summary.failed) == (3, 1, 0)
+    assert second.calls == ['2.jpg']
+    assert JSONLResultSink(tmp_path).done_set() == set(image_paths)
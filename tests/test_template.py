@@ -0,0 +1,36 @@
+import pytest
+
+from railflow.base.template import MIN_STATIC_PREFIX_CHARS, render_template, split_template
+
+
+PARAMS = {'subject': 'Chemistry', 'options': ['Cat', 'Dog']}
+
+
+def _source(prefix_chars:int, newline:str='\n') -> str:
+    line = 'Read the exam page carefully.'
+    lines = [line] * (prefix_chars // (len(line) + len(newline)))
+    header = newline.join(lines) + newline
+    header = header + 'x' * (prefix_chars - len(header) - len(newline)) + newline
+    assert len(header) == prefix_chars
+    return header + f'Subject: {{{{ subject }}}}{newline}{{% for option in options %}}- {{{{ option }}}}{newline}{{% endfor %}}{newline}'
+
+
+@pytest.mark.parametrize('prefix_chars', [MIN_STATIC_PREFIX_CHARS - 1, MIN_STATIC_PREFIX_CHARS, MIN_STATIC_PREFIX_CHARS + 1, 4096])
+@pytest.mark.parametrize('newline', ['\n', '\r\n'])
+def test_split_render_is_identical_to_whole_render(prefix_chars, newline):
+    source = _source(prefix_chars, newline)
+    prefix, rest = split_template(source)
+
+    assert bool(prefix) == (prefix_chars >= MIN_STATIC_PREFIX_CHARS)
+    assert prefix + render_template(rest, PARAMS) == render_template(source, PARAMS)
+
+
+def test_fully_static_template_is_split_whole():
+    source = 'Describe the image.\n' * 20
+    prefix, rest = split_template(source)
+
+    assert (prefix, rest) == (render_template(source), '')
+
+
+def test_whole_render_drops_the_trailing_newline():
+    assert render_template('Subject:\n{{ subject }}\n', PARAMS) == 'Subject:\nChemistry'
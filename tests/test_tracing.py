@@ -0,0 +1,34 @@
+from pathlib import Path
+
+from PIL import Image
+
+from inference_engine.fake import FakeEngine
+from inference_engine.limiter import RateLimiter
+from inference_engine.pool import EnginePool
+from railflow.base import RailFlow, RailFlowConfig, Tracer
+
+
+CONFIG_PATH = Path(__file__).resolve().parent.parent / 'config' / 'sample_for_exam.yml'
+
+
+def test_retries_of_pool_members_are_counted_on_engine_spans(tmp_path):
+    flows = RailFlowConfig.from_yaml(CONFIG_PATH).rails.input.flows
+    image_path = tmp_path / 'page.jpg'
+    Image.new('RGB', (32, 32)).save(image_path)
+
+    limiters = [RateLimiter(base_delay=0, max_retries=20) for _ in range(2)]
+    pool = EnginePool([
+        FakeEngine(responses={'Would this image': 'Chemistry'}, default_response='QA', rate_limit_rate=0.5, retry_after=0, seed=seed, rate_limiter=limiter)
+        for seed, limiter in enumerate(limiters)
+    ])
+    spans = []
+    rail_flow = RailFlow(pool, tracer=Tracer([spans.append]))
+
+    for _ in range(4):
+        rail_flow.generate(flows, image_path=str(image_path))
+
+    retries = sum(limiter.retries for limiter in limiters)
+    assert retries > 0
+    assert all(limiter.on_retry is None for limiter in limiters)
+    assert sum(span.retries for span in spans if span.name == 'engine') == retries
+    assert sum(span.retries for span in spans if span.parent_id is None) == retries
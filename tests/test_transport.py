@@ -0,0 +1,75 @@
+import json
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from inference_engine.openai import AsyncOpenAIWrapper, OpenAIWrapper
+from inference_engine.transport import close_http_clients, get_http_client
+
+
+class _CompletionHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers['Content-Length']))
+        body = json.dumps({
+            'id': 'chatcmpl-1', 'object': 'chat.completion', 'created': 0, 'model': 'test',
+            'choices': [{'index': 0, 'finish_reason': 'stop', 'message': {'role': 'assistant', 'content': 'hi'}}],
+        }).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def base_url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), _CompletionHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_address[1]}/v1'
+    server.shutdown()
+    close_http_clients()
+
+
+MESSAGES = [{'role': 'user', 'content': 'hello'}]
+
+
+def test_sync_clients_are_shared_process_wide(base_url):
+    first = OpenAIWrapper(client_params={'base_url': base_url, 'api_key': 'test'})
+    second = OpenAIWrapper(client_params={'base_url': base_url, 'api_key': 'test'})
+
+    assert first.base_client is second.base_client
+    assert second.chat.completions.create(model='test', messages=MESSAGES).choices[0].message.content == 'hi'
+
+
+def test_async_clients_are_shared_within_an_event_loop(base_url):
+    async def run():
+        first = AsyncOpenAIWrapper(client_params={'base_url': base_url, 'api_key': 'test'})
+        second = AsyncOpenAIWrapper(client_params={'base_url': base_url, 'api_key': 'test'})
+        return first.base_client is second.base_client
+
+    assert asyncio.run(run())
+
+
+def test_async_clients_work_across_event_loops(base_url):
+    async def run():
+        engine = AsyncOpenAIWrapper(client_params={'base_url': base_url, 'api_key': 'test'})
+        response = await engine.chat.completions.create(model='test', messages=MESSAGES)
+        return engine.base_client, response.choices[0].message.content
+
+    first_client, first = asyncio.run(run())
+    second_client, second = asyncio.run(run())
+
+    assert first == second == 'hi'
+    assert first_client is not second_client
+
+
+def test_async_clients_created_outside_a_loop_are_not_shared():
+    assert get_http_client('http://test/v1', is_async=True) is not get_http_client('http://test/v1', is_async=True)
+    assert get_http_client('http://test/v1') is get_http_client('http://test/v1')
@@ -0,0 +1,159 @@
+import time
+
+import pytest
+
+from railflow.base.work_queue import WorkQueue, select_shard, shard_of
+
+
+@pytest.fixture
+def queue(tmp_path):
+    queue = WorkQueue(tmp_path / 'queue.sqlite', lease_seconds=0.05, max_attempts=2)
+    yield queue
+    queue.close()
+
+
+def test_add_ignores_paths_already_queued(queue):
+    assert queue.add(['a.jpg', 'b.jpg']) == 2
+    assert queue.add(['b.jpg', 'c.jpg']) == 1
+    assert queue.counts() == {'pending': 3, 'leased': 0, 'done': 0, 'failed': 0}
+
+
+def test_workers_lease_disjoint_items(queue):
+    queue.add(['a.jpg', 'b.jpg', 'c.jpg'])
+
+    assert queue.lease('w1', count=2) == ['a.jpg', 'b.jpg']
+    assert queue.lease('w2', count=2) == ['c.jpg']
+    assert queue.lease('w2', count=2) == []
+
+
+def test_expired_lease_is_taken_over(queue):
+    queue.add(['a.jpg'])
+    assert queue.lease('crashed') == ['a.jpg']
+    assert queue.lease('w2') == []
+
+    time.sleep(0.1)
+    assert queue.lease('w2') == ['a.jpg']
+    # The crashed worker coming back no longer holds the item
+    assert not queue.complete('crashed', 'a.jpg')
+    assert queue.complete('w2', 'a.jpg')
+    assert queue.counts()['done'] == 1
+
+
+def test_renew_keeps_leases_and_reports_lost_ones(tmp_path):
+    queue = WorkQueue(tmp_path / 'queue.sqlite', lease_seconds=0.4)
+    queue.add(['a.jpg', 'b.jpg'])
+    assert queue.lease('w1', count=2) == ['a.jpg', 'b.jpg']
+
+    time.sleep(0.2)
+    assert queue.renew('w1', ['a.jpg']) == []
+    time.sleep(0.3)
+    # b.jpg expired and was taken over, a.jpg was renewed and is still held
+    assert queue.lease('w2', count=2) == ['b.jpg']
+    assert queue.renew('w1', ['a.jpg', 'b.jpg']) == ['b.jpg']
+    queue.close()
+
+
+def test_failed_items_are_retried_up_to_max_attempts(queue):
+    queue.add(['a.jpg'])
+
+    assert queue.lease('w1') == ['a.jpg']
+    assert queue.fail('w1', 'a.jpg', 'RuntimeError: boom')
+    assert queue.counts()['pending'] == 1
+
+    assert queue.lease('w1') == ['a.jpg']
+    assert queue.fail('w1', 'a.jpg', 'RuntimeError: boom')
+    assert queue.counts() == {'pending': 0, 'leased': 0, 'done': 0, 'failed': 1}
+    assert queue.lease('w1') == []
+
+
+def test_expired_lease_on_last_attempt_is_marked_failed(queue):
+    queue.add(['a.jpg'])
+    queue.lease('w1')
+    time.sleep(0.1)
+    queue.lease('w1')
+    time.sleep(0.1)
+
+    assert queue.lease('w1') == []
+    assert queue.counts()['failed'] == 1
+
+
+def test_queue_state_survives_reopening(tmp_path):
+    first = WorkQueue(tmp_path / 'queue.sqlite')
+    first.add(['a.jpg', 'b.jpg'])
+    first.lease('w1')
+    first.complete('w1', 'a.jpg')
+    first.close()
+
+    second = WorkQueue(tmp_path / 'queue.sqlite')
+    assert second.counts() == {'pending': 1, 'leased': 0, 'done': 1, 'failed': 0}
+    assert second.lease('w2') == ['b.jpg']
+    second.close()
+
+
+def test_shards_are_stable_and_disjoint():
+    image_paths = [f'{index}.jpg' for index in range(100)]
+    shards = [list(select_shard(image_paths, index, 3)) for index in range(3)]
+
+    assert sorted(sum(shards, [])) == sorted(image_paths)
+    assert shard_of('7.jpg', 3) == shard_of('7.jpg', 3)
+    with pytest.raises(ValueError):
+        list(select_shard(image_paths, 3, 3))
+
+
+def test_run_queue_takes_over_a_crashed_worker(tmp_path):
+    from railflow.base.flow import RailFlow
+    from railflow.base.run import JSONLResultSink, RunManager
+
+    class StubFlow(RailFlow):
+        def __init__(self):
+            super().__init__()
+            self.calls = []
+
+        def generate(self, plan, image_path, **kwargs):
+            self.calls.append(image_path)
+            if image_path == 'bad.jpg':
+                raise RuntimeError('boom')
+            return {'image_path': image_path, 'error': None}
+
+    queue = WorkQueue(tmp_path / 'queue.sqlite', lease_seconds=0.05, max_attempts=2)
+    queue.add(['a.jpg', 'b.jpg', 'bad.jpg', 'c.jpg'])
+    # A worker leased two inputs and died
+    assert queue.lease('crashed', count=2) == ['a.jpg', 'b.jpg']
+    time.sleep(0.1)
+
+    flow = StubFlow()
+    summary = RunManager(flow, {}, JSONLResultSink(tmp_path / 'results', prefix='results-w2')).run_queue(queue, 'w2')
+
+    assert sorted(flow.calls) == ['a.jpg', 'b.jpg', 'bad.jpg', 'bad.jpg', 'c.jpg']
+    assert (summary.succeeded, summary.failed) == (3, 2)
+    assert queue.counts() == {'pending': 0, 'leased': 0, 'done': 3, 'failed': 1}
+    queue.close()
+
+
+def test_arun_queue_keeps_queue_calls_off_the_event_loop(tmp_path):
+    import asyncio
+    import threading
+    from railflow.base.flow import RailFlow
+    from railflow.base.run import JSONLResultSink, RunManager
+
+    class StubFlow(RailFlow):
+        async def agenerate(self, plan, image_path, **kwargs):
+            await asyncio.sleep(0.01)
+            if image_path == 'bad.jpg':
+                raise RuntimeError('boom')
+            return {'image_path': image_path, 'error': None}
+
+    queue = WorkQueue(tmp_path / 'queue.sqlite', lease_seconds=1, max_attempts=2)
+    queue.add(['a.jpg', 'b.jpg', 'bad.jpg', 'c.jpg'])
+    threads = []
+    for name in ('lease', 'complete', 'fail'):
+        method = getattr(queue, name)
+        setattr(queue, name, lambda *args, method=method, **kwargs: threads.append(threading.get_ident()) or method(*args, **kwargs))
+
+    manager = RunManager(StubFlow(), {}, JSONLResultSink(tmp_path / 'results'))
+    summary = asyncio.run(manager.arun_queue(queue, 'w1', max_concurrency=2))
+
+    assert (summary.succeeded, summary.failed) == (3, 2)
+    assert queue.counts() == {'pending': 0, 'leased': 0, 'done': 3, 'failed': 1}
+    assert threads and threading.get_ident() not in threads
+    queue.close()